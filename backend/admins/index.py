@@ -3,12 +3,29 @@ Business: Manage administrators - list, create, update, delete admins
 Args: event with httpMethod, body, queryStringParameters; context with request_id
 Returns: HTTP response with admin data
 '''
+import hmac
 import json
 import os
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, Optional
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_connection, note_write, release_connection
+from timing import instrumented
+from pagination import parse_limit, decode_cursor, fetch_json_page
+from responses import dumps_with_fragments, json_response
+from settings import get_setting, set_setting
 
+AUTH_LOG_MAINTENANCE_SECRET = os.environ.get('AUTH_LOG_MAINTENANCE_SECRET', '')
+AUTH_LOG_RETENTION_MONTHS = int(os.environ.get('AUTH_LOG_RETENTION_MONTHS', '12'))
+AUTH_LOG_MONTHS_AHEAD = int(os.environ.get('AUTH_LOG_MONTHS_AHEAD', '2'))
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -18,7 +35,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token, X-Cron-Secret, X-Read-After',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -33,55 +50,108 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Database configuration missing'})
         }
     
-    conn = psycopg2.connect(database_url)
+    params = event.get('queryStringParameters', {}) or {}
+    if method == 'GET' and params.get('action') == 'site_status':
+        # Фронтенд спрашивает флаг на каждой загрузке страницы: ответ из кэша, без соединения из пула
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'site_enabled': get_setting('site_enabled', True)})
+        }
+    
+    # Журнал и список админов читаются с реплики, если она задана в DATABASE_READ_URL;
+    # после записи в этом экземпляре реплика используется, только когда уже проиграла её
+    headers = event.get('headers') or {}
+    read_only = method == 'GET' and params.get('action') != 'maintain_logs'
+    conn = get_connection(read_only, headers, 'admins')
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
         if method == 'GET':
-            params = event.get('queryStringParameters', {}) or {}
             action = params.get('action', 'admins')
             
-            if action == 'site_status':
-                cursor.execute(
-                    "SELECT site_enabled FROM t_p8741694_magazin_samp.admins LIMIT 1"
+            if action == 'logs':
+                limit = parse_limit(params.get('limit'))
+                
+                try:
+                    cursor_values = decode_cursor(params.get('cursor'))
+                    date_from = parse_date(params.get('date_from'))
+                    date_to = parse_date(params.get('date_to'))
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': str(e)})
+                    }
+                
+                # Фильтры по created_at отсекают лишние месячные секции ещё при планировании
+                conditions = []
+                values = []
+                for column in ('user_id', 'action', 'status'):
+                    if params.get(column):
+                        conditions.append(f'{column} = %s')
+                        values.append(params[column])
+                if date_from:
+                    conditions.append('created_at >= %s')
+                    values.append(date_from)
+                if date_to:
+                    conditions.append('created_at < %s')
+                    values.append(date_to)
+                if cursor_values:
+                    conditions.append('(created_at, id) < (%s::timestamp, %s)')
+                    values.extend(cursor_values)
+                values.append(limit + 1)
+                
+                where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+                logs_json, next_cursor = fetch_json_page(
+                    cursor,
+                    f"""SELECT id, user_id, username, action, ip_address, user_agent, status, created_at
+                        FROM t_p8741694_magazin_samp.auth_logs {where}
+                        ORDER BY created_at DESC, id DESC LIMIT %s""",
+                    values,
+                    limit
                 )
-                result = cursor.fetchone()
-                site_enabled = result['site_enabled'] if result else True
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'site_enabled': site_enabled})
-                }
+                return json_response(200, body=dumps_with_fragments(
+                    {'next_cursor': next_cursor, 'has_more': next_cursor is not None},
+                    logs=logs_json
+                ))
             
-            if action == 'logs':
-                limit = int(params.get('limit', 100))
+            if action == 'maintain_logs':
+                headers = event.get('headers') or {}
+                cron_secret = headers.get('x-cron-secret') or headers.get('X-Cron-Secret') or ''
+                # Без заданного AUTH_LOG_MAINTENANCE_SECRET обслуживание секций закрыто для всех
+                if not (AUTH_LOG_MAINTENANCE_SECRET and hmac.compare_digest(cron_secret, AUTH_LOG_MAINTENANCE_SECRET)):
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': 'Forbidden'})
+                    }
+                
                 cursor.execute(
-                    "SELECT id, user_id, username, action, ip_address, user_agent, status, created_at FROM auth_logs ORDER BY created_at DESC LIMIT %s",
-                    (limit,)
+                    "SELECT t_p8741694_magazin_samp.ensure_auth_logs_partitions(CURRENT_DATE, %s) AS created",
+                    (AUTH_LOG_MONTHS_AHEAD,)
                 )
-                logs = cursor.fetchall()
-                
-                logs_list = [
-                    {
-                        'id': log['id'],
-                        'user_id': log['user_id'],
-                        'username': log['username'],
-                        'action': log['action'],
-                        'ip_address': log['ip_address'],
-                        'user_agent': log['user_agent'],
-                        'status': log['status'],
-                        'created_at': log['created_at'].isoformat() if log['created_at'] else None
-                    }
-                    for log in logs
-                ]
+                created = cursor.fetchone()['created']
+                cursor.execute(
+                    "SELECT t_p8741694_magazin_samp.drop_auth_logs_partitions(%s) AS dropped",
+                    (AUTH_LOG_RETENTION_MONTHS,)
+                )
+                dropped = cursor.fetchone()['dropped']
+                conn.commit()
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'isBase64Encoded': False,
-                    'body': json.dumps({'logs': logs_list})
+                    'body': json.dumps({
+                        'partitions_created': created,
+                        'partitions_dropped': dropped,
+                        'retention_months': AUTH_LOG_RETENTION_MONTHS
+                    })
                 }
             
             cursor.execute(
@@ -160,13 +230,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             action = body_data.get('action')
             
             if action == 'toggle_site':
-                site_enabled = body_data.get('site_enabled', True)
-                
-                cursor.execute(
-                    "UPDATE t_p8741694_magazin_samp.admins SET site_enabled = %s",
-                    (site_enabled,)
-                )
-                conn.commit()
+                site_enabled = bool(body_data.get('site_enabled', True))
+                set_setting(conn, 'site_enabled', site_enabled)
                 
                 return {
                     'statusCode': 200,
@@ -211,7 +276,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         elif method == 'DELETE':
-            params = event.get('queryStringParameters', {}) or {}
             admin_id = params.get('id')
             
             if not admin_id:
@@ -252,4 +316,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        if not read_only:
+            note_write(conn, headers, 'admins')
+        release_connection(conn)
\ No newline at end of file
@@ -0,0 +1,93 @@
+'''
+Business: Настройки сайта из site_settings - кэш в памяти экземпляра, сбрасываемый по LISTEN/NOTIFY
+Args: SETTINGS_CACHE_TTL, SETTINGS_LISTEN_RETRY из окружения
+Returns: Значение настройки; при попадании в кэш запроса к базе нет
+'''
+
+import logging
+import os
+import threading
+import time
+from typing import Any
+import psycopg2
+from psycopg2.extras import Json
+from cache import TTLCache
+from db import CONNECT_TIMEOUT, DATABASE_URL, db_connection
+
+SETTINGS_CACHE_TTL = float(os.environ.get('SETTINGS_CACHE_TTL', '30'))
+SETTINGS_LISTEN_RETRY = float(os.environ.get('SETTINGS_LISTEN_RETRY', '10'))
+SETTINGS_CHANNEL = 'site_settings'
+SCHEMA = 't_p8741694_magazin_samp'
+
+logger = logging.getLogger('settings')
+
+_cache = TTLCache(64, SETTINGS_CACHE_TTL)
+_listener = None
+_listener_retry_at = 0.0
+_listener_lock = threading.Lock()
+_MISSING = object()
+
+def _close_listener():
+    global _listener
+    if _listener is not None and not _listener.closed:
+        _listener.close()
+    _listener = None
+
+def poll_notifications():
+    '''Разбирает уведомления, уже пришедшие в сокет слушателя; poll() не отправляет запрос в базу.
+
+    Слушатель - отдельное соединение вне пула в autocommit, LISTEN живёт, пока оно открыто.
+    Пока слушателя нет, уведомления теряются, поэтому при его (пере)подключении кэш очищается,
+    а TTL ограничивает устаревание, если подключиться не удаётся.
+    '''
+    global _listener, _listener_retry_at
+    with _listener_lock:
+        try:
+            if _listener is None or _listener.closed:
+                if time.monotonic() < _listener_retry_at:
+                    return
+                _listener_retry_at = time.monotonic() + SETTINGS_LISTEN_RETRY
+                _listener = psycopg2.connect(DATABASE_URL, connect_timeout=CONNECT_TIMEOUT)
+                _listener.autocommit = True
+                with _listener.cursor() as cursor:
+                    cursor.execute(f'LISTEN {SETTINGS_CHANNEL}')
+                _cache.clear()
+                return
+            _listener.poll()
+        except psycopg2.Error as e:
+            logger.warning('site_settings listener unavailable: %s', e)
+            _close_listener()
+            _cache.clear()
+            return
+        keys = {notify.payload for notify in _listener.notifies}
+        _listener.notifies.clear()
+    for key in keys:
+        _cache.pop(key)
+
+def get_setting(key: str, default: Any = None) -> Any:
+    '''Значение настройки; соединение из пула берётся только при промахе кэша.'''
+    poll_notifications()
+    value = _cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT value FROM {SCHEMA}.site_settings WHERE key = %s", (key,))
+            row = cursor.fetchone()
+        conn.rollback()
+    value = row[0] if row else default
+    _cache.set(key, value)
+    return value
+
+def set_setting(conn, key: str, value: Any):
+    '''Сохраняет настройку; триггер рассылает NOTIFY остальным экземплярам при COMMIT.'''
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"""INSERT INTO {SCHEMA}.site_settings (key, value, updated_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at""",
+            (key, Json(value))
+        )
+    conn.commit()
+    _cache.set(key, value)
@@ -0,0 +1,192 @@
+'''
+Business: Потоковая выгрузка orders, payments, balance_ledger и старых transactions/balance_transactions в CSV или NDJSON
+Args: соединение psycopg2, таблица, формат, date_from/date_to и файловый объект для записи
+Returns: Число выгруженных строк; данные пишутся кусками, без списка всех строк в памяти.
+Для ответа функции - export_page: порция не больше потолка и курсор продолжения
+
+Полная выгрузка без ограничения размера - из командной строки, прямо в файл:
+  DATABASE_URL=... python export.py orders --format csv --date-from 2025-01-01 --gzip > orders.csv.gz
+'''
+
+import gzip
+import io
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+SCHEMA = 't_p8741694_magazin_samp'
+EXPORT_TABLES = ('orders', 'payments', 'balance_ledger', 'transactions', 'balance_transactions')
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', '2000'))
+EXPORT_MAX_BYTES = int(os.environ.get('EXPORT_MAX_BYTES', str(3 * 1024 * 1024)))
+
+class ExportTooLarge(Exception):
+    '''Одна строка таблицы не помещается в потолок ответа.'''
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid date: {value}')
+
+def export_filters(table: str, date_from: Optional[datetime], date_to: Optional[datetime],
+                   after_id: Optional[int] = None, until_id: Optional[int] = None) -> Tuple[str, str, List[Any]]:
+    '''Таблица со схемой, WHERE и значения; окно по id - (after_id, until_id].'''
+    if table not in EXPORT_TABLES:
+        raise ValueError(f'table must be one of: {", ".join(EXPORT_TABLES)}')
+
+    conditions: List[str] = []
+    values: List[Any] = []
+    if date_from:
+        conditions.append('created_at >= %s')
+        values.append(date_from)
+    if date_to:
+        conditions.append('created_at < %s')
+        values.append(date_to)
+    if after_id is not None:
+        conditions.append('id > %s')
+        values.append(after_id)
+    if until_id is not None:
+        conditions.append('id <= %s')
+        values.append(until_id)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return f'{SCHEMA}.{table}', where, values
+
+def build_export_query(cursor, table: str, date_from: Optional[datetime], date_to: Optional[datetime],
+                       after_id: Optional[int] = None, until_id: Optional[int] = None) -> str:
+    source, where, values = export_filters(table, date_from, date_to, after_id, until_id)
+    # COPY не принимает параметры, поэтому значения подставляются через mogrify
+    query = cursor.mogrify(f'SELECT * FROM {source} {where} ORDER BY id', values)
+    return query.decode('utf-8')
+
+def window_end(cursor, table: str, after_id: Optional[int], size: int,
+               date_from: Optional[datetime], date_to: Optional[datetime]) -> Optional[int]:
+    '''id последней строки окна из size строк после after_id; None, если до конца выборки строк не больше size.'''
+    source, where, values = export_filters(table, date_from, date_to, after_id)
+    cursor.execute(f'SELECT id FROM {source} {where} ORDER BY id OFFSET %s LIMIT 1', values + [size - 1])
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def write_csv(conn, query: str, out, header: bool = True) -> int:
+    # COPY отдаёт данные кусками прямо в out; rowcount после COPY - число выгруженных строк
+    options = 'FORMAT csv, HEADER' if header else 'FORMAT csv'
+    with conn.cursor() as cursor:
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH ({options}, ENCODING 'UTF8')", out)
+        return cursor.rowcount
+
+def write_ndjson(conn, query: str, out) -> int:
+    # row_to_json в базе и именованный курсор: строки приходят пачками по EXPORT_FETCH_SIZE
+    rows = 0
+    with conn.cursor(name='export_ndjson') as cursor:
+        cursor.itersize = EXPORT_FETCH_SIZE
+        cursor.execute(f'SELECT row_to_json(t)::text FROM ({query}) t')
+        for (line,) in cursor:
+            out.write(line.encode('utf-8') + b'\n')
+            rows += 1
+    return rows
+
+def export_table(conn, table: str, fmt: str, out, date_from: Optional[datetime] = None,
+                 date_to: Optional[datetime] = None, compress: bool = False) -> int:
+    '''Пишет таблицу в out кусками; при compress поток сжимается gzip на лету.'''
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'format must be one of: {", ".join(EXPORT_FORMATS)}')
+
+    with conn.cursor() as cursor:
+        query = build_export_query(cursor, table, date_from, date_to)
+
+    target = gzip.GzipFile(fileobj=out, mode='wb') if compress else out
+    try:
+        if fmt == 'csv':
+            rows = write_csv(conn, query, target)
+        else:
+            rows = write_ndjson(conn, query, target)
+    finally:
+        conn.rollback()
+        if compress:
+            target.close()
+    return rows
+
+def export_page(conn, table: str, fmt: str, max_bytes: int, after_id: Optional[int] = None,
+                date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                compress: bool = False) -> Tuple[bytes, int, Optional[int]]:
+    '''Порция выгрузки не больше max_bytes: тело, число строк и after_id следующей порции (None - выгружено всё).
+
+    Таблица читается окнами по id, каждое окно - отдельный COPY с обеими границами,
+    так что после потолка база ничего не читает. Окно, которое не влезло, уходит в следующую порцию.
+    При compress каждое окно - отдельный член gzip: склеенные члены распаковываются как один файл.
+    '''
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'format must be one of: {", ".join(EXPORT_FORMATS)}')
+
+    body = io.BytesIO()
+    rows = 0
+    size = EXPORT_FETCH_SIZE
+    try:
+        while True:
+            with conn.cursor() as cursor:
+                until_id = window_end(cursor, table, after_id, size, date_from, date_to)
+                query = build_export_query(cursor, table, date_from, date_to, after_id, until_id)
+            chunk = io.BytesIO()
+            if fmt == 'csv':
+                count = write_csv(conn, query, chunk, header=not body.tell())
+            else:
+                count = write_ndjson(conn, query, chunk)
+            data = chunk.getvalue()
+            if compress and data:
+                data = gzip.compress(data)
+
+            if body.tell() + len(data) > max_bytes:
+                if rows:
+                    return body.getvalue(), rows, after_id
+                # Даже первое окно не влезло: сужаем его, пока не останется одна строка
+                if size == 1:
+                    raise ExportTooLarge(f'A single row exceeds {max_bytes} bytes')
+                size //= 2
+                continue
+
+            body.write(data)
+            rows += count
+            if until_id is None:
+                return body.getvalue(), rows, None
+            after_id = until_id
+    finally:
+        conn.rollback()
+
+def export_headers(table: str, fmt: str, compress: bool) -> Dict[str, str]:
+    content_type = 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/x-ndjson; charset=utf-8'
+    filename = f'{table}.{fmt}'
+    if compress:
+        content_type = 'application/gzip'
+        filename += '.gz'
+    return {
+        'Content-Type': content_type,
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'Content-Disposition, X-Export-Rows, X-Export-Cursor'
+    }
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    from db import get_connection, release_connection
+
+    parser = argparse.ArgumentParser(description='Stream a table export to stdout')
+    parser.add_argument('table', choices=EXPORT_TABLES)
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--date-from')
+    parser.add_argument('--date-to')
+    parser.add_argument('--gzip', action='store_true')
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        count = export_table(
+            conn, args.table, args.format, sys.stdout.buffer,
+            parse_date(args.date_from), parse_date(args.date_to), args.gzip
+        )
+    finally:
+        release_connection(conn)
+    sys.stderr.write(f'Exported {count} rows\n')
@@ -3,12 +3,89 @@ Business: Manage user balance operations - get balance, add funds, get transacti
 Args: event with httpMethod, body, queryStringParameters; context with request_id
 Returns: HTTP response with balance data or transaction history
 '''
+import base64
+import hmac
 import json
 import os
+from datetime import datetime, timedelta
 from typing import Dict, Any
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_connection, note_write, release_connection
+from timing import instrumented
+from export import EXPORT_MAX_BYTES, ExportTooLarge, export_headers, export_page, parse_date
+from ledger import balance_at, materialize_daily, record_entry, statement
+from pagination import parse_limit, decode_cursor, encode_cursor, fetch_json_page
+from responses import dumps_with_fragments, json_response
 
+EXPORT_SECRET = os.environ.get('EXPORT_SECRET', '')
+SNAPSHOT_SECRET = os.environ.get('SNAPSHOT_SECRET', '')
+STATEMENT_DEFAULT_DAYS = 30
+
+def handle_export(conn, params: Dict[str, Any], headers: Dict[str, Any]) -> Dict[str, Any]:
+    '''Выгрузка таблицы в ответе функции порциями до EXPORT_MAX_BYTES, полные дампы - через export.py.
+
+    Если выгружено не всё, X-Export-Cursor несёт cursor для следующей порции.
+
+    Без заданного EXPORT_SECRET выгрузка закрыта: в ней заказы, платежи и журнал баланса всех пользователей.
+    '''
+    export_secret = headers.get('x-export-secret') or headers.get('X-Export-Secret') or ''
+    if not (EXPORT_SECRET and hmac.compare_digest(export_secret, EXPORT_SECRET)):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Forbidden'})
+        }
+    
+    table = params.get('table', '')
+    fmt = params.get('format', 'csv')
+    compress = params.get('gzip') in ('1', 'true')
+    
+    try:
+        cursor_values = decode_cursor(params.get('cursor'), 1)
+        after_id = cursor_values[0] if cursor_values else None
+        if after_id is not None and (isinstance(after_id, bool) or not isinstance(after_id, int)):
+            raise ValueError('Invalid cursor')
+        body, rows, next_id = export_page(
+            conn, table, fmt, EXPORT_MAX_BYTES, after_id,
+            parse_date(params.get('date_from')), parse_date(params.get('date_to')), compress
+        )
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e)})
+        }
+    except ExportTooLarge:
+        return {
+            'statusCode': 413,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'A single row exceeds the export size limit, use export.py'})
+        }
+    
+    response_headers = export_headers(table, fmt, compress)
+    response_headers['X-Export-Rows'] = str(rows)
+    if next_id is not None:
+        response_headers['X-Export-Cursor'] = encode_cursor(next_id)
+    
+    if compress:
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'isBase64Encoded': True,
+            'body': base64.b64encode(body).decode('ascii')
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': response_headers,
+        'isBase64Encoded': False,
+        'body': body.decode('utf-8')
+    }
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -18,7 +95,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Export-Secret, X-Cron-Secret, X-Read-After',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -33,7 +110,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Database configuration missing'})
         }
     
-    conn = psycopg2.connect(database_url)
+    # Баланс, история, выписка и выгрузка читаются с реплики, если она задана в DATABASE_READ_URL.
+    # Фронтенд не шлёт X-Session-Token: чтение после пополнения привязывается к пользователю
+    headers = event.get('headers') or {}
+    params = event.get('queryStringParameters', {}) or {}
+    read_only = method == 'GET' and params.get('action') != 'materialize_snapshots'
+    sticky_key = f"user:{params['user_id']}" if params.get('user_id') else None
+    conn = get_connection(read_only, headers, sticky_key)
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
@@ -42,6 +125,28 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             user_id = params.get('user_id')
             action = params.get('action', 'balance')
             
+            if action == 'export':
+                return handle_export(conn, params, event.get('headers') or {})
+            
+            if action == 'materialize_snapshots':
+                headers = event.get('headers') or {}
+                cron_secret = headers.get('x-cron-secret') or headers.get('X-Cron-Secret') or ''
+                # Без заданного SNAPSHOT_SECRET пересчёт снимков закрыт для всех
+                if not (SNAPSHOT_SECRET and hmac.compare_digest(cron_secret, SNAPSHOT_SECRET)):
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': 'Forbidden'})
+                    }
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps(materialize_daily(conn))
+                }
+            
             if not user_id:
                 return {
                     'statusCode': 400,
@@ -62,46 +167,94 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'User not found'})
                     }
                 
+                response = {
+                    'user_id': user['id'],
+                    'username': user['username'],
+                    'balance': float(user['balance'])
+                }
+                
+                if params.get('at'):
+                    try:
+                        at = parse_date(params['at'])
+                    except ValueError as e:
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'isBase64Encoded': False,
+                            'body': json.dumps({'error': str(e)})
+                        }
+                    response['at'] = at.isoformat()
+                    response['balance_at'] = float(balance_at(cursor, user_id, at))
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'isBase64Encoded': False,
-                    'body': json.dumps({
-                        'user_id': user['id'],
-                        'username': user['username'],
-                        'balance': float(user['balance'])
-                    })
+                    'body': json.dumps(response)
                 }
             
             elif action == 'transactions':
-                cursor.execute(
-                    "SELECT id, amount, type, description, created_at FROM transactions WHERE user_id = %s ORDER BY created_at DESC LIMIT 50",
-                    (user_id,)
+                limit = parse_limit(params.get('limit'), 50)
+                
+                try:
+                    cursor_values = decode_cursor(params.get('cursor'))
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': 'Invalid cursor'})
+                    }
+                
+                conditions = ['user_id = %s']
+                values = [user_id]
+                if cursor_values:
+                    conditions.append('(created_at, id) < (%s::timestamp, %s)')
+                    values.extend(cursor_values)
+                values.append(limit + 1)
+                
+                # amount и balance_after - NUMERIC, json_agg пишет их числами, как раньше float()
+                transactions_json, next_cursor = fetch_json_page(
+                    cursor,
+                    f"""SELECT id, amount, balance_after, type, description, created_at FROM balance_ledger
+                        WHERE {' AND '.join(conditions)}
+                        ORDER BY created_at DESC, id DESC LIMIT %s""",
+                    values,
+                    limit
                 )
-                transactions = cursor.fetchall()
                 
-                transactions_list = [
-                    {
-                        'id': t['id'],
-                        'amount': float(t['amount']),
-                        'type': t['type'],
-                        'description': t['description'],
-                        'created_at': t['created_at'].isoformat() if t['created_at'] else None
+                return json_response(200, body=dumps_with_fragments(
+                    {'next_cursor': next_cursor, 'has_more': next_cursor is not None},
+                    transactions=transactions_json
+                ))
+            
+            elif action == 'statement':
+                try:
+                    date_to = parse_date(params.get('date_to')) or datetime.now()
+                    date_from = parse_date(params.get('date_from')) or date_to - timedelta(days=STATEMENT_DEFAULT_DAYS)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': str(e)})
                     }
-                    for t in transactions
-                ]
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'transactions': transactions_list})
-                }
+                if date_from > date_to:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': 'date_from must not be after date_to'})
+                    }
+                
+                return json_response(200, statement(cursor, user_id, date_from.date(), date_to.date()))
         
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             user_id = body_data.get('user_id')
             amount = body_data.get('amount')
+            sticky_key = f'user:{user_id}' if user_id else None
             description = body_data.get('description', 'Пополнение баланса')
             
             if not user_id or amount is None:
@@ -132,11 +285,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'User not found'})
                 }
             
-            cursor.execute(
-                "INSERT INTO transactions (user_id, amount, type, description) VALUES (%s, %s, %s, %s) RETURNING id",
-                (user_id, amount, 'deposit', description)
-            )
-            transaction_id = cursor.fetchone()['id']
+            transaction_id = record_entry(cursor, user_id, amount, result['balance'], 'deposit', description)
             
             conn.commit()
             
@@ -160,4 +309,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
+        if not read_only:
+            note_write(conn, headers, sticky_key)
+        release_connection(conn)
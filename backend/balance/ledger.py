@@ -0,0 +1,141 @@
+'''
+Business: Единый журнал операций с балансом - запись операции, баланс на момент времени, дневные снимки и выписка
+Args: курсор в транзакции, где баланс пользователя уже изменён через UPDATE users ... RETURNING balance
+Returns: Записи balance_ledger с остатком после операции и агрегаты balance_daily
+'''
+
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+SCHEMA = 't_p8741694_magazin_samp'
+
+def record_entry(cursor, user_id: Any, amount: Any, balance_after: Any, entry_type: str,
+                 description: Optional[str] = None) -> int:
+    '''Пишет операцию в журнал.
+
+    Вызывается в той же транзакции, что и UPDATE users: блокировка строки пользователя
+    упорядочивает записи, и balance_after всегда совпадает с балансом после операции.
+    '''
+    cursor.execute(
+        f"""INSERT INTO {SCHEMA}.balance_ledger (user_id, amount, balance_after, type, description)
+            VALUES (%s, %s, %s, %s, %s) RETURNING id""",
+        (user_id, amount, balance_after, entry_type, description)
+    )
+    return cursor.fetchone()['id']
+
+def balance_at(cursor, user_id: Any, at: datetime) -> Decimal:
+    '''Баланс на момент at - остаток последней операции до него, одна строка по индексу.'''
+    cursor.execute(
+        f"""SELECT balance_after FROM {SCHEMA}.balance_ledger
+            WHERE user_id = %s AND created_at < %s
+            ORDER BY created_at DESC, id DESC LIMIT 1""",
+        (user_id, at)
+    )
+    row = cursor.fetchone()
+    return row['balance_after'] if row else Decimal('0')
+
+DAILY_AGGREGATE = f"""
+    SELECT user_id, created_at::date AS day,
+           COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0) AS credits,
+           COALESCE(-SUM(amount) FILTER (WHERE amount < 0), 0) AS debits,
+           COUNT(*) AS entries,
+           (ARRAY_AGG(balance_after ORDER BY created_at DESC, id DESC))[1] AS closing_balance
+    FROM {SCHEMA}.balance_ledger
+    WHERE {{where}}
+    GROUP BY user_id, created_at::date
+"""
+
+def materialize_daily(conn) -> Dict[str, Any]:
+    '''Достраивает balance_daily по завершённым дням после последнего снимка.'''
+    from psycopg2.extras import RealDictCursor
+
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        # FOR UPDATE сериализует параллельные запуски задания; «вчера» берётся по часам базы,
+        # в которых записан created_at
+        cursor.execute(
+            f"""SELECT materialized_through, CURRENT_DATE - 1 AS until
+                FROM {SCHEMA}.balance_snapshot_state WHERE id = 1 FOR UPDATE"""
+        )
+        row = cursor.fetchone()
+        through = row['materialized_through']
+        until = row['until']
+
+        if through is not None and through >= until:
+            conn.rollback()
+            return {'materialized_from': None, 'materialized_through': through.isoformat(), 'days': 0}
+
+        start = through + timedelta(days=1) if through else None
+        where = 'created_at >= %s AND created_at < %s' if start else 'created_at < %s'
+        values = (start, until + timedelta(days=1)) if start else (until + timedelta(days=1),)
+        cursor.execute(
+            f"""INSERT INTO {SCHEMA}.balance_daily (user_id, day, credits, debits, entries, closing_balance)
+                {DAILY_AGGREGATE.format(where=where)}
+                ON CONFLICT (user_id, day) DO UPDATE
+                SET credits = EXCLUDED.credits, debits = EXCLUDED.debits,
+                    entries = EXCLUDED.entries, closing_balance = EXCLUDED.closing_balance""",
+            values
+        )
+        days = cursor.rowcount
+        cursor.execute(
+            f"""INSERT INTO {SCHEMA}.balance_snapshot_state (id, materialized_through, updated_at)
+                VALUES (1, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (id) DO UPDATE
+                SET materialized_through = EXCLUDED.materialized_through, updated_at = EXCLUDED.updated_at""",
+            (until,)
+        )
+    conn.commit()
+    return {
+        'materialized_from': start.isoformat() if start else None,
+        'materialized_through': until.isoformat(),
+        'days': days
+    }
+
+def statement(cursor, user_id: Any, date_from: date, date_to: date) -> Dict[str, Any]:
+    '''Выписка за дни [date_from, date_to]: снимки balance_daily плюс ещё не материализованный хвост журнала.'''
+    cursor.execute(f"SELECT materialized_through FROM {SCHEMA}.balance_snapshot_state WHERE id = 1")
+    row = cursor.fetchone()
+    through = row['materialized_through'] if row else None
+
+    days: List[Dict[str, Any]] = []
+    if through is not None and through >= date_from:
+        cursor.execute(
+            f"""SELECT day, credits, debits, entries, closing_balance
+                FROM {SCHEMA}.balance_daily
+                WHERE user_id = %s AND day >= %s AND day <= %s
+                ORDER BY day""",
+            (user_id, date_from, min(date_to, through))
+        )
+        days.extend(dict(r) for r in cursor.fetchall())
+
+    live_from = max(date_from, through + timedelta(days=1)) if through else date_from
+    if live_from <= date_to:
+        cursor.execute(
+            f"""SELECT day, credits, debits, entries, closing_balance FROM (
+                    {DAILY_AGGREGATE.format(where='user_id = %s AND created_at >= %s AND created_at < %s')}
+                ) live ORDER BY day""",
+            (user_id, live_from, date_to + timedelta(days=1))
+        )
+        days.extend(dict(r) for r in cursor.fetchall())
+
+    opening = balance_at(cursor, user_id, datetime.combine(date_from, time.min))
+    return {
+        'user_id': user_id,
+        'date_from': date_from.isoformat(),
+        'date_to': date_to.isoformat(),
+        'opening_balance': opening,
+        'closing_balance': days[-1]['closing_balance'] if days else opening,
+        'credits': sum((d['credits'] for d in days), Decimal('0')),
+        'debits': sum((d['debits'] for d in days), Decimal('0')),
+        'days': [dict(d, day=d['day'].isoformat()) for d in days]
+    }
+
+if __name__ == '__main__':
+    import json
+    from db import get_connection, release_connection
+
+    conn = get_connection()
+    try:
+        print(json.dumps(materialize_daily(conn)))
+    finally:
+        release_connection(conn)
@@ -0,0 +1,65 @@
+'''
+Business: Keyset-пагинация для списков, отсортированных по (created_at, id)
+Args: limit и cursor из queryStringParameters
+Returns: Страницу строк (или готовый JSON из json_agg) и непрозрачный курсор следующей страницы
+'''
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Tuple
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+def parse_limit(value: Any, default: int = DEFAULT_LIMIT, maximum: int = MAX_LIMIT) -> int:
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, maximum))
+
+def encode_cursor(*values: Any) -> str:
+    payload = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], default=str)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: Optional[str], size: int = 2) -> Optional[List[Any]]:
+    if not cursor:
+        return None
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, binascii.Error):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+    return values
+
+def build_page(rows: List[Any], limit: int, key: Callable[[Any], Tuple]) -> Tuple[List[Any], Optional[str]]:
+    '''Строки запрашиваются с LIMIT limit + 1: лишняя строка означает, что есть следующая страница.'''
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+def fetch_json_page(cursor, query: str, values: List[Any], limit: int) -> Tuple[str, Optional[str]]:
+    '''Страница, собранная в JSON самой базой через json_agg: строки не разбираются в Python и не сериализуются заново.
+
+    query - выборка с ORDER BY created_at DESC, id DESC LIMIT limit + 1, значения её параметров - в values.
+    Возвращает JSON-массив строкой и курсор следующей страницы.
+    '''
+    cursor.execute(
+        f'''WITH fetched AS ({query}),
+                 page AS (SELECT * FROM fetched ORDER BY created_at DESC, id DESC LIMIT %s)
+            SELECT (SELECT COALESCE(json_agg(page ORDER BY created_at DESC, id DESC), '[]'::json)::text
+                    FROM page) AS page_json,
+                   (SELECT count(*) FROM fetched) AS fetched,
+                   last_row.created_at, last_row.id
+            FROM (SELECT 1) single
+            LEFT JOIN LATERAL (SELECT created_at, id FROM page ORDER BY created_at, id LIMIT 1) last_row ON true''',
+        list(values) + [limit]
+    )
+    row = cursor.fetchone()
+    next_cursor = encode_cursor(row['created_at'], row['id']) if row['fetched'] > limit else None
+    return row['page_json'], next_cursor
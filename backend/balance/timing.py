@@ -0,0 +1,165 @@
+'''
+Business: Инструментирование запросов - время в БД и во внешних HTTP-вызовах, журнал медленных запросов
+Args: SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN, SLOW_REQUEST_MS из окружения
+Returns: Заголовок Server-Timing в ответе каждого обработчика, обёрнутого instrumented
+'''
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', '1') == '1'
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1000'))
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+
+logger = logging.getLogger('timing')
+_local = threading.local()
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_ms = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.http_ms = 0.0
+        self.http_calls = 0
+        self.spans: Dict[str, float] = {}
+        # LSN записи этого запроса, см. db.note_write
+        self.read_after: Optional[str] = None
+
+    def add_span(self, name: str, elapsed_ms: float):
+        self.spans[name] = self.spans.get(name, 0.0) + elapsed_ms
+
+    def summary(self) -> Dict[str, Any]:
+        total_ms = (time.perf_counter() - self.started) * 1000
+        spans_ms = sum(self.spans.values())
+        return {
+            'total_ms': round(total_ms, 2),
+            'db_ms': round(self.db_ms, 2),
+            'queries': self.queries,
+            'rows': self.rows,
+            'http_ms': round(self.http_ms, 2),
+            'http_calls': self.http_calls,
+            'spans': {name: round(ms, 2) for name, ms in self.spans.items()},
+            'app_ms': round(max(0.0, total_ms - self.db_ms - self.http_ms - spans_ms), 2),
+        }
+
+    def server_timing(self) -> str:
+        summary = self.summary()
+        entries = [
+            f'db;dur={summary["db_ms"]};desc="{self.queries} queries, {self.rows} rows"',
+            f'http;dur={summary["http_ms"]};desc="{self.http_calls} calls"',
+        ]
+        entries.extend(f'{name};dur={ms}' for name, ms in summary['spans'].items())
+        entries.append(f'app;dur={summary["app_ms"]}')
+        entries.append(f'total;dur={summary["total_ms"]}')
+        return ', '.join(entries)
+
+def current_stats() -> Optional[RequestStats]:
+    return getattr(_local, 'stats', None)
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current_stats()
+        if stats is not None:
+            stats.add_span(name, (time.perf_counter() - started) * 1000)
+
+def _log_slow_query(cursor, query: Any, vars: Any, elapsed_ms: float):
+    text = query.decode('utf-8', 'replace') if isinstance(query, bytes) else str(query)
+    record = {'slow_query_ms': round(elapsed_ms, 2), 'query': ' '.join(text.split()), 'rows': cursor.rowcount}
+
+    if SLOW_QUERY_EXPLAIN and not cursor.name and text.lstrip().upper().startswith(EXPLAINABLE):
+        from psycopg2 import extensions
+        explain_cursor = extensions.connection.cursor(cursor.connection, cursor_factory=extensions.cursor)
+        try:
+            explain_cursor.execute(b'EXPLAIN ' + cursor.mogrify(query, vars))
+            record['plan'] = [row[0] for row in explain_cursor.fetchall()]
+        except Exception as e:
+            record['plan_error'] = str(e)
+        finally:
+            explain_cursor.close()
+
+    logger.warning(json.dumps(record, ensure_ascii=False))
+
+def _record_query(cursor, query: Any, vars: Any, started: float):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stats = current_stats()
+    if stats is not None:
+        stats.db_ms += elapsed_ms
+        stats.queries += 1
+        stats.rows += max(cursor.rowcount, 0)
+    if elapsed_ms >= SLOW_QUERY_MS:
+        _log_slow_query(cursor, query, vars, elapsed_ms)
+
+_cursor_classes: Dict[type, type] = {}
+
+def instrumented_cursor_class(base: type) -> type:
+    '''Подкласс курсора, который замеряет execute; кэшируется для каждой cursor_factory.'''
+    cls = _cursor_classes.get(base)
+    if cls is None:
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            result = base.execute(self, query, vars)
+            _record_query(self, query, vars, started)
+            return result
+
+        def copy_expert(self, sql, file, size=8192):
+            started = time.perf_counter()
+            result = base.copy_expert(self, sql, file, size)
+            _record_query(self, sql, None, started)
+            return result
+
+        cls = type(f'Instrumented{base.__name__}', (base,), {'execute': execute, 'copy_expert': copy_expert})
+        _cursor_classes[base] = cls
+    return cls
+
+def urlopen(request, *args, **kwargs):
+    import urllib.request
+
+    started = time.perf_counter()
+    try:
+        return urllib.request.urlopen(request, *args, **kwargs)
+    finally:
+        stats = current_stats()
+        if stats is not None:
+            stats.http_ms += (time.perf_counter() - started) * 1000
+            stats.http_calls += 1
+
+def instrumented(handler: Callable) -> Callable:
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        stats = RequestStats()
+        _local.stats = stats
+        try:
+            response = handler(event, context)
+        finally:
+            _local.stats = None
+
+        if isinstance(response, dict):
+            headers = response.setdefault('headers', {})
+            headers['Server-Timing'] = stats.server_timing()
+            headers['Timing-Allow-Origin'] = '*'
+            if stats.read_after:
+                headers['X-Read-After'] = stats.read_after
+                exposed = headers.get('Access-Control-Expose-Headers')
+                headers['Access-Control-Expose-Headers'] = f'{exposed}, X-Read-After' if exposed else 'X-Read-After'
+
+        summary = stats.summary()
+        if summary['total_ms'] >= SLOW_REQUEST_MS:
+            logger.warning(json.dumps({
+                'slow_request': getattr(context, 'function_name', None),
+                'method': event.get('httpMethod'),
+                'timing': summary
+            }, ensure_ascii=False))
+        return response
+    return wrapper
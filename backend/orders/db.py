@@ -0,0 +1,253 @@
+'''
+Business: Общий пул соединений с PostgreSQL, который переживает тёплые вызовы функции, и маршрутизация чтения на реплику
+Args: DATABASE_URL, DATABASE_READ_URL, DB_POOL_MIN, DB_POOL_MAX, DB_READ_STICKY_SECONDS из окружения
+Returns: Проверенные соединения psycopg2 для обработчиков
+'''
+
+import logging
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+import psycopg2
+from psycopg2 import extensions, pool
+from timing import current_stats, instrumented_cursor_class
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL', '')
+POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '5'))
+READ_STICKY_SECONDS = float(os.environ.get('DB_READ_STICKY_SECONDS', '30'))
+READ_RETRY_SECONDS = float(os.environ.get('DB_READ_RETRY_SECONDS', '30'))
+READ_AFTER_HEADER = 'X-Read-After'
+PRIMARY = 'primary'
+REPLICA = 'replica'
+LSN_PATTERN = re.compile(r'^[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}$')
+
+logger = logging.getLogger('db')
+
+class InstrumentedConnection(extensions.connection):
+    '''Соединение для пула: любой курсор, включая RealDictCursor из обработчиков, получает замеры.
+
+    prepared_statements - запросы, подготовленные через statements.execute_prepared на этом соединении,
+    role - пул, из которого соединение взято (primary или replica).
+    '''
+
+    role = PRIMARY
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements: Dict[str, str] = {}
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+_pools: Dict[str, pool.ThreadedConnectionPool] = {}
+_pool_lock = threading.Lock()
+# Ключ сессии -> (LSN последней записи, до какого момента читать с учётом этой записи)
+_write_marks: Dict[str, Tuple[int, float]] = {}
+_replica_down_until = 0.0
+
+def get_pool(role: str = PRIMARY) -> pool.ThreadedConnectionPool:
+    conn_pool = _pools.get(role)
+    if conn_pool is None or conn_pool.closed:
+        with _pool_lock:
+            conn_pool = _pools.get(role)
+            if conn_pool is None or conn_pool.closed:
+                conn_pool = pool.ThreadedConnectionPool(
+                    POOL_MIN, POOL_MAX, DATABASE_READ_URL if role == REPLICA else DATABASE_URL,
+                    connect_timeout=CONNECT_TIMEOUT, connection_factory=InstrumentedConnection
+                )
+                _pools[role] = conn_pool
+    return conn_pool
+
+def reset_pool(role: str = PRIMARY):
+    with _pool_lock:
+        conn_pool = _pools.pop(role, None)
+        if conn_pool is not None and not conn_pool.closed:
+            conn_pool.closeall()
+
+def _is_healthy(conn) -> bool:
+    '''Пинг при каждой выдаче: соединение, оборванное сервером или прокси, не доходит до обработчика.
+
+    В autocommit SELECT 1 уходит без BEGIN и ROLLBACK - один обмен с сервером.
+    '''
+    if conn.closed:
+        return False
+    if conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.autocommit = False
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+def _checkout(role: str):
+    for _ in range(POOL_MAX + 1):
+        conn_pool = get_pool(role)
+        try:
+            conn = conn_pool.getconn()
+        except psycopg2.OperationalError:
+            reset_pool(role)
+            raise
+        if _is_healthy(conn):
+            conn.role = role
+            return conn
+        conn_pool.putconn(conn, close=True)
+    reset_pool(role)
+    conn = get_pool(role).getconn()
+    conn.role = role
+    return conn
+
+def _header(headers: Optional[Dict[str, Any]], name: str) -> Optional[str]:
+    lowered = name.lower()
+    for key, value in (headers or {}).items():
+        if key.lower() == lowered:
+            return value
+    return None
+
+def parse_lsn(value: Optional[str]) -> Optional[int]:
+    '''LSN вида 16/B374D848 числом; None для пустого или неверного значения.'''
+    if not value or not LSN_PATTERN.match(value.strip()):
+        return None
+    high, low = value.strip().split('/')
+    return (int(high, 16) << 32) | int(low, 16)
+
+def format_lsn(value: int) -> str:
+    return f'{value >> 32:X}/{value & 0xFFFFFFFF:X}'
+
+def _session_key(headers: Optional[Dict[str, Any]], key: Optional[str]) -> Optional[str]:
+    return key or _header(headers, 'X-Session-Token')
+
+def _required_lsn(headers: Optional[Dict[str, Any]], key: Optional[str]) -> Optional[int]:
+    '''LSN, который реплика должна проиграть: из заголовка клиента или из записи этой сессии в экземпляре.'''
+    required = parse_lsn(_header(headers, READ_AFTER_HEADER))
+    key = _session_key(headers, key)
+    mark = _write_marks.get(key) if key else None
+    if mark is not None:
+        if mark[1] > time.monotonic():
+            required = max(required or 0, mark[0])
+        else:
+            _write_marks.pop(key, None)
+    return required
+
+def _replica_has(conn, lsn: int) -> bool:
+    with conn.cursor() as cur:
+        # Вне восстановления (DATABASE_READ_URL указывает на основной сервер) pg_last_wal_replay_lsn() - NULL
+        cur.execute(
+            'SELECT COALESCE(pg_last_wal_replay_lsn(), pg_current_wal_lsn()) >= %s::pg_lsn',
+            (format_lsn(lsn),)
+        )
+        caught_up = cur.fetchone()[0]
+    conn.rollback()
+    return caught_up
+
+def _discard(conn):
+    '''Закрывает соединение и освобождает его слот в пуле.'''
+    conn_pool = _pools.get(getattr(conn, 'role', PRIMARY))
+    try:
+        if conn_pool is not None and not conn_pool.closed:
+            conn_pool.putconn(conn, close=True)
+            return
+    except pool.PoolError:
+        pass
+    if not conn.closed:
+        conn.close()
+
+def get_connection(read_only: bool = False, headers: Optional[Dict[str, Any]] = None, key: Optional[str] = None):
+    '''Берёт соединение из пула; мёртвые соединения выбрасываются и заменяются новыми.
+
+    read_only - путь только читает: при заданном DATABASE_READ_URL соединение берётся с реплики.
+    Если клиент недавно писал (X-Read-After от ответа на запись или запись той же сессии в
+    экземпляре), реплика используется, только когда уже проиграла эту запись, иначе - основной сервер.
+    key - ключ сессии для обработчиков без X-Session-Token, например пользователь из параметров.
+    Недоступная реплика на DB_READ_RETRY_SECONDS уступает чтение основному серверу.
+    '''
+    global _replica_down_until
+    if not (read_only and DATABASE_READ_URL) or time.monotonic() < _replica_down_until:
+        return _checkout(PRIMARY)
+
+    required = _required_lsn(headers, key)
+    conn = None
+    try:
+        conn = _checkout(REPLICA)
+        caught_up = required is None or _replica_has(conn, required)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError) as e:
+        # Соединение, на котором упала проверка, закрывается, иначе каждый сбой занимает слот пула
+        if conn is not None:
+            _discard(conn)
+        logger.warning('read replica unavailable, reading from primary: %s', e)
+        _replica_down_until = time.monotonic() + READ_RETRY_SECONDS
+        return _checkout(PRIMARY)
+    if caught_up:
+        return conn
+    release_connection(conn)
+    return _checkout(PRIMARY)
+
+def note_write(conn, headers: Optional[Dict[str, Any]] = None, key: Optional[str] = None) -> Optional[str]:
+    '''После записи на основном сервере запоминает её LSN для read-your-writes.
+
+    LSN уходит клиенту заголовком X-Read-After (его добавляет timing.instrumented) и
+    запоминается для X-Session-Token на DB_READ_STICKY_SECONDS. Вызывается перед возвратом
+    соединения: незакоммиченное откатывается, как и в release_connection. Без реплики ничего не делает.
+    '''
+    if not DATABASE_READ_URL or getattr(conn, 'role', PRIMARY) != PRIMARY or conn.closed:
+        return None
+    try:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_current_wal_lsn()::text')
+            lsn = cur.fetchone()[0]
+        conn.rollback()
+    except psycopg2.Error as e:
+        # Без отметки чтение этой сессии может отстать на лаг реплики, но ответ записи не теряется
+        logger.warning('write LSN unavailable: %s', e)
+        return None
+
+    key = _session_key(headers, key)
+    if key:
+        if len(_write_marks) > 10000:
+            now = time.monotonic()
+            for stale in [k for k, (_, until) in _write_marks.items() if until <= now]:
+                _write_marks.pop(stale, None)
+        _write_marks[key] = (parse_lsn(lsn), time.monotonic() + READ_STICKY_SECONDS)
+    stats = current_stats()
+    if stats is not None:
+        stats.read_after = lsn
+    return lsn
+
+def release_connection(conn):
+    '''Возвращает соединение в его пул, откатывая незавершённую транзакцию.'''
+    conn_pool = _pools.get(getattr(conn, 'role', PRIMARY))
+    broken = conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN
+    if not broken and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+    if conn_pool is None or conn_pool.closed:
+        if not conn.closed:
+            conn.close()
+        return
+    try:
+        conn_pool.putconn(conn, close=broken)
+    except pool.PoolError:
+        if not conn.closed:
+            conn.close()
+
+@contextmanager
+def db_connection(read_only: bool = False, headers: Optional[Dict[str, Any]] = None,
+                  key: Optional[str] = None) -> Iterator:
+    conn = get_connection(read_only, headers, key)
+    try:
+        yield conn
+    finally:
+        release_connection(conn)
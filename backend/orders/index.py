@@ -6,15 +6,136 @@ Returns: HTTP response dict с заказами из базы данных
 """
 
 import json
-import os
-from typing import Dict, Any
-import psycopg2
+from datetime import datetime
+from typing import Dict, Any, List, Tuple
 from psycopg2.extras import RealDictCursor
+from db import get_connection, note_write, release_connection
+from timing import instrumented
+from pagination import parse_limit, decode_cursor, fetch_json_page
+from responses import dumps_with_fragments, json_response
+from statements import execute_prepared, prepared_statement
 
-def get_db_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+MAX_BULK_IDS = 10000
+MAX_ORDER_ID = 2147483647  # orders.id - SERIAL (int4)
+PENDING_STATUS = 'В обработке'
 
+ORDER_INSERT = prepared_statement(
+    'order_insert',
+    "INSERT INTO orders (customer_name, customer_email, items, total_price, status) VALUES (%s, %s, %s, %s, %s) RETURNING *"
+)
+
+ORDER_STATS = prepared_statement(
+    'order_stats',
+    """SELECT COUNT(*) AS total_orders,
+              COALESCE(SUM(total_price), 0) AS total_revenue,
+              COUNT(*) FILTER (WHERE status = %s) AS pending_orders
+       FROM orders"""
+)
+
+def parse_date(value: Any) -> datetime:
+    '''Дата фильтра в формате ISO 8601; ValueError для всего остального.'''
+    if not isinstance(value, str):
+        raise ValueError(f'Invalid date: {value!r}')
+    return datetime.fromisoformat(value.strip())
+
+def build_order_filters(filters: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    '''Условия по status, date_from и date_to; неверная дата - ValueError, а не DataError из базы.'''
+    conditions = []
+    values = []
+    
+    if filters.get('status'):
+        conditions.append('status = %s')
+        values.append(filters['status'])
+    if filters.get('date_from'):
+        conditions.append('created_at >= %s')
+        values.append(parse_date(filters['date_from']))
+    if filters.get('date_to'):
+        conditions.append('created_at < %s')
+        values.append(parse_date(filters['date_to']))
+    
+    return conditions, values
+
+def bulk_update_status(cur, conn, body_data: Dict[str, Any]) -> Dict[str, Any]:
+    '''Меняет статус списку заказов (ids) или всем заказам под фильтром (filter) одним UPDATE.'''
+    status = body_data.get('status')
+    ids = body_data.get('ids')
+    filters = body_data.get('filter')
+    
+    error = None
+    try:
+        has_filter = isinstance(filters, dict) and bool(build_order_filters(filters)[0])
+    except ValueError:
+        has_filter = False
+    if not status:
+        error = 'status is required'
+    elif ids is not None:
+        if not isinstance(ids, list) or not all(
+            isinstance(i, int) and not isinstance(i, bool) and 1 <= i <= MAX_ORDER_ID for i in ids
+        ):
+            error = f'ids must be a list of integers from 1 to {MAX_ORDER_ID}'
+        elif len(ids) > MAX_BULK_IDS:
+            error = f'At most {MAX_BULK_IDS} ids per request'
+    elif not has_filter:
+        error = 'filter must contain status, date_from or date_to (ISO 8601 dates)'
+    
+    if error:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': error}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    
+    if ids is not None:
+        ids = list(dict.fromkeys(ids))
+        cur.execute(
+            '''UPDATE orders SET status = %s, updated_at = CURRENT_TIMESTAMP
+               WHERE id = ANY(%s::int[]) AND status IS DISTINCT FROM %s
+               RETURNING id''',
+            (status, ids, status)
+        )
+        updated = {row['id'] for row in cur.fetchall()}
+        
+        rest = [i for i in ids if i not in updated]
+        existing = set()
+        if rest:
+            cur.execute('SELECT id FROM orders WHERE id = ANY(%s::int[])', (rest,))
+            existing = {row['id'] for row in cur.fetchall()}
+        
+        results = [
+            {'id': i, 'result': 'updated' if i in updated else 'unchanged' if i in existing else 'not_found'}
+            for i in ids
+        ]
+    else:
+        conditions, values = build_order_filters(filters)
+        cur.execute(
+            f'''UPDATE orders SET status = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE {' AND '.join(conditions)} AND status IS DISTINCT FROM %s
+                RETURNING id''',
+            [status] + values + [status]
+        )
+        results = [{'id': row['id'], 'result': 'updated'} for row in cur.fetchall()]
+    
+    conn.commit()
+    
+    summary = {'updated': 0, 'unchanged': 0, 'not_found': 0}
+    for item in results:
+        summary[item['result']] += 1
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({'status': status, 'summary': summary, 'results': results}, ensure_ascii=False),
+        'isBase64Encoded': False
+    }
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -24,30 +145,71 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Auth',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Auth, X-Read-After',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    # Список заказов читается с реплики, если она задана в DATABASE_READ_URL;
+    # после записи в этом экземпляре реплика используется, только когда уже проиграла её
+    headers = event.get('headers') or {}
+    read_only = method == 'GET'
+    conn = get_connection(read_only, headers, 'orders')
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
         if method == 'GET':
-            cur.execute('SELECT * FROM orders ORDER BY created_at DESC')
-            orders = cur.fetchall()
+            params = event.get('queryStringParameters') or {}
+            limit = parse_limit(params.get('limit'))
+            
+            if params.get('action') == 'stats':
+                # Сводка для админ-панели считается в базе: список отдаётся страницами и всех заказов не содержит
+                execute_prepared(cur, ORDER_STATS, (PENDING_STATUS,))
+                return json_response(200, {'stats': cur.fetchone()})
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'orders': orders}, ensure_ascii=False, default=str),
-                'isBase64Encoded': False
-            }
+            try:
+                cursor_values = decode_cursor(params.get('cursor'))
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'Invalid cursor'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
+            try:
+                conditions, values = build_order_filters(params)
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'date_from and date_to must be ISO 8601 dates'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            if cursor_values:
+                conditions.append('(created_at, id) < (%s::timestamp, %s)')
+                values.extend(cursor_values[:2])
+            
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            values.append(limit + 1)
+            
+            # Страница собирается в JSON в базе: items (JSONB) не разбирается в Python и не сериализуется заново
+            orders_json, next_cursor = fetch_json_page(
+                cur, f'SELECT * FROM orders {where} ORDER BY created_at DESC, id DESC LIMIT %s', values, limit
+            )
+            
+            return json_response(200, body=dumps_with_fragments(
+                {'next_cursor': next_cursor, 'has_more': next_cursor is not None},
+                orders=orders_json
+            ))
         
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
@@ -56,25 +218,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             items = body_data.get('items', [])
             total_price = body_data.get('total_price', 0)
             
-            cur.execute(
-                "INSERT INTO orders (customer_name, customer_email, items, total_price, status) VALUES (%s, %s, %s, %s, %s) RETURNING *",
-                (customer_name, customer_email, json.dumps(items), total_price, 'В обработке')
+            execute_prepared(
+                cur, ORDER_INSERT, (customer_name, customer_email, json.dumps(items), total_price, PENDING_STATUS)
             )
             conn.commit()
             new_order = cur.fetchone()
             
-            return {
-                'statusCode': 201,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'order': new_order}, ensure_ascii=False, default=str),
-                'isBase64Encoded': False
-            }
+            return json_response(201, {'order': new_order})
         
         elif method == 'PUT':
             body_data = json.loads(event.get('body', '{}'))
+            
+            if 'ids' in body_data or 'filter' in body_data:
+                return bulk_update_status(cur, conn, body_data)
+            
             order_id = body_data.get('id')
             status = body_data.get('status')
             
@@ -85,15 +242,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             conn.commit()
             updated_order = cur.fetchone()
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'order': updated_order}, ensure_ascii=False, default=str),
-                'isBase64Encoded': False
-            }
+            return json_response(200, {'order': updated_order})
         
         return {
             'statusCode': 405,
@@ -107,4 +256,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cur.close()
-        conn.close()
+        if not read_only:
+            note_write(conn, headers, 'orders')
+        release_connection(conn)
@@ -0,0 +1,63 @@
+'''
+Business: Сборка JSON-ответов функций - orjson, если он установлен, иначе стандартный json
+Args: JSON_ENCODER из окружения (orjson или json), данные ответа или готовые JSON-фрагменты из базы
+Returns: Тело ответа строкой и словарь ответа облачной функции
+'''
+
+import json
+import os
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Optional
+from timing import span
+
+# orjson при загрузке сам импортирует uuid и zoneinfo, поэтому с JSON_ENCODER=json его не трогаем
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'orjson')
+orjson = None
+if JSON_ENCODER == 'orjson':
+    try:
+        import orjson
+    except ImportError:
+        JSON_ENCODER = 'json'
+
+def encode_default(value: Any) -> Any:
+    '''Типы из psycopg2, которых нет в JSON: деньги - числом, даты - в ISO 8601.'''
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if type(value).__name__ == 'UUID':
+        # По имени типа: импорт uuid ради isinstance тянул бы его в холодный старт
+        return str(value)
+    if isinstance(value, memoryview):
+        return value.tobytes().decode('utf-8', 'replace')
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps(payload: Any) -> str:
+    '''JSON строкой. orjson сам пишет datetime и dict-подклассы вроде RealDictRow; через encode_default идут только Decimal и редкие типы.'''
+    with span('serialize'):
+        if JSON_ENCODER == 'orjson':
+            return orjson.dumps(payload, default=encode_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        return json.dumps(payload, ensure_ascii=False, default=encode_default)
+
+def dumps_with_fragments(payload: Dict[str, Any], **fragments: str) -> str:
+    '''Объект, в который вставлены уже готовые JSON-тексты (например, json_agg из базы) без повторного разбора.'''
+    with span('serialize'):
+        head = ','.join(f'{json.dumps(key)}:{fragment}' for key, fragment in fragments.items())
+    rest = dumps(payload)[1:] if payload else '}'
+    if not head:
+        return '{' + rest
+    return '{' + head + (',' + rest if rest != '}' else '}')
+
+def json_response(status_code: int, payload: Any = None, headers: Optional[Dict[str, str]] = None,
+                  body: Optional[str] = None) -> Dict[str, Any]:
+    '''Ответ функции с JSON-телом; body - уже собранный JSON, иначе сериализуется payload.'''
+    response_headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+    if headers:
+        response_headers.update(headers)
+    return {
+        'statusCode': status_code,
+        'headers': response_headers,
+        'isBase64Encoded': False,
+        'body': body if body is not None else dumps(payload)
+    }
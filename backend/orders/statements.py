@@ -0,0 +1,79 @@
+'''
+Business: Реестр горячих запросов - PREPARE один раз на соединение пула, дальше EXECUTE без разбора и планирования
+Args: DB_PREPARE из окружения (0 - обычный execute, например за пулером в режиме транзакций)
+Returns: Результат запроса в курсоре, как после cursor.execute
+'''
+
+import os
+from typing import Any, Dict, Sequence, Tuple
+
+DB_PREPARE = os.environ.get('DB_PREPARE', '1') == '1'
+
+# SQLSTATE: подготовленного запроса нет на сервере; план устарел (изменился состав столбцов результата)
+INVALID_STATEMENT_NAME = '26000'
+FEATURE_NOT_SUPPORTED = '0A000'
+RETRY_SAVEPOINT = 'execute_prepared'
+
+# имя -> (запрос с %s для execute, текст для PREPARE с $1..$n, число параметров)
+_statements: Dict[str, Tuple[str, str, int]] = {}
+
+def prepared_statement(name: str, query: str) -> str:
+    '''Регистрирует запрос при импорте модуля; возвращает имя для execute_prepared.'''
+    parts = query.split('%s')
+    body = parts[0] + ''.join(f'${number}{part}' for number, part in enumerate(parts[1:], 1))
+    _statements[name] = (query, body, len(parts) - 1)
+    return name
+
+def registered_statements() -> Dict[str, str]:
+    return {name: query for name, (query, _, _) in _statements.items()}
+
+def _prepare(cursor, prepared: Dict[str, str], name: str, body: str):
+    state = prepared.get(name)
+    if state == 'ready':
+        return
+    if state == 'stale':
+        cursor.execute(f'DEALLOCATE {name}')
+    cursor.execute(f'PREPARE {name} AS {body}')
+    prepared[name] = 'ready'
+
+def execute_prepared(cursor, name: str, vars: Sequence[Any] = ()):
+    '''EXECUTE подготовленного запроса; при первом вызове на соединении сначала PREPARE.
+
+    Подготовленные имена хранит соединение пула (prepared_statements в db.InstrumentedConnection),
+    новое соединение готовит запросы заново. PREPARE не откатывается вместе с транзакцией.
+    Если запроса на сервере нет или после миграции сменился состав столбцов результата
+    (RETURNING *, SELECT *), запрос готовится заново и выполняется ещё раз в этом же вызове.
+    Ошибка прерывает транзакцию, поэтому повтор возможен так: вызов, открывший транзакцию,
+    откатывает её целиком; внутри транзакции EXECUTE уходит вместе с SAVEPOINT одним запросом,
+    и откатывается только он. Точка сохранения живёт до конца транзакции.
+    '''
+    query, body, count = _statements[name]
+    conn = cursor.connection
+    prepared = getattr(conn, 'prepared_statements', None)
+    if not DB_PREPARE or prepared is None:
+        return cursor.execute(query, vars)
+
+    from psycopg2 import extensions
+
+    in_transaction = conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE
+    execute = f"EXECUTE {name} ({', '.join(['%s'] * count)})" if count else f'EXECUTE {name}'
+    if in_transaction:
+        execute = f'SAVEPOINT {RETRY_SAVEPOINT}; {execute}'
+    for attempt in range(2):
+        _prepare(cursor, prepared, name, body)
+        try:
+            return cursor.execute(execute, vars) if count else cursor.execute(execute)
+        except Exception as e:
+            code = getattr(e, 'pgcode', None)
+            if code == INVALID_STATEMENT_NAME:
+                prepared.pop(name, None)
+            elif code == FEATURE_NOT_SUPPORTED:
+                prepared[name] = 'stale'
+            else:
+                raise
+            if attempt:
+                raise
+            if in_transaction:
+                cursor.execute(f'ROLLBACK TO SAVEPOINT {RETRY_SAVEPOINT}')
+            else:
+                conn.rollback()
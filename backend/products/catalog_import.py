@@ -0,0 +1,239 @@
+'''
+Business: Массовый импорт каталога - товары и их фото пачкой в одной транзакции
+Args: тело запроса JSON ({"products": [...]} или массив) либо NDJSON, по товару на строку
+Returns: Отчёт по каждой строке; при ошибках проверки ничего не записывается
+'''
+
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from pricing import parse_price
+
+IMPORT_MAX_ROWS = int(os.environ.get('IMPORT_MAX_ROWS', '2000'))
+IMPORT_MAX_IMAGES = int(os.environ.get('IMPORT_MAX_IMAGES', '20'))
+IMPORT_PAGE_SIZE = int(os.environ.get('IMPORT_PAGE_SIZE', '500'))
+PRODUCT_FIELDS = ('title', 'description', 'icon', 'gradient')
+# Пределы VARCHAR колонок products; None - TEXT без предела
+TEXT_LIMITS = {'external_id': 100, 'title': 255, 'description': None, 'icon': 100, 'gradient': 100, 'price_currency': 10}
+
+class ImportRejected(Exception):
+    '''Пакет не прошёл проверку; report - отчёт по строкам.'''
+
+    def __init__(self, message: str, report: Optional[List[Dict[str, Any]]] = None):
+        super().__init__(message)
+        self.report = report or []
+
+def parse_batch(body: str, fmt: str) -> List[Tuple[int, Any]]:
+    '''Строки пакета с номерами; строка NDJSON, которую не удалось разобрать, остаётся строкой с ошибкой.'''
+    if fmt == 'ndjson':
+        items = []
+        for number, line in enumerate(body.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                items.append((number, json.loads(line)))
+            except ValueError:
+                items.append((number, ValueError('Invalid JSON')))
+        return items
+
+    try:
+        data = json.loads(body or '[]')
+    except ValueError:
+        raise ImportRejected('Invalid JSON')
+    if isinstance(data, dict):
+        data = data.get('products')
+    if not isinstance(data, list):
+        raise ImportRejected('Expected a list of products or {"products": [...]}')
+    return list(enumerate(data, 1))
+
+def validate_images(raw: Any) -> Tuple[List[Dict[str, Any]], List[str]]:
+    if not isinstance(raw, list):
+        return [], ['images must be a list']
+    if len(raw) > IMPORT_MAX_IMAGES:
+        return [], [f'at most {IMPORT_MAX_IMAGES} images per product']
+
+    images: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    seen = set()
+    for position, item in enumerate(raw):
+        if isinstance(item, str):
+            item = {'image_url': item}
+        if not isinstance(item, dict):
+            errors.append(f'images[{position}] must be a URL or an object')
+            continue
+        url = str(item.get('image_url') or item.get('url') or '').strip()
+        if not url.startswith(('http://', 'https://')):
+            errors.append(f'images[{position}] needs an http(s) image_url')
+            continue
+        if url in seen:
+            errors.append(f'images[{position}] duplicates {url}')
+            continue
+        seen.add(url)
+        order = item.get('display_order', position)
+        if isinstance(order, bool) or not isinstance(order, int):
+            errors.append(f'images[{position}].display_order must be an integer')
+            continue
+        images.append({'image_url': url, 'is_primary': bool(item.get('is_primary')), 'display_order': order})
+
+    if images and not any(image['is_primary'] for image in images):
+        images[0]['is_primary'] = True
+    if sum(image['is_primary'] for image in images) > 1:
+        errors.append('only one image can be primary')
+    return images, errors
+
+def validate_text(raw: Dict[str, Any], field: str, errors: List[str]) -> Optional[str]:
+    '''Строковое поле строки импорта в пределах колонки; ошибка дописывается в errors.'''
+    value = raw.get(field)
+    if value is None:
+        return None
+    if field == 'external_id' and isinstance(value, int) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str):
+        errors.append(f'{field} must be a string')
+        return None
+    value = value.strip()
+    limit = TEXT_LIMITS[field]
+    if limit and len(value) > limit:
+        errors.append(f'{field} must be up to {limit} characters')
+        return None
+    return value
+
+def validate_row(raw: Any) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    if isinstance(raw, ValueError):
+        return None, [str(raw)]
+    if not isinstance(raw, dict):
+        return None, ['row must be an object']
+
+    errors: List[str] = []
+    values = {field: validate_text(raw, field, errors) for field in TEXT_LIMITS}
+    for field in ('external_id', 'title'):
+        if raw.get(field) is None or values[field] == '':
+            errors.append(f'{field} is required')
+
+    try:
+        price_amount, price_currency, price = parse_price(raw.get('price'), values['price_currency'])
+    except ValueError as e:
+        errors.append(str(e).lower())
+        price_amount = price_currency = price = None
+    if price and len(price) > 50:
+        errors.append('price must be up to 50 characters')
+
+    images = None
+    if 'images' in raw:
+        images, image_errors = validate_images(raw['images'])
+        errors.extend(image_errors)
+
+    if errors:
+        return None, errors
+    row = {field: values[field] for field in PRODUCT_FIELDS}
+    row.update({
+        'external_id': values['external_id'],
+        'icon': values['icon'] or 'Package',
+        'gradient': values['gradient'] or 'bg-gradient-primary',
+        'price': price,
+        'price_amount': price_amount,
+        'price_currency': price_currency,
+        'images': images
+    })
+    return row, []
+
+def validate_batch(items: List[Tuple[int, Any]]) -> List[Dict[str, Any]]:
+    '''Проверяет весь пакет до записи; ImportRejected с отчётом, если хоть одна строка неверна.'''
+    if not items:
+        raise ImportRejected('Batch is empty')
+    if len(items) > IMPORT_MAX_ROWS:
+        raise ImportRejected(f'Batch exceeds {IMPORT_MAX_ROWS} rows, split it')
+
+    rows: List[Dict[str, Any]] = []
+    report: List[Dict[str, Any]] = []
+    seen: Dict[str, int] = {}
+    for number, raw in items:
+        row, errors = validate_row(raw)
+        if row and row['external_id'] in seen:
+            errors = [f"external_id repeats row {seen[row['external_id']]}"]
+        if errors:
+            report.append({'row': number, 'status': 'invalid', 'errors': errors})
+            continue
+        seen[row['external_id']] = number
+        row['row'] = number
+        rows.append(row)
+        report.append({'row': number, 'external_id': row['external_id'], 'status': 'valid'})
+
+    if len(rows) != len(items):
+        raise ImportRejected('Batch has invalid rows, nothing was imported', report)
+    return rows
+
+def import_catalog(conn, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''Upsert товаров и фото несколькими execute_values в одной транзакции.
+
+    Если у строки есть images, набор фото товара приводится к переданному: лишние удаляются.
+    Триггеры каталога срабатывают на оператор, так что версия каталога растёт на несколько шагов, а не на строку.
+    '''
+    from psycopg2.extras import execute_values
+
+    with conn.cursor() as cursor:
+        products = execute_values(
+            cursor,
+            '''INSERT INTO products
+                   (external_id, title, price, price_amount, price_currency, description, icon, gradient)
+               VALUES %s
+               ON CONFLICT (external_id) DO UPDATE SET
+                   title = EXCLUDED.title, price = EXCLUDED.price, price_amount = EXCLUDED.price_amount,
+                   price_currency = EXCLUDED.price_currency, description = EXCLUDED.description,
+                   icon = EXCLUDED.icon, gradient = EXCLUDED.gradient, updated_at = CURRENT_TIMESTAMP
+               RETURNING id, external_id, (xmax = 0) AS inserted''',
+            [
+                (r['external_id'], r['title'], r['price'], r['price_amount'], r['price_currency'],
+                 r['description'], r['icon'], r['gradient'])
+                for r in rows
+            ],
+            page_size=IMPORT_PAGE_SIZE,
+            fetch=True
+        )
+        ids = {external_id: (product_id, inserted) for product_id, external_id, inserted in products}
+
+        synced = [r for r in rows if r['images'] is not None]
+        images = [
+            (ids[r['external_id']][0], image['image_url'], image['is_primary'], image['display_order'])
+            for r in synced for image in r['images']
+        ]
+        if synced:
+            # Фото, которых нет в пакете, удаляются одним запросом по всем синхронизируемым товарам
+            cursor.execute(
+                '''DELETE FROM product_images pi
+                   WHERE pi.product_id = ANY(%s)
+                     AND NOT EXISTS (
+                         SELECT 1 FROM unnest(%s::int[], %s::text[]) AS keep(product_id, image_url)
+                         WHERE keep.product_id = pi.product_id AND keep.image_url = pi.image_url
+                     )''',
+                (
+                    [ids[r['external_id']][0] for r in synced],
+                    [image[0] for image in images],
+                    [image[1] for image in images]
+                )
+            )
+        if images:
+            execute_values(
+                cursor,
+                '''INSERT INTO product_images (product_id, image_url, is_primary, display_order)
+                   VALUES %s
+                   ON CONFLICT (product_id, image_url) DO UPDATE SET
+                       is_primary = EXCLUDED.is_primary, display_order = EXCLUDED.display_order''',
+                images,
+                page_size=IMPORT_PAGE_SIZE
+            )
+    conn.commit()
+
+    report = []
+    for r in rows:
+        product_id, inserted = ids[r['external_id']]
+        entry = {
+            'row': r['row'],
+            'external_id': r['external_id'],
+            'product_id': product_id,
+            'status': 'created' if inserted else 'updated'
+        }
+        if r['images'] is not None:
+            entry['images'] = len(r['images'])
+        report.append(entry)
+    return report
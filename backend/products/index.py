@@ -5,16 +5,186 @@ Args: event - dict с httpMethod, body, queryStringParameters
 Returns: HTTP response dict с товарами из базы данных
 """
 
+import base64
 import json
 import os
-from typing import Dict, Any
-import psycopg2
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Any, Optional
 from psycopg2.extras import RealDictCursor
+from db import get_connection, note_write, release_connection
+from timing import instrumented
+from pricing import parse_price
+from catalog_import import ImportRejected, import_catalog, parse_batch, validate_batch
+from responses import json_response
+from statements import execute_prepared, prepared_statement
 
-def get_db_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+CATALOG_VERSION_TTL = float(os.environ.get('CATALOG_VERSION_TTL', '2'))
 
+PRICE_SORTS = {'price_asc': 'p.price_amount ASC NULLS LAST, p.id', 'price_desc': 'p.price_amount DESC NULLS LAST, p.id'}
+
+CATALOG_QUERY = '''SELECT p.*, 
+   COALESCE(
+       json_agg(
+           json_build_object('id', pi.id, 'image_url', pi.image_url, 'is_primary', pi.is_primary)
+           ORDER BY pi.display_order
+       ) FILTER (WHERE pi.id IS NOT NULL),
+       '[]'::json
+   ) as images
+   FROM products p
+   LEFT JOIN product_images pi ON p.id = pi.product_id
+   {where}
+   GROUP BY p.id
+   ORDER BY {order}'''
+
+# Весь ответ {"products": [...]} собирается в базе: строки и фото не проходят через Python-объекты
+CATALOG_JSON_QUERY = f'''SELECT json_build_object(
+       'products', COALESCE(json_agg(p ORDER BY {{order}}), '[]'::json)
+   )::text AS body
+   FROM ({CATALOG_QUERY}) p'''
+
+# Запросы каталога без фильтров одинаковы на каждом вызове: готовятся один раз на соединение
+CATALOG_VERSION = prepared_statement('catalog_version', 'SELECT version FROM catalog_state WHERE id = 1')
+CATALOG_BODY = prepared_statement('catalog_body', CATALOG_JSON_QUERY.format(where='', order='p.id'))
+PRODUCT_BY_ID = prepared_statement(
+    'product_by_id',
+    '''SELECT p.*, 
+       COALESCE(
+           json_agg(
+               json_build_object('id', pi.id, 'image_url', pi.image_url, 'is_primary', pi.is_primary, 'display_order', pi.display_order)
+               ORDER BY pi.display_order
+           ) FILTER (WHERE pi.id IS NOT NULL),
+           '[]'::json
+       ) as images
+       FROM products p
+       LEFT JOIN product_images pi ON p.id = pi.product_id
+       WHERE p.id = %s
+       GROUP BY p.id'''
+)
+
+_catalog_cache: Dict[str, Any] = {}
+
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    headers = event.get('headers') or {}
+    lowered = name.lower()
+    for key, value in headers.items():
+        if key.lower() == lowered:
+            return value
+    return None
+
+def get_fresh_catalog() -> Optional[Dict[str, Any]]:
+    if not _catalog_cache:
+        return None
+    if time.monotonic() - _catalog_cache['checked_at'] > CATALOG_VERSION_TTL:
+        return None
+    return _catalog_cache
+
+def invalidate_catalog():
+    _catalog_cache.clear()
+
+def load_catalog(cur) -> Dict[str, Any]:
+    execute_prepared(cur, CATALOG_VERSION)
+    row = cur.fetchone()
+    version = row['version'] if row else 0
+    
+    if _catalog_cache.get('version') != version:
+        execute_prepared(cur, CATALOG_BODY)
+        body = cur.fetchone()['body']
+        _catalog_cache.clear()
+        _catalog_cache.update({
+            'version': version,
+            'etag': f'"catalog-{version}"',
+            'body': body
+        })
+    
+    _catalog_cache['checked_at'] = time.monotonic()
+    return _catalog_cache
+
+def query_products_json(cur, params: Dict[str, Any]) -> str:
+    conditions = []
+    values = []
+    
+    if params.get('min_price'):
+        conditions.append('p.price_amount >= %s')
+        values.append(Decimal(params['min_price']))
+    if params.get('max_price'):
+        conditions.append('p.price_amount <= %s')
+        values.append(Decimal(params['max_price']))
+    if params.get('currency'):
+        conditions.append('p.price_currency = %s')
+        values.append(params['currency'].upper())
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    order = PRICE_SORTS.get(params.get('sort'), 'p.id')
+    cur.execute(CATALOG_JSON_QUERY.format(where=where, order=order), values)
+    return cur.fetchone()['body']
+
+def catalog_response(event: Dict[str, Any], catalog: Dict[str, Any]) -> Dict[str, Any]:
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': 'no-cache',
+        'ETag': catalog['etag']
+    }
+    
+    if_none_match = get_header(event, 'If-None-Match') or ''
+    if catalog['etag'] in [tag.strip() for tag in if_none_match.split(',')]:
+        return {
+            'statusCode': 304,
+            'headers': headers,
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': catalog['body'],
+        'isBase64Encoded': False
+    }
+
+def handle_bulk_import(conn, event: Dict[str, Any], params: Dict[str, Any]) -> Dict[str, Any]:
+    '''Импорт пакета товаров: сначала проверяется весь пакет, затем одна транзакция на запись.'''
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    content_type = get_header(event, 'Content-Type') or ''
+    fmt = 'ndjson' if params.get('format') == 'ndjson' or 'ndjson' in content_type else 'json'
+    
+    try:
+        rows = validate_batch(parse_batch(body, fmt))
+    except ImportRejected as e:
+        return {
+            'statusCode': 422 if e.report else 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': str(e), 'rows': e.report}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    
+    report = import_catalog(conn, rows)
+    invalidate_catalog()
+    created = sum(1 for entry in report if entry['status'] == 'created')
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'created': created,
+            'updated': len(report) - created,
+            'images': sum(entry.get('images', 0) for entry in report),
+            'rows': report
+        }, ensure_ascii=False),
+        'isBase64Encoded': False
+    }
+
+@instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -24,102 +194,97 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Auth',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Auth, If-None-Match, X-Read-After',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    params = event.get('queryStringParameters') or {}
+    is_full_catalog = not any(params.get(key) for key in ('id', 'min_price', 'max_price', 'currency', 'sort'))
+    
+    if method == 'GET' and is_full_catalog:
+        catalog = get_fresh_catalog()
+        if catalog:
+            return catalog_response(event, catalog)
+    
+    # Каталог и карточки читаются с реплики, если она задана в DATABASE_READ_URL.
+    # Каталог общий для всех: после правки экземпляр не кэширует версию, которую реплика ещё не проиграла
+    headers = event.get('headers') or {}
+    read_only = method == 'GET'
+    conn = get_connection(read_only, headers, 'catalog')
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
         if method == 'GET':
-            params = event.get('queryStringParameters', {})
             product_id = params.get('id')
             
             if product_id:
-                cur.execute(
-                    '''SELECT p.*, 
-                       COALESCE(
-                           json_agg(
-                               json_build_object('id', pi.id, 'image_url', pi.image_url, 'is_primary', pi.is_primary, 'display_order', pi.display_order)
-                               ORDER BY pi.display_order
-                           ) FILTER (WHERE pi.id IS NOT NULL),
-                           '[]'::json
-                       ) as images
-                       FROM products p
-                       LEFT JOIN product_images pi ON p.id = pi.product_id
-                       WHERE p.id = %s
-                       GROUP BY p.id''',
-                    (product_id,)
-                )
+                execute_prepared(cur, PRODUCT_BY_ID, (product_id,))
                 product = cur.fetchone()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'product': product}, ensure_ascii=False, default=str),
-                    'isBase64Encoded': False
-                }
+                return json_response(200, {'product': product})
+            elif is_full_catalog:
+                return catalog_response(event, load_catalog(cur))
             else:
-                cur.execute(
-                    '''SELECT p.*, 
-                       COALESCE(
-                           json_agg(
-                               json_build_object('id', pi.id, 'image_url', pi.image_url, 'is_primary', pi.is_primary)
-                               ORDER BY pi.display_order
-                           ) FILTER (WHERE pi.id IS NOT NULL),
-                           '[]'::json
-                       ) as images
-                       FROM products p
-                       LEFT JOIN product_images pi ON p.id = pi.product_id
-                       GROUP BY p.id
-                       ORDER BY p.id'''
-                )
-                products = cur.fetchall()
+                try:
+                    body = query_products_json(cur, params)
+                except InvalidOperation:
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Invalid price filter'}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'products': products}, ensure_ascii=False, default=str),
-                    'isBase64Encoded': False
-                }
+                return json_response(200, body=body)
         
         elif method == 'POST':
+            # NDJSON не разбирается как один JSON, поэтому импорт выбирается до json.loads
+            if params.get('action') == 'bulk_import':
+                return handle_bulk_import(conn, event, params)
+            
             body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action', 'create_product')
             
+            if action == 'bulk_import':
+                return handle_bulk_import(conn, event, params)
+            
             if action == 'create_product':
                 title = body_data.get('title')
-                price = body_data.get('price')
                 description = body_data.get('description')
                 icon = body_data.get('icon', 'Package')
                 gradient = body_data.get('gradient', 'bg-gradient-primary')
                 
+                try:
+                    price_amount, price_currency, price = parse_price(
+                        body_data.get('price'), body_data.get('price_currency')
+                    )
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': str(e)}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
+                
                 cur.execute(
-                    "INSERT INTO products (title, price, description, icon, gradient) VALUES (%s, %s, %s, %s, %s) RETURNING *",
-                    (title, price, description, icon, gradient)
+                    '''INSERT INTO products (title, price, price_amount, price_currency, description, icon, gradient)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING *''',
+                    (title, price, price_amount, price_currency, description, icon, gradient)
                 )
                 conn.commit()
                 new_product = cur.fetchone()
+                invalidate_catalog()
                 
-                return {
-                    'statusCode': 201,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'product': new_product}, ensure_ascii=False, default=str),
-                    'isBase64Encoded': False
-                }
+                return json_response(201, {'product': new_product})
             
             elif action == 'add_image':
                 product_id = body_data.get('product_id')
@@ -133,16 +298,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 )
                 conn.commit()
                 new_image = cur.fetchone()
+                invalidate_catalog()
                 
-                return {
-                    'statusCode': 201,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'image': new_image}, ensure_ascii=False, default=str),
-                    'isBase64Encoded': False
-                }
+                return json_response(201, {'image': new_image})
         
         elif method == 'PUT':
             body_data = json.loads(event.get('body', '{}'))
@@ -151,27 +309,38 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             update_fields = []
             update_values = []
             
-            for field in ['title', 'price', 'description', 'icon', 'gradient']:
+            for field in ['title', 'description', 'icon', 'gradient']:
                 if field in body_data:
                     update_fields.append(f"{field} = %s")
                     update_values.append(body_data[field])
             
+            if 'price' in body_data:
+                try:
+                    price_amount, price_currency, price = parse_price(
+                        body_data['price'], body_data.get('price_currency')
+                    )
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': str(e)}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
+                update_fields.extend(['price = %s', 'price_amount = %s', 'price_currency = %s'])
+                update_values.extend([price, price_amount, price_currency])
+            
             if update_fields:
                 update_values.append(product_id)
                 query = f"UPDATE products SET {', '.join(update_fields)} WHERE id = %s RETURNING *"
                 cur.execute(query, update_values)
                 conn.commit()
                 updated_product = cur.fetchone()
+                invalidate_catalog()
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'product': updated_product}, ensure_ascii=False, default=str),
-                    'isBase64Encoded': False
-                }
+                return json_response(200, {'product': updated_product})
         
         elif method == 'DELETE':
             params = event.get('queryStringParameters', {})
@@ -181,6 +350,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if image_id:
                 cur.execute('DELETE FROM product_images WHERE id = %s', (image_id,))
                 conn.commit()
+                invalidate_catalog()
                 
                 return {
                     'statusCode': 200,
@@ -194,6 +364,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             elif product_id:
                 cur.execute('DELETE FROM products WHERE id = %s', (product_id,))
                 conn.commit()
+                invalidate_catalog()
                 
                 return {
                     'statusCode': 200,
@@ -217,4 +388,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        if not read_only:
+            note_write(conn, headers, 'catalog')
+        release_connection(conn)
\ No newline at end of file
@@ -0,0 +1,46 @@
+'''
+Business: Разбор цены товара - число или строка вида '1000₽' в сумму, валюту и строку для витрины
+Args: значение цены и необязательный код валюты
+Returns: Кортеж (Decimal сумма, код валюты, строка цены); ValueError для некорректной цены или валюты
+'''
+
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Any, Optional, Tuple
+
+CURRENCY_SYMBOLS = {'₽': 'RUB', 'руб': 'RUB', '$': 'USD', '€': 'EUR'}
+CURRENCY_SIGNS = {'RUB': '₽', 'USD': '$', 'EUR': '€'}
+CURRENCY_CODE = re.compile(r'^[A-Z]{3}$')
+
+def parse_price(value: Any, currency: Optional[str] = None) -> Tuple[Decimal, str, str]:
+    '''Принимает цену числом или строкой вида '1000₽'; возвращает сумму, валюту и строку для витрины.'''
+    if isinstance(value, bool) or value is None:
+        raise ValueError('Invalid price')
+    
+    if isinstance(value, (int, float, Decimal)):
+        amount = Decimal(str(value))
+        display = None
+    else:
+        display = str(value).strip()
+        lowered = display.lower()
+        for symbol, code in CURRENCY_SYMBOLS.items():
+            if symbol in lowered:
+                currency = currency or code
+                break
+        try:
+            amount = Decimal(re.sub(r'[^0-9.]', '', display.replace(',', '.')))
+        except InvalidOperation:
+            raise ValueError('Invalid price')
+    
+    if not amount.is_finite() or amount < 0 or amount >= Decimal('100000000'):
+        raise ValueError('Invalid price')
+    
+    if currency is None or currency == '':
+        currency = 'RUB'
+    if not isinstance(currency, str) or not CURRENCY_CODE.match(currency.upper()):
+        raise ValueError('Invalid currency')
+    currency = currency.upper()
+    amount = amount.quantize(Decimal('0.01'))
+    if not display:
+        display = f"{amount.normalize():f}{CURRENCY_SIGNS.get(currency, ' ' + currency)}"
+    return amount, currency, display
@@ -0,0 +1,132 @@
+'''
+Business: Буферизованная запись auth_logs - события копятся в памяти экземпляра и пишутся одним многострочным INSERT
+Args: AUTH_LOG_BATCH, AUTH_LOG_FLUSH_SECONDS, AUTH_LOG_MAX_BUFFER из окружения
+Returns: Число записанных строк; при отсутствии месячной секции она создаётся и вставка повторяется
+
+Успешные входы и выходы пишутся до ответа на запрос, в котором они случились: экземпляр может
+быть остановлен в любой момент, и журнал не должен терять их вместе с буфером. Пачками
+копятся неудачные попытки - при переборе токенов именно их много.
+'''
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+AUTH_LOG_BATCH = int(os.environ.get('AUTH_LOG_BATCH', '50'))
+AUTH_LOG_FLUSH_SECONDS = float(os.environ.get('AUTH_LOG_FLUSH_SECONDS', '5'))
+AUTH_LOG_MAX_BUFFER = int(os.environ.get('AUTH_LOG_MAX_BUFFER', '5000'))
+SCHEMA = 't_p8741694_magazin_samp'
+
+logger = logging.getLogger('auth_log')
+
+_buffer: List[Tuple] = []
+_buffer_started: Optional[float] = None
+_urgent = False
+_lock = threading.Lock()
+
+def request_origin(event: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    '''IP и User-Agent из event облачной функции.'''
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    headers = event.get('headers') or {}
+    user_agent = headers.get('user-agent') or headers.get('User-Agent') or identity.get('userAgent')
+    return identity.get('sourceIp'), user_agent
+
+def log_auth_event(action: str, status: str, user_id: Optional[int] = None, username: Optional[str] = None,
+                   ip_address: Optional[str] = None, user_agent: Optional[str] = None):
+    '''Кладёт событие в буфер; created_at фиксируется сейчас, а не в момент сброса.'''
+    global _buffer_started, _urgent
+    row = (user_id, username, action, ip_address, user_agent, status, datetime.now())
+    with _lock:
+        if len(_buffer) >= AUTH_LOG_MAX_BUFFER:
+            # база недоступна дольше, чем помещается в буфер: старые события отбрасываются
+            del _buffer[0]
+        if not _buffer:
+            _buffer_started = time.monotonic()
+        _buffer.append(row)
+        if status == 'success':
+            _urgent = True
+
+def _due() -> bool:
+    if _urgent or len(_buffer) >= AUTH_LOG_BATCH:
+        return True
+    return _buffer_started is not None and time.monotonic() - _buffer_started >= AUTH_LOG_FLUSH_SECONDS
+
+def flush_due() -> bool:
+    '''Пора ли сбрасывать буфер; соединение под сброс берётся только тогда.'''
+    with _lock:
+        return bool(_buffer) and _due()
+
+def _take_batch(force: bool) -> List[Tuple]:
+    global _buffer_started, _urgent
+    with _lock:
+        if not _buffer:
+            return []
+        if not force and not _due():
+            return []
+        batch = _buffer[:]
+        _buffer.clear()
+        _buffer_started = None
+        _urgent = False
+        return batch
+
+def _requeue(batch: List[Tuple]):
+    global _buffer_started, _urgent
+    with _lock:
+        _buffer[:0] = batch[-AUTH_LOG_MAX_BUFFER:]
+        del _buffer[AUTH_LOG_MAX_BUFFER:]
+        if _buffer_started is None:
+            _buffer_started = time.monotonic()
+        _urgent = _urgent or any(row[5] == 'success' for row in batch)
+
+def _insert(conn, batch: List[Tuple]):
+    from psycopg2.extras import execute_values
+
+    with conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            f"""INSERT INTO {SCHEMA}.auth_logs
+                (user_id, username, action, ip_address, user_agent, status, created_at) VALUES %s""",
+            batch,
+            page_size=AUTH_LOG_BATCH
+        )
+
+def flush_auth_logs(conn, force: bool = False) -> int:
+    '''Пишет буфер, если в нём успешный вход или выход, набралась пачка AUTH_LOG_BATCH
+    или старейшему событию больше AUTH_LOG_FLUSH_SECONDS.
+
+    conn - отдельное соединение, а не соединение маршрута: сброс коммитит только журнал.
+    Незакоммиченное на соединении откатывается до вставки. Ошибка записи не роняет запрос:
+    пачка возвращается в буфер до следующего сброса.
+    '''
+    batch = _take_batch(force)
+    if not batch:
+        return 0
+
+    import psycopg2
+    from psycopg2 import errorcodes
+
+    try:
+        conn.rollback()
+        try:
+            _insert(conn, batch)
+        except psycopg2.Error as e:
+            if e.pgcode != errorcodes.CHECK_VIOLATION:
+                raise
+            # Нет секции под месяц события: создаём недостающие и повторяем один раз
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT {SCHEMA}.ensure_auth_logs_partitions(%s)",
+                    (min(row[-1] for row in batch).date(),)
+                )
+            _insert(conn, batch)
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        _requeue(batch)
+        logger.warning('auth_logs flush failed, %d events kept: %s', len(batch), e)
+        return 0
+    return len(batch)
@@ -0,0 +1,259 @@
+'''
+Business: Лента изменений заказов и поддержки - события change_events после курсора клиента, новые ждутся через LISTEN/NOTIFY
+Args: CHANGE_FEED_WAIT, CHANGE_FEED_GAP_GRACE, CHANGE_FEED_BATCH, CHANGE_FEED_RETENTION_HOURS,
+      CHANGE_FEED_TICKET_SECRET, CHANGE_FEED_TICKET_TTL из окружения
+Returns: События по возрастанию id и курсор (id), с которого продолжать чтение
+'''
+
+import hashlib
+import hmac
+import logging
+import os
+import select
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import psycopg2
+from db import CONNECT_TIMEOUT, DATABASE_URL
+
+CHANGE_FEED_WAIT = float(os.environ.get('CHANGE_FEED_WAIT', '20'))
+CHANGE_FEED_GAP_GRACE = float(os.environ.get('CHANGE_FEED_GAP_GRACE', '5'))
+CHANGE_FEED_BATCH = int(os.environ.get('CHANGE_FEED_BATCH', '100'))
+CHANGE_FEED_LISTEN_RETRY = float(os.environ.get('CHANGE_FEED_LISTEN_RETRY', '10'))
+CHANGE_FEED_RETENTION_HOURS = float(os.environ.get('CHANGE_FEED_RETENTION_HOURS', '48'))
+CHANGE_FEED_TICKET_SECRET = os.environ.get('CHANGE_FEED_TICKET_SECRET', '')
+CHANGE_FEED_TICKET_TTL = int(os.environ.get('CHANGE_FEED_TICKET_TTL', '300'))
+CHANGE_FEED_CHANNEL = 'change_feed'
+CHANGE_FEED_TOPICS = ('order', 'ticket', 'message')
+SCHEMA = 't_p8741694_magazin_samp'
+
+logger = logging.getLogger('changefeed')
+
+_listener = None
+_listener_retry_at = 0.0
+_listener_lock = threading.Lock()
+_generation = 0
+
+class CursorExpired(Exception):
+    '''События после курсора уже удалены чисткой; клиент перечитывает списки и берёт курсор head.'''
+
+    def __init__(self, head: int):
+        super().__init__('Cursor expired')
+        self.head = head
+
+def _ticket_signature(scope: str, expires: int) -> str:
+    message = f'{scope}.{expires}'.encode()
+    return hmac.new(CHANGE_FEED_TICKET_SECRET.encode(), message, hashlib.sha256).hexdigest()
+
+def issue_ticket(user_id: Optional[int]) -> Optional[str]:
+    '''Короткоживущий билет на чтение ленты для EventSource, который не умеет ставить заголовки.
+
+    Билет подписан CHANGE_FEED_TICKET_SECRET и действует CHANGE_FEED_TICKET_TTL секунд:
+    в адресе запроса оказывается он, а не токен сессии или ADMIN_API_TOKEN. user_id None - лента поддержки.
+    Без заданного секрета билеты не выдаются.
+    '''
+    if not CHANGE_FEED_TICKET_SECRET:
+        return None
+    scope = 'admin' if user_id is None else f'user{int(user_id)}'
+    expires = int(time.time()) + CHANGE_FEED_TICKET_TTL
+    return f'{scope}.{expires}.{_ticket_signature(scope, expires)}'
+
+def verify_ticket(ticket: str) -> Tuple[bool, Optional[int]]:
+    '''(valid, user_id) по билету из issue_ticket; user_id None у действительного билета - лента поддержки.'''
+    parts = ticket.split('.')
+    if not CHANGE_FEED_TICKET_SECRET or len(parts) != 3 or not parts[1].isdigit():
+        return False, None
+    scope, expires, signature = parts[0], int(parts[1]), parts[2]
+    if expires < time.time() or not hmac.compare_digest(signature, _ticket_signature(scope, expires)):
+        return False, None
+    if scope == 'admin':
+        return True, None
+    if scope.startswith('user') and scope[4:].isdigit():
+        return True, int(scope[4:])
+    return False, None
+
+def _close_listener():
+    global _listener
+    if _listener is not None and not _listener.closed:
+        _listener.close()
+    _listener = None
+
+def _ensure_listener() -> bool:
+    '''Слушатель - отдельное соединение вне пула в autocommit; вызывается под _listener_lock.'''
+    global _listener, _listener_retry_at
+    if _listener is not None and not _listener.closed:
+        return True
+    if time.monotonic() < _listener_retry_at:
+        return False
+    _listener_retry_at = time.monotonic() + CHANGE_FEED_LISTEN_RETRY
+    try:
+        _listener = psycopg2.connect(DATABASE_URL, connect_timeout=CONNECT_TIMEOUT)
+        _listener.autocommit = True
+        with _listener.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANGE_FEED_CHANNEL}')
+    except psycopg2.Error as e:
+        logger.warning('change_feed listener unavailable: %s', e)
+        _close_listener()
+        return False
+    return True
+
+def _drain():
+    '''Забирает уведомления из сокета слушателя; poll() не отправляет запрос в базу.'''
+    global _generation
+    try:
+        _listener.poll()
+    except psycopg2.Error as e:
+        logger.warning('change_feed listener lost: %s', e)
+        _close_listener()
+        return
+    _generation += len(_listener.notifies)
+    _listener.notifies.clear()
+
+def notification_generation() -> int:
+    '''Число полученных NOTIFY; запоминается до чтения событий, чтобы уведомление между чтением и ожиданием не потерялось.'''
+    with _listener_lock:
+        if _ensure_listener():
+            _drain()
+        return _generation
+
+def wait_for_notification(generation: int, timeout: float) -> bool:
+    '''Ждёт NOTIFY после generation не дольше timeout; True - пора перечитать события.
+
+    Сокет слушает один поток за раз отрезками не длиннее секунды, остальные видят
+    изменение _generation. Без слушателя ожидание превращается в редкий опрос.
+    '''
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if not _listener_lock.acquire(timeout=remaining):
+            return False
+        try:
+            if _generation != generation:
+                return True
+            listening = _ensure_listener()
+            if listening:
+                ready, _, _ = select.select([_listener], [], [], min(remaining, 1.0))
+                if ready:
+                    _drain()
+                if _generation != generation:
+                    return True
+        finally:
+            _listener_lock.release()
+        if not listening:
+            time.sleep(min(remaining, 1.0))
+            return True
+
+def parse_topics(raw: Optional[str]) -> Optional[List[str]]:
+    '''Темы из "order,ticket"; None, если есть неизвестная.'''
+    if not raw:
+        return list(CHANGE_FEED_TOPICS)
+    topics = [topic.strip() for topic in raw.split(',') if topic.strip()]
+    if not topics or any(topic not in CHANGE_FEED_TOPICS for topic in topics):
+        return None
+    return topics
+
+def feed_bounds(cursor, after_id: int) -> Tuple[int, int]:
+    '''(head, oldest): head - последний id, до которого лента непрерывна.
+
+    id выдаются при INSERT, а видны после COMMIT, поэтому событие 12 может появиться раньше 11.
+    Дыра в id моложе CHANGE_FEED_GAP_GRACE считается незавершённой транзакцией, и head
+    останавливается на последнем видимом id перед ней (дыра бывает длиннее одного id);
+    более старая дыра - откат, её пропускаем.
+    '''
+    cursor.execute(
+        f"""WITH first_after_gap AS (
+                SELECT MIN(e.id) AS id FROM {SCHEMA}.change_events e
+                WHERE e.id > %s + 1
+                  AND e.created_at > clock_timestamp() - make_interval(secs => %s)
+                  AND NOT EXISTS (SELECT 1 FROM {SCHEMA}.change_events p WHERE p.id = e.id - 1)
+            )
+            SELECT
+                CASE WHEN g.id IS NOT NULL THEN COALESCE(
+                    (SELECT MAX(p.id) FROM {SCHEMA}.change_events p WHERE p.id < g.id), 0
+                ) END AS gap,
+                (SELECT MAX(id) FROM {SCHEMA}.change_events) AS last_id,
+                (SELECT MIN(id) FROM {SCHEMA}.change_events) AS oldest
+            FROM first_after_gap g""",
+        (after_id, CHANGE_FEED_GAP_GRACE)
+    )
+    row = cursor.fetchone()
+    head = row['gap'] if row['gap'] is not None else (row['last_id'] or 0)
+    return max(head, after_id), row['oldest'] or 0
+
+def fetch_changes(cursor, after_id: Optional[int], user_id: Optional[int], topics: Sequence[str],
+                  limit: int = CHANGE_FEED_BATCH) -> Tuple[List[Dict[str, Any]], int]:
+    '''События после after_id, видимые зрителю: пользователю - свои, поддержке (user_id None; доступ проверяет маршрут) - все.
+
+    Без курсора возвращается только head: клиент загружает списки и дальше читает дельты от него.
+    Курсор продвигается и через чужие события, чтобы следующий запрос их не просматривал.
+    '''
+    head, oldest = feed_bounds(cursor, after_id or 0)
+    if after_id is None:
+        return [], head
+    if oldest and after_id + 1 < oldest:
+        raise CursorExpired(head)
+    if head <= after_id:
+        return [], after_id
+
+    conditions = ['id > %s', 'id <= %s', 'topic = ANY(%s)']
+    values: List[Any] = [after_id, head, list(topics)]
+    if user_id is not None:
+        conditions.append('user_id = %s')
+        values.append(user_id)
+    values.append(limit)
+    cursor.execute(
+        f"""SELECT id, topic, op, entity_id, payload, created_at
+            FROM {SCHEMA}.change_events
+            WHERE {' AND '.join(conditions)}
+            ORDER BY id LIMIT %s""",
+        values
+    )
+    events = cursor.fetchall()
+    if len(events) == limit:
+        return events, events[-1]['id']
+    return events, head
+
+def read_changes(conn, cursor, after_id: Optional[int], user_id: Optional[int], topics: Sequence[str],
+                 wait: float, limit: int = CHANGE_FEED_BATCH) -> Tuple[List[Dict[str, Any]], int]:
+    '''Long-poll: отдаёт события сразу, если они есть, иначе ждёт NOTIFY до wait секунд.
+
+    Транзакция закрывается перед ожиданием, чтобы соединение пула не висело idle in transaction.
+    Ожидание режется на отрезки по CHANGE_FEED_GAP_GRACE: дыра от отката NOTIFY не пришлёт.
+    '''
+    deadline = time.monotonic() + wait
+    while True:
+        generation = notification_generation()
+        events, next_id = fetch_changes(cursor, after_id, user_id, topics, limit)
+        conn.rollback()
+        remaining = deadline - time.monotonic()
+        if events or after_id is None or remaining <= 0:
+            return events, next_id
+        after_id = next_id
+        wait_for_notification(generation, min(remaining, CHANGE_FEED_GAP_GRACE))
+
+def format_sse(events: List[Dict[str, Any]], next_id: int, dumps) -> str:
+    '''Пачка событий в формате text/event-stream; последний id: без data сдвигает Last-Event-ID у EventSource.'''
+    parts = ['retry: 1000\n\n']
+    for event in events:
+        parts.append(f"id: {event['id']}\nevent: {event['topic']}\ndata: {dumps(event)}\n\n")
+    parts.append(f'id: {next_id}\n\n')
+    return ''.join(parts)
+
+def prune_change_events(conn, deadline: Optional[float] = None) -> Dict[str, int]:
+    '''Удаляет события старше CHANGE_FEED_RETENTION_HOURS пачками, коммитя каждую.'''
+    stats = {'deleted': 0, 'batches': 0}
+    while deadline is None or time.monotonic() < deadline:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {SCHEMA}.prune_change_events(make_interval(secs => %s))",
+                (CHANGE_FEED_RETENTION_HOURS * 3600,)
+            )
+            deleted = cursor.fetchone()[0]
+        conn.commit()
+        if not deleted:
+            break
+        stats['deleted'] += deleted
+        stats['batches'] += 1
+    return stats
@@ -6,48 +6,73 @@ Returns: Данные пользователей, токены авториза
 
 import json
 import os
-import uuid
-import hashlib
-import secrets
-import base64
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, Callable, List, Optional, Tuple
 from datetime import datetime, timedelta
-from decimal import Decimal
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import urllib.request
+from timing import instrumented, urlopen
+from cache import TTLCache
+from outbox import enqueue_message
+from ledger import record_entry
+from sessions import enforce_session_cap, sweep_expired_sessions
+from auth_log import flush_auth_logs, flush_due, log_auth_event, request_origin
+from responses import dumps_with_fragments, json_response
+from statements import execute_prepared, prepared_statement
+
+# Тяжёлые зависимости (psycopg2, urllib.request, uuid, base64, secrets) импортируются внутри
+# маршрутов, которым они нужны: холодный старт платит только за модули своего маршрута
 
-DATABASE_URL = os.environ.get('DATABASE_URL')
-TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 YOOKASSA_SHOP_ID = os.environ.get('YOOKASSA_SHOP_ID', '')
 YOOKASSA_SECRET_KEY = os.environ.get('YOOKASSA_SECRET_KEY', '')
+YOOKASSA_TIMEOUT = float(os.environ.get('YOOKASSA_TIMEOUT', '10'))
 SCHEMA = 't_p8741694_magazin_samp'
+BALANCE_CURRENCY = 'RUB'
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '2048'))
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '30'))
+SESSION_NEGATIVE_TTL = float(os.environ.get('SESSION_NEGATIVE_TTL', '10'))
+OUTBOX_DRAIN_SECRET = os.environ.get('OUTBOX_DRAIN_SECRET', '')
+OUTBOX_DRAIN_SECONDS = float(os.environ.get('OUTBOX_DRAIN_SECONDS', '20'))
+SESSION_SWEEP_SECRET = os.environ.get('SESSION_SWEEP_SECRET', '')
+SESSION_SWEEP_SECONDS = float(os.environ.get('SESSION_SWEEP_SECONDS', '20'))
+CHANGE_FEED_SWEEP_SECRET = os.environ.get('CHANGE_FEED_SWEEP_SECRET', '')
+TELEGRAM_POLL_SECRET = os.environ.get('TELEGRAM_POLL_SECRET', '')
+TELEGRAM_POLL_SECONDS = float(os.environ.get('TELEGRAM_POLL_SECONDS', '20'))
+ADMIN_API_TOKEN = os.environ.get('ADMIN_API_TOKEN', '')
+SUPPORT_PAGE_SIZE = 50
+SUPPORT_MESSAGE_MAX = 4000
 
-def decimal_to_float(obj):
-    if isinstance(obj, Decimal):
-        return float(obj)
-    raise TypeError
+# Горячие запросы готовятся один раз на соединение пула (statements.execute_prepared)
+SESSION_BY_TOKEN = prepared_statement(
+    'session_by_token',
+    f"""SELECT s.user_id, s.expires_at, u.username, u.email, u.balance, u.status
+        FROM {SCHEMA}.user_sessions s
+        JOIN {SCHEMA}.users u ON s.user_id = u.id
+        WHERE s.session_token = %s AND s.expires_at > %s"""
+)
+USER_BY_TELEGRAM_ID = prepared_statement(
+    'user_by_telegram_id', f"SELECT id FROM {SCHEMA}.users WHERE telegram_id = %s"
+)
+PRODUCT_PRICE_BY_ID = prepared_statement(
+    'product_price_by_id', f"SELECT title, price_amount, price_currency FROM {SCHEMA}.products WHERE id = %s"
+)
 
-def send_telegram_message(chat_id: int, text: str):
-    if not TELEGRAM_BOT_TOKEN:
-        return
-    try:
-        url = f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage'
-        data = json.dumps({'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'}).encode('utf-8')
-        req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
-        urllib.request.urlopen(req)
-    except:
-        pass
+_session_cache = TTLCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+_processed_payments = TTLCache(4096, 3600)
+_MISSING = object()
 
 def generate_session_token() -> str:
+    import secrets
     return secrets.token_urlsafe(32)
 
-def create_yookassa_payment(amount: float, order_id: int, description: str) -> Dict:
+def create_yookassa_payment(amount: float, order_id: int, description: str, currency: str = 'RUB') -> Dict:
+    import base64
+    import uuid
+    import urllib.request
+    
     url = 'https://api.yookassa.ru/v3/payments'
     idempotence_key = str(uuid.uuid4())
     
     payload = {
-        'amount': {'value': f'{amount:.2f}', 'currency': 'RUB'},
+        'amount': {'value': f'{amount:.2f}', 'currency': currency},
         'confirmation': {
             'type': 'redirect',
             'return_url': 'https://magazin-samp.poehali.dev/payment-success'
@@ -66,21 +91,71 @@ def create_yookassa_payment(amount: float, order_id: int, description: str) -> D
     
     data = json.dumps(payload).encode('utf-8')
     req = urllib.request.Request(url, data=data, headers=headers)
-    response = urllib.request.urlopen(req)
+    response = urlopen(req, timeout=YOOKASSA_TIMEOUT)
     return json.loads(response.read().decode('utf-8'))
 
-def get_user_from_session(cursor, session_token: str) -> Optional[int]:
-    cursor.execute(
-        f"""SELECT user_id FROM {SCHEMA}.user_sessions 
-            WHERE session_token = %s AND expires_at > %s""",
-        (session_token, datetime.now())
-    )
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def estimate_count(cursor, where: str, values: list) -> int:
+    '''Оценка числа строк из плана запроса вместо полного count(*).'''
+    cursor.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {SCHEMA}.users {where}", values)
+    plan = cursor.fetchone()['QUERY PLAN']
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def get_session_user(cursor, session_token: str, cache_missing: bool = True) -> Optional[Dict[str, Any]]:
+    cached = _session_cache.get(session_token, _MISSING)
+    if cached is not _MISSING:
+        return cached
+    
+    execute_prepared(cursor, SESSION_BY_TOKEN, (session_token, datetime.now()))
     result = cursor.fetchone()
-    return result['user_id'] if result else None
+    
+    if not result:
+        if cache_missing:
+            _session_cache.set(session_token, None, SESSION_NEGATIVE_TTL)
+        return None
+    
+    session = dict(result)
+    expires_at = session.pop('expires_at')
+    ttl = min(SESSION_CACHE_TTL, (expires_at - datetime.now()).total_seconds())
+    _session_cache.set(session_token, session, ttl)
+    return session
+
+def get_user_from_session(cursor, session_token: str) -> Optional[int]:
+    session = get_session_user(cursor, session_token)
+    return session['user_id'] if session else None
+
+def invalidate_user_sessions(user_id: Any):
+    _session_cache.discard_where(lambda session: session is not None and str(session['user_id']) == str(user_id))
+
+TelegramEffects = Tuple[List[str], List[Tuple[str, str, Optional[int], Optional[str]]]]
 
 def handle_telegram_bot(update: Dict, cursor, conn) -> Dict:
+    from telegram_updates import claim_updates, prune_updates, remember, seen_recently
+    
+    update_id = update.get('update_id')
+    if update_id is not None:
+        # Telegram повторяет доставку, если ответ задержался: повтор подтверждаем, не обрабатывая
+        if seen_recently(update_id) or not claim_updates(cursor, [update_id]):
+            conn.rollback()
+            return {'statusCode': 200, 'body': json.dumps({'ok': True, 'duplicate': True})}
+        if update_id % 1000 == 0:
+            prune_updates(cursor)
+    
+    effects = apply_telegram_update(cursor, update)
+    conn.commit()
+    if update_id is not None:
+        remember([update_id])
+    finish_telegram_update(effects)
+    return {'statusCode': 200, 'body': json.dumps({'ok': True})}
+
+def apply_telegram_update(cursor, update: Dict) -> TelegramEffects:
+    '''Изменения в базе по одному обновлению без COMMIT: общий код вебхука и воркера getUpdates.'''
     if 'message' not in update:
-        return {'statusCode': 200, 'body': 'ok'}
+        return [], []
     
     message = update['message']
     chat_id = message['chat']['id']
@@ -88,46 +163,49 @@ def handle_telegram_bot(update: Dict, cursor, conn) -> Dict:
     telegram_username = message['from'].get('username', '')
     telegram_id = message['from']['id']
     first_name = message['from'].get('first_name', 'Пользователь')
+    evicted_tokens = []
+    auth_events = []
     
     if text == '/start':
+        username = telegram_username or f"user_{telegram_id}"
+        email = f"{telegram_id}@telegram.user"
+        
+        # Два параллельных /start не создают двух пользователей: второй упирается в uq_users_telegram_id
         cursor.execute(
-            f"SELECT id FROM {SCHEMA}.users WHERE telegram_id = %s",
-            (telegram_id,)
+            f"""INSERT INTO {SCHEMA}.users 
+            (username, email, telegram_id, telegram_username, created_at) 
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (telegram_id) DO NOTHING
+            RETURNING id""",
+            (username, email, telegram_id, telegram_username, datetime.now())
         )
-        user = cursor.fetchone()
+        created = cursor.fetchone()
         
-        if user:
-            send_telegram_message(
+        if not created:
+            execute_prepared(cursor, USER_BY_TELEGRAM_ID, (telegram_id,))
+            user = cursor.fetchone()
+            enqueue_message(
+                cursor,
                 chat_id,
                 f"✅ <b>Вы уже зарегистрированы!</b>\n\nВаш ID: <code>{user['id']}</code>\nИспользуйте /login для входа."
             )
         else:
-            username = telegram_username or f"user_{telegram_id}"
-            email = f"{telegram_id}@telegram.user"
-            
-            cursor.execute(
-                f"""INSERT INTO {SCHEMA}.users 
-                (username, email, telegram_id, telegram_username, created_at) 
-                VALUES (%s, %s, %s, %s, %s) RETURNING id""",
-                (username, email, telegram_id, telegram_username, datetime.now())
-            )
-            user_id = cursor.fetchone()['id']
-            conn.commit()
+            user_id = created['id']
+            auth_events.append(('telegram_register', 'success', user_id, username))
             
-            send_telegram_message(
+            enqueue_message(
+                cursor,
                 chat_id,
                 f"🎉 <b>Добро пожаловать, {first_name}!</b>\n\n✅ Регистрация завершена\n🆔 ID: <code>{user_id}</code>\n\nИспользуйте /login для входа."
             )
     
     elif text == '/login':
-        cursor.execute(
-            f"SELECT id FROM {SCHEMA}.users WHERE telegram_id = %s",
-            (telegram_id,)
-        )
+        execute_prepared(cursor, USER_BY_TELEGRAM_ID, (telegram_id,))
         user = cursor.fetchone()
         
         if not user:
-            send_telegram_message(chat_id, "❌ Вы не зарегистрированы. Используйте /start")
+            enqueue_message(cursor, chat_id, "❌ Вы не зарегистрированы. Используйте /start")
+            auth_events.append(('telegram_login', 'failed', None, telegram_username or None))
         else:
             session_token = generate_session_token()
             expires_at = datetime.now() + timedelta(days=30)
@@ -137,450 +215,1074 @@ def handle_telegram_bot(update: Dict, cursor, conn) -> Dict:
                 VALUES (%s, %s, %s)""",
                 (user['id'], session_token, expires_at)
             )
+            evicted_tokens = enforce_session_cap(cursor, user['id'])
+            auth_events.append(('telegram_login', 'success', user['id'], telegram_username or None))
             cursor.execute(
                 f"UPDATE {SCHEMA}.users SET last_login = %s WHERE id = %s",
                 (datetime.now(), user['id'])
             )
-            conn.commit()
             
             login_url = f"https://magazin-samp.poehali.dev/auth?token={session_token}"
-            send_telegram_message(
+            enqueue_message(
+                cursor,
                 chat_id,
                 f"🔐 <b>Ссылка для входа:</b>\n{login_url}\n\n⏰ Действительна 30 дней"
             )
     else:
-        send_telegram_message(
+        enqueue_message(
+            cursor,
             chat_id,
             "ℹ️ <b>Команды:</b>\n/start - Регистрация\n/login - Вход"
         )
     
-    return {'statusCode': 200, 'body': json.dumps({'ok': True})}
+    return evicted_tokens, auth_events
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
+def finish_telegram_update(effects: TelegramEffects):
+    '''После COMMIT: сброс вытесненных сессий из кэша и журнал входов.'''
+    evicted_tokens, auth_events = effects
+    for token in evicted_tokens:
+        _session_cache.pop(token)
+    for action, status, user_id, username in auth_events:
+        log_auth_event(action, status, user_id, username)
+
+class Request:
+    '''Разобранный event; соединение и курсор подставляет handler, сессия читается только по требованию маршрута.'''
+
+    def __init__(self, event: Dict[str, Any]):
+        self.method: str = event.get('httpMethod', 'GET')
+        self.params = event.get('queryStringParameters') or {}
+        self.headers = event.get('headers') or {}
+        self.body = json.loads(event.get('body', '{}')) if event.get('body') else {}
+        self.action = self.params.get('action') or self.body.get('action', '')
+        self.ip_address, self.user_agent = request_origin(event)
+        self.cursor = None
+        self.conn = None
+        self._session = _MISSING
+
+    def log_auth(self, action: str, status: str, user_id: Optional[int] = None, username: Optional[str] = None):
+        log_auth_event(action, status, user_id, username, self.ip_address, self.user_agent)
+
+    @property
+    def session_token(self) -> Optional[str]:
+        return self.headers.get('x-session-token') or self.headers.get('X-Session-Token')
+
+    @property
+    def session(self) -> Optional[Dict[str, Any]]:
+        if self._session is _MISSING:
+            token = self.session_token
+            on_replica = getattr(self.conn, 'role', None) == 'replica'
+            self._session = get_session_user(self.cursor, token, not on_replica) if token else None
+            if token and self._session is None and on_replica:
+                # Сессию мог только что создать вход, а реплика её ещё не проиграла
+                from psycopg2.extras import RealDictCursor
+                from db import db_connection
+                
+                with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    self._session = get_session_user(cursor, token)
+        return self._session
+
+    @property
+    def user_id(self) -> Optional[int]:
+        return self.session['user_id'] if self.session else None
     
-    if method == 'OPTIONS':
+    @property
+    def is_admin(self) -> bool:
+        '''X-Admin-Auth совпадает с ADMIN_API_TOKEN; без заданного токена админского доступа нет.'''
+        import secrets
+        
+        token = self.headers.get('x-admin-auth') or self.headers.get('X-Admin-Auth') or ''
+        return bool(ADMIN_API_TOKEN) and secrets.compare_digest(token, ADMIN_API_TOKEN)
+
+Route = Callable[[Request], Dict[str, Any]]
+
+def cron_forbidden(request: Request, secret: str) -> Optional[Dict[str, Any]]:
+    '''403, если X-Cron-Secret не совпадает с secret; без заданного секрета маршрут закрыт.'''
+    import secrets
+    
+    cron_secret = request.headers.get('x-cron-secret') or request.headers.get('X-Cron-Secret') or ''
+    if secret and secrets.compare_digest(cron_secret, secret):
+        return None
+    return {
+        'statusCode': 403,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Forbidden'})
+    }
+
+def route_telegram(request: Request) -> Dict[str, Any]:
+    return handle_telegram_bot(request.body, request.cursor, request.conn)
+
+def route_drain_outbox(request: Request) -> Dict[str, Any]:
+    from outbox import drain_outbox
+    
+    forbidden = cron_forbidden(request, OUTBOX_DRAIN_SECRET)
+    if forbidden:
+        return forbidden
+    
+    stats = drain_outbox(request.conn, deadline=time.monotonic() + OUTBOX_DRAIN_SECONDS)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(stats)
+    }
+
+def route_telegram_poll(request: Request) -> Dict[str, Any]:
+    from outbox import TelegramError
+    from telegram_updates import poll_updates
+    
+    forbidden = cron_forbidden(request, TELEGRAM_POLL_SECRET)
+    if forbidden:
+        return forbidden
+    
+    # Режим без вебхука: обновления забираются getUpdates и обрабатываются пачками
+    try:
+        stats = poll_updates(
+            request.conn, apply_telegram_update, finish_telegram_update,
+            deadline=time.monotonic() + TELEGRAM_POLL_SECONDS
+        )
+    except TelegramError as e:
         return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Session-Token, X-Admin-Auth, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
+            'statusCode': 502,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'getUpdates failed: {e}'})
         }
     
-    conn = psycopg2.connect(DATABASE_URL)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(stats)
+    }
+
+def route_sweep_sessions(request: Request) -> Dict[str, Any]:
+    forbidden = cron_forbidden(request, SESSION_SWEEP_SECRET)
+    if forbidden:
+        return forbidden
+
+    stats = sweep_expired_sessions(request.conn, deadline=time.monotonic() + SESSION_SWEEP_SECONDS)
     
-    params = event.get('queryStringParameters') or {}
-    headers = event.get('headers') or {}
-    body_data = json.loads(event.get('body', '{}')) if event.get('body') else {}
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(stats)
+    }
+
+def route_sweep_changes(request: Request) -> Dict[str, Any]:
+    from changefeed import prune_change_events
     
-    action = params.get('action') or body_data.get('action', '')
+    forbidden = cron_forbidden(request, CHANGE_FEED_SWEEP_SECRET)
+    if forbidden:
+        return forbidden
     
-    if 'update_id' in body_data or 'message' in body_data:
-        result = handle_telegram_bot(body_data, cursor, conn)
-        cursor.close()
-        conn.close()
-        return result
+    stats = prune_change_events(request.conn, deadline=time.monotonic() + SESSION_SWEEP_SECONDS)
     
-    if action == 'auth':
-        token = params.get('token')
-        
-        if not token:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Token required'})
-            }
-        
-        cursor.execute(
-            f"""SELECT s.session_token, s.expires_at, s.user_id,
-                u.username, u.email, u.balance, u.telegram_username
-                FROM {SCHEMA}.user_sessions s
-                JOIN {SCHEMA}.users u ON s.user_id = u.id
-                WHERE s.session_token = %s AND s.expires_at > %s""",
-            (token, datetime.now())
-        )
-        
-        session = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        if not session:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid or expired token'})
-            }
-        
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(stats)
+    }
+
+def route_auth(request: Request) -> Dict[str, Any]:
+    cursor = request.cursor
+    token = request.params.get('token')
+    
+    if not token:
         return {
-            'statusCode': 200,
+            'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'user': {
-                    'id': session['user_id'],
-                    'username': session['username'],
-                    'email': session['email'],
-                    'balance': float(session['balance']) if session['balance'] else 0.0,
-                    'telegram_username': session['telegram_username']
-                },
-                'session_token': session['session_token']
-            }, default=decimal_to_float)
-        }
-    
-    session_token = headers.get('x-session-token') or headers.get('X-Session-Token')
-    user_id = get_user_from_session(cursor, session_token) if session_token else None
-    
-    if action == 'verify':
-        if not user_id:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'authenticated': False})
-            }
-        
-        cursor.execute(
-            f"SELECT username, email, balance, status FROM {SCHEMA}.users WHERE id = %s",
-            (user_id,)
-        )
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
+            'body': json.dumps({'error': 'Token required'})
+        }
+    
+    cursor.execute(
+        f"""SELECT s.session_token, s.expires_at, s.user_id,
+            u.username, u.email, u.balance, u.telegram_username
+            FROM {SCHEMA}.user_sessions s
+            JOIN {SCHEMA}.users u ON s.user_id = u.id
+            WHERE s.session_token = %s AND s.expires_at > %s""",
+        (token, datetime.now())
+    )
+    
+    session = cursor.fetchone()
+    
+    if not session:
+        request.log_auth('login', 'failed')
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid or expired token'})
+        }
+    
+    request.log_auth('login', 'success', session['user_id'], session['username'])
+    
+    return json_response(200, {
+        'user': {
+            'id': session['user_id'],
+            'username': session['username'],
+            'email': session['email'],
+            'balance': float(session['balance']) if session['balance'] else 0.0,
+            'telegram_username': session['telegram_username']
+        },
+        'session_token': session['session_token']
+    })
+
+def route_verify(request: Request) -> Dict[str, Any]:
+    session = request.session
+    
+    if not session:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'authenticated': False})
+        }
+    
+    return json_response(200, {
+        'authenticated': True,
+        'user': {key: session[key] for key in ('username', 'email', 'balance', 'status')}
+    })
+
+def route_logout(request: Request) -> Dict[str, Any]:
+    session_token = request.session_token
+    
+    if not session_token:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Session token required'})
+        }
+    
+    session = request.session
+    request.cursor.execute(f"DELETE FROM {SCHEMA}.user_sessions WHERE session_token = %s", (session_token,))
+    request.conn.commit()
+    _session_cache.pop(session_token)
+    if session:
+        request.log_auth('logout', 'success', session['user_id'], session['username'])
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True})
+    }
+
+def route_payment(request: Request) -> Dict[str, Any]:
+    cursor = request.cursor
+    user_id = request.user_id
+    
+    if not user_id:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'})
+        }
+    
+    if not (YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY):
+        return {
+            'statusCode': 503,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Payments are not configured'})
+        }
+    
+    product_id = request.body.get('product_id')
+    
+    execute_prepared(cursor, PRODUCT_PRICE_BY_ID, (product_id,))
+    product = cursor.fetchone()
+    
+    if not product:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Product not found'})
+        }
+    
+    if product['price_amount'] is None:
+        return {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Product price is not set'})
+        }
+    
+    price = float(product['price_amount'])
+    currency = product['price_currency'] or 'RUB'
+    auto_delivery_text = f"Товар: {product['title']}\nДоступ предоставлен автоматически."
+    
+    cursor.execute(
+        f"""INSERT INTO {SCHEMA}.orders 
+            (user_id, product_id, status, auto_delivery_content, delivery_status, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s) RETURNING id""",
+        (user_id, product_id, 'pending', auto_delivery_text, 'pending', datetime.now())
+    )
+    order_id = cursor.fetchone()['id']
+    
+    payment_response = create_yookassa_payment(
+        price, order_id, f"Оплата заказа #{order_id} - {product['title']}", currency
+    )
+    
+    cursor.execute(
+        f"""INSERT INTO {SCHEMA}.payments 
+            (user_id, order_id, amount, currency, payment_method, payment_status, transaction_id, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+        (user_id, order_id, price, currency, 'yookassa', 'pending', payment_response['id'], datetime.now())
+    )
+    request.conn.commit()
+    
+    return json_response(200, {
+        'payment_url': payment_response['confirmation']['confirmation_url'],
+        'order_id': order_id,
+        'amount': price,
+        'currency': currency
+    })
+
+def route_payment_webhook(request: Request) -> Dict[str, Any]:
+    cursor = request.cursor
+    conn = request.conn
+    payment_data = request.body['object']
+    payment_id = payment_data['id']
+    order_id = int(payment_data['metadata']['order_id'])
+    
+    if _processed_payments.get(payment_id):
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'status': 'duplicate'})
+        }
+    
+    cursor.execute(
+        f"""INSERT INTO {SCHEMA}.payment_events (payment_id, event, order_id)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (payment_id, event) DO NOTHING
+            RETURNING payment_id""",
+        (payment_id, 'payment.succeeded', order_id)
+    )
+    
+    if not cursor.fetchone():
+        conn.commit()
+        _processed_payments.set(payment_id, True)
         return {
             'statusCode': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'status': 'duplicate'})
+        }
+    
+    cursor.execute(
+        f"""UPDATE {SCHEMA}.orders 
+            SET status = %s, delivery_status = %s, delivered_at = %s 
+            WHERE id = %s AND status IS DISTINCT FROM %s""",
+        ('completed', 'delivered', datetime.now(), order_id, 'completed')
+    )
+    cursor.execute(
+        f"""UPDATE {SCHEMA}.payments 
+            SET payment_status = %s, completed_at = %s 
+            WHERE transaction_id = %s AND payment_status IS DISTINCT FROM %s""",
+        ('completed', datetime.now(), payment_id, 'completed')
+    )
+    conn.commit()
+    _processed_payments.set(payment_id, True)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'status': 'processed'})
+    }
+
+def route_purchase_with_balance(request: Request) -> Dict[str, Any]:
+    '''Покупка с баланса одной транзакцией: условное списание, заказ и запись в журнал операций.'''
+    cursor = request.cursor
+    conn = request.conn
+    user_id = request.user_id
+    
+    if not user_id:
+        return {
+            'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'authenticated': True,
-                'user': dict(user) if user else None
-            }, default=decimal_to_float)
+            'body': json.dumps({'error': 'Unauthorized'})
         }
     
-    if action == 'payment':
-        if not user_id:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Unauthorized'})
-            }
-        
-        product_id = body_data.get('product_id')
-        
-        cursor.execute(
-            f"SELECT title, price FROM {SCHEMA}.products WHERE id = %s",
-            (product_id,)
-        )
-        product = cursor.fetchone()
-        
-        if not product:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Product not found'})
-            }
-        
-        price = float(product['price'].replace('₽', '').replace(' ', '').strip())
-        auto_delivery_text = f"Товар: {product['title']}\nДоступ предоставлен автоматически."
-        
+    product_id = request.body.get('product_id')
+    
+    execute_prepared(cursor, PRODUCT_PRICE_BY_ID, (product_id,))
+    product = cursor.fetchone()
+    
+    if not product:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Product not found'})
+        }
+    
+    if product['price_amount'] is None or (product['price_currency'] or 'RUB') != BALANCE_CURRENCY:
+        return {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'Product is not priced in {BALANCE_CURRENCY}'})
+        }
+    
+    price = product['price_amount']
+    
+    # Условный UPDATE блокирует строку пользователя до конца транзакции: параллельные покупки
+    # выстраиваются в очередь и проверяют уже уменьшенный баланс, поэтому уйти в минус нельзя
+    cursor.execute(
+        f"""UPDATE {SCHEMA}.users 
+            SET balance = balance - %s 
+            WHERE id = %s AND balance >= %s
+            RETURNING balance, username, email""",
+        (price, user_id, price)
+    )
+    account = cursor.fetchone()
+    
+    if not account:
+        conn.rollback()
+        return {
+            'statusCode': 402,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Insufficient balance'})
+        }
+    
+    auto_delivery_text = f"Товар: {product['title']}\nДоступ предоставлен автоматически."
+    items = [{'id': product_id, 'title': product['title'], 'quantity': 1, 'price': float(price)}]
+    
+    cursor.execute(
+        f"""INSERT INTO {SCHEMA}.orders 
+            (customer_name, customer_email, items, total_price, status, user_id, product_id,
+             auto_delivery_content, delivery_status, delivered_at, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+        (account['username'], account['email'], json.dumps(items, ensure_ascii=False), price,
+         'completed', user_id, product_id, auto_delivery_text, 'delivered', datetime.now(), datetime.now())
+    )
+    order_id = cursor.fetchone()['id']
+    
+    record_entry(cursor, user_id, -price, account['balance'], 'purchase', f"Покупка: {product['title']} (заказ #{order_id})")
+    conn.commit()
+    invalidate_user_sessions(user_id)
+    
+    return json_response(200, {
+        'success': True,
+        'order_id': order_id,
+        'amount': price,
+        'currency': BALANCE_CURRENCY,
+        'new_balance': account['balance'],
+        'auto_delivery_content': auto_delivery_text
+    })
+
+def route_support_list(request: Request) -> Dict[str, Any]:
+    from pagination import parse_limit, decode_cursor, fetch_json_page
+    
+    params = request.params
+    user_id = request.user_id
+    limit = parse_limit(params.get('limit'), SUPPORT_PAGE_SIZE)
+    
+    if not user_id and not request.is_admin:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'})
+        }
+    
+    try:
+        cursor_values = decode_cursor(params.get('cursor'))
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid cursor'})
+        }
+    
+    # Пользователь видит свои тикеты и непрочитанные ответы поддержки, поддержка - все тикеты и ответы пользователей
+    unread_column = 'unread_by_user' if user_id else 'unread_by_admin'
+    conditions = []
+    values = []
+    if user_id:
+        conditions.append('t.user_id = %s')
+        values.append(user_id)
+    for column in ('status', 'priority'):
+        if params.get(column):
+            conditions.append(f't.{column} = %s')
+            values.append(params[column])
+    if params.get('unread') in ('1', 'true'):
+        conditions.append(f't.{unread_column} > 0')
+    if cursor_values:
+        conditions.append('(t.created_at, t.id) < (%s::timestamp, %s)')
+        values.extend(cursor_values)
+    values.append(limit + 1)
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    username = '' if user_id else ', u.username'
+    join = '' if user_id else f'JOIN {SCHEMA}.users u ON t.user_id = u.id'
+    tickets_json, next_cursor = fetch_json_page(
+        request.cursor,
+        f"""SELECT t.id, t.subject, t.status, t.priority, t.created_at, t.updated_at,
+                t.message_count, t.last_message_at, t.{unread_column} AS unread_count{username}
+            FROM {SCHEMA}.support_tickets t {join}
+            {where}
+            ORDER BY t.created_at DESC, t.id DESC LIMIT %s""",
+        values,
+        limit
+    )
+    
+    return json_response(200, body=dumps_with_fragments(
+        {'next_cursor': next_cursor, 'has_more': next_cursor is not None},
+        tickets=tickets_json
+    ))
+
+def route_support_create(request: Request) -> Dict[str, Any]:
+    cursor = request.cursor
+    user_id = request.user_id
+    
+    if not user_id:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'})
+        }
+    
+    subject = (request.body.get('subject') or '').strip()
+    priority = request.body.get('priority', 'normal')
+    message = (request.body.get('message') or '').strip()
+    
+    if not subject or len(subject) > 500 or len(message) > SUPPORT_MESSAGE_MAX:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'subject is required (up to 500 characters), message up to {SUPPORT_MESSAGE_MAX}'})
+        }
+    
+    cursor.execute(
+        f"""INSERT INTO {SCHEMA}.support_tickets 
+            (user_id, subject, priority, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s) RETURNING id""",
+        (user_id, subject, priority, datetime.now(), datetime.now())
+    )
+    ticket_id = cursor.fetchone()['id']
+    if message:
         cursor.execute(
-            f"""INSERT INTO {SCHEMA}.orders 
-                (user_id, product_id, status, auto_delivery_content, delivery_status, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s) RETURNING id""",
-            (user_id, product_id, 'pending', auto_delivery_text, 'pending', datetime.now())
+            f"""INSERT INTO {SCHEMA}.support_messages (ticket_id, user_id, message, is_admin)
+                VALUES (%s, %s, %s, false)""",
+            (ticket_id, user_id, message)
         )
-        order_id = cursor.fetchone()['id']
-        
-        if YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY:
-            payment_response = create_yookassa_payment(
-                price, order_id, f"Оплата заказа #{order_id} - {product['title']}"
-            )
-            
-            cursor.execute(
-                f"""INSERT INTO {SCHEMA}.payments 
-                    (user_id, order_id, amount, payment_method, payment_status, transaction_id, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)""",
-                (user_id, order_id, price, 'yookassa', 'pending', payment_response['id'], datetime.now())
-            )
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'payment_url': payment_response['confirmation']['confirmation_url'],
-                    'order_id': order_id,
-                    'amount': price
-                }, default=decimal_to_float)
-            }
+    request.conn.commit()
     
-    if 'event' in body_data and body_data.get('event') == 'payment.succeeded':
-        payment_data = body_data['object']
-        payment_id = payment_data['id']
-        order_id = int(payment_data['metadata']['order_id'])
-        
+    return {
+        'statusCode': 201,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'ticket_id': ticket_id, 'status': 'created'})
+    }
+
+def support_unauthorized(request: Request) -> Optional[Dict[str, Any]]:
+    '''401, если запрос не от пользователя с сессией и не от поддержки с X-Admin-Auth.'''
+    if request.user_id or request.is_admin:
+        return None
+    return {
+        'statusCode': 401,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Unauthorized'})
+    }
+
+def get_support_ticket(request: Request, ticket_id: Any) -> Optional[Dict[str, Any]]:
+    '''Тикет, доступный текущему зрителю: пользователю - только свой, поддержке - любой.'''
+    request.cursor.execute(
+        f"SELECT id, user_id, status FROM {SCHEMA}.support_tickets WHERE id = %s",
+        (ticket_id,)
+    )
+    ticket = request.cursor.fetchone()
+    if not ticket or (request.user_id and ticket['user_id'] != request.user_id):
+        return None
+    return ticket
+
+def route_support_messages(request: Request) -> Dict[str, Any]:
+    from pagination import parse_limit
+    
+    cursor = request.cursor
+    params = request.params
+    
+    unauthorized = support_unauthorized(request)
+    if unauthorized:
+        return unauthorized
+    
+    try:
+        ticket_id = int(params.get('ticket_id'))
+        since_id = int(params.get('since_id') or 0)
+    except (TypeError, ValueError):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'ticket_id and since_id must be integers'})
+        }
+    
+    if not get_support_ticket(request, ticket_id):
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Ticket not found'})
+        }
+    
+    # Клиент передаёт id последнего полученного сообщения и получает только новые
+    limit = parse_limit(params.get('limit'), SUPPORT_PAGE_SIZE)
+    cursor.execute(
+        f"""SELECT id, user_id, admin_id, message, is_admin, created_at
+            FROM {SCHEMA}.support_messages
+            WHERE ticket_id = %s AND id > %s
+            ORDER BY id LIMIT %s""",
+        (ticket_id, since_id, limit + 1)
+    )
+    messages = cursor.fetchall()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    last_id = messages[-1]['id'] if messages else since_id
+    
+    side = 'user' if request.user_id else 'admin'
+    unread_count = None
+    if messages and params.get('mark_read') not in ('0', 'false'):
+        # Счётчик уменьшается на сообщения другой стороны между прежней отметкой и last_id;
+        # подзапрос видит отметку строки после блокировки, поэтому параллельные отметки не вычитают дважды
         cursor.execute(
-            f"""UPDATE {SCHEMA}.orders 
-                SET status = %s, delivery_status = %s, delivered_at = %s 
-                WHERE id = %s""",
-            ('completed', 'delivered', datetime.now(), order_id)
+            f"""UPDATE {SCHEMA}.support_tickets t
+                SET unread_by_{side} = GREATEST(t.unread_by_{side} - (
+                        SELECT COUNT(*) FROM {SCHEMA}.support_messages m
+                        WHERE m.ticket_id = t.id AND m.is_admin = %s
+                          AND m.id > t.{side}_read_message_id AND m.id <= %s
+                    ), 0),
+                    {side}_read_message_id = %s
+                WHERE t.id = %s AND t.{side}_read_message_id < %s
+                RETURNING t.unread_by_{side} AS unread_count""",
+            (side == 'user', last_id, last_id, ticket_id, last_id)
         )
+        row = cursor.fetchone()
+        request.conn.commit()
+        unread_count = row['unread_count'] if row else None
+    
+    if unread_count is None:
         cursor.execute(
-            f"""UPDATE {SCHEMA}.payments 
-                SET payment_status = %s, completed_at = %s 
-                WHERE transaction_id = %s""",
-            ('completed', datetime.now(), payment_id)
+            f"SELECT unread_by_{side} AS unread_count FROM {SCHEMA}.support_tickets WHERE id = %s",
+            (ticket_id,)
         )
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
+        unread_count = cursor.fetchone()['unread_count']
+    
+    return json_response(200, {
+        'ticket_id': ticket_id,
+        'messages': messages,
+        'last_id': last_id,
+        'has_more': has_more,
+        'unread_count': unread_count
+    })
+
+def route_support_reply(request: Request) -> Dict[str, Any]:
+    cursor = request.cursor
+    ticket_id = request.body.get('ticket_id')
+    message = (request.body.get('message') or '').strip()
+    
+    unauthorized = support_unauthorized(request)
+    if unauthorized:
+        return unauthorized
+    
+    if not isinstance(ticket_id, int) or not message or len(message) > SUPPORT_MESSAGE_MAX:
         return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'status': 'processed'})
-        }
-    
-    if action == 'support':
-        if method == 'GET':
-            if user_id:
-                cursor.execute(
-                    f"""SELECT id, subject, status, priority, created_at, updated_at
-                        FROM {SCHEMA}.support_tickets WHERE user_id = %s
-                        ORDER BY created_at DESC""",
-                    (user_id,)
-                )
-            else:
-                cursor.execute(
-                    f"""SELECT t.id, t.subject, t.status, t.priority, t.created_at, 
-                        t.updated_at, u.username
-                        FROM {SCHEMA}.support_tickets t
-                        JOIN {SCHEMA}.users u ON t.user_id = u.id
-                        ORDER BY t.created_at DESC"""
-                )
-            
-            tickets = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'tickets': [dict(t) for t in tickets]}, default=str)
-            }
-        
-        elif method == 'POST':
-            if not user_id:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Unauthorized'})
-                }
-            
-            subject = body_data.get('subject')
-            priority = body_data.get('priority', 'normal')
-            
-            cursor.execute(
-                f"""INSERT INTO {SCHEMA}.support_tickets 
-                    (user_id, subject, priority, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s) RETURNING id""",
-                (user_id, subject, priority, datetime.now(), datetime.now())
-            )
-            ticket_id = cursor.fetchone()['id']
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'ticket_id': ticket_id, 'status': 'created'})
-            }
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'ticket_id and message are required (message up to {SUPPORT_MESSAGE_MAX} characters)'})
+        }
     
-    if action == 'purchases':
-        user_id_param = params.get('user_id')
-        
-        if not user_id_param:
-            cursor.close()
-            conn.close()
+    if not get_support_ticket(request, ticket_id):
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Ticket not found'})
+        }
+    
+    # Без сессии пишет поддержка, подтверждённая X-Admin-Auth; общий токен не называет админа,
+    # поэтому admin_id не заполняется. Счётчики тикета обновляет триггер
+    is_admin = not request.user_id
+    cursor.execute(
+        f"""INSERT INTO {SCHEMA}.support_messages (ticket_id, user_id, message, is_admin)
+            VALUES (%s, %s, %s, %s) RETURNING id, created_at""",
+        (ticket_id, request.user_id, message, is_admin)
+    )
+    created = cursor.fetchone()
+    request.conn.commit()
+    
+    return json_response(201, {'message_id': created['id'], 'created_at': created['created_at']})
+
+def changes_unauthorized(request: Request) -> Optional[Dict[str, Any]]:
+    '''401 для ленты: неверный токен сессии - не лента поддержки, общая лента с текстами сообщений - только для поддержки.'''
+    if request.session_token and not request.session:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid session'})
+        }
+    if not request.user_id and not request.is_admin:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'})
+        }
+    return None
+
+def route_changes_ticket(request: Request) -> Dict[str, Any]:
+    '''Билет для EventSource по X-Session-Token или X-Admin-Auth: долгоживущие токены не попадают в адрес.'''
+    from changefeed import CHANGE_FEED_TICKET_TTL, issue_ticket
+    
+    unauthorized = changes_unauthorized(request)
+    if unauthorized:
+        return unauthorized
+    
+    ticket = issue_ticket(request.user_id)
+    if ticket is None:
+        return {
+            'statusCode': 503,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Change feed tickets are not configured'})
+        }
+    
+    return json_response(200, {'ticket': ticket, 'expires_in': CHANGE_FEED_TICKET_TTL})
+
+def route_changes(request: Request) -> Dict[str, Any]:
+    from changefeed import (CHANGE_FEED_BATCH, CHANGE_FEED_WAIT, CursorExpired, format_sse,
+                            parse_topics, read_changes, verify_ticket)
+    from responses import dumps
+    
+    params = request.params
+    headers = request.headers
+    # EventSource не умеет ставить заголовки: вместо токенов в адресе - билет из changes_ticket
+    if params.get('ticket'):
+        valid, user_id = verify_ticket(params['ticket'])
+        if not valid:
             return {
-                'statusCode': 400,
+                'statusCode': 401,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'User ID required'})
+                'body': json.dumps({'error': 'Invalid or expired ticket'})
             }
-        
-        cursor.execute(
-            f"""SELECT o.id, o.customer_name, o.items, o.total_price, o.status, o.created_at
-            FROM {SCHEMA}.orders o
-            WHERE o.user_id = %s
-            ORDER BY o.created_at DESC""",
-            (user_id_param,)
-        )
-        purchases = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
+    else:
+        unauthorized = changes_unauthorized(request)
+        if unauthorized:
+            return unauthorized
+        user_id = request.user_id
+    
+    topics = parse_topics(params.get('topics'))
+    raw_cursor = params.get('cursor') or headers.get('last-event-id') or headers.get('Last-Event-ID')
+    try:
+        after_id = int(raw_cursor) if raw_cursor else None
+        wait = min(max(float(params.get('wait', CHANGE_FEED_WAIT)), 0.0), CHANGE_FEED_WAIT)
+        limit = min(max(int(params.get('limit', CHANGE_FEED_BATCH)), 1), CHANGE_FEED_BATCH)
+        valid = topics is not None and (after_id is None or after_id >= 0)
+    except ValueError:
+        valid = False
+    if not valid:
         return {
-            'statusCode': 200,
+            'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'purchases': [dict(p) for p in purchases]}, default=decimal_to_float)
+            'body': json.dumps({'error': 'cursor must be an event id, wait and limit numbers, topics from order,ticket,message'})
         }
     
-    if method == 'GET':
-        cursor.execute(
-            f'SELECT id, username, email, balance, status, created_at FROM {SCHEMA}.users ORDER BY created_at DESC'
-        )
-        users = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
+    try:
+        events, next_id = read_changes(request.conn, request.cursor, after_id, user_id, topics, wait, limit)
+    except CursorExpired as e:
+        return json_response(410, {'error': 'Cursor expired, reload the lists', 'cursor': str(e.head)})
+    
+    accept = headers.get('accept') or headers.get('Accept') or ''
+    if params.get('format') == 'sse' or 'text/event-stream' in accept:
+        # Ответ функции отдаётся целиком: одна пачка на запрос, EventSource переподключается сам
         return {
             'statusCode': 200,
+            'headers': {
+                'Content-Type': 'text/event-stream; charset=utf-8',
+                'Cache-Control': 'no-cache',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': format_sse(events, next_id, dumps)
+        }
+    
+    return json_response(200, {'events': events, 'cursor': str(next_id)})
+
+def route_purchases(request: Request) -> Dict[str, Any]:
+    cursor = request.cursor
+    user_id_param = request.params.get('user_id')
+    
+    if not user_id_param:
+        return {
+            'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps([dict(u) for u in users], ensure_ascii=False, default=str)
+            'body': json.dumps({'error': 'User ID required'})
         }
     
-    elif method == 'POST':
-        action_type = body_data.get('action')
-        
-        if action_type == 'add_balance':
-            user_id_target = body_data.get('user_id')
-            amount = body_data.get('amount')
-            description = body_data.get('description', 'Пополнение баланса')
-            
-            cursor.execute(
-                f"""UPDATE {SCHEMA}.users 
-                    SET balance = balance + %s 
-                    WHERE id = %s
-                    RETURNING id, balance""",
-                (amount, user_id_target)
-            )
-            
-            result = cursor.fetchone()
-            
-            cursor.execute(
-                f"""INSERT INTO {SCHEMA}.balance_transactions (user_id, amount, type, description)
-                    VALUES (%s, %s, %s, %s)""",
-                (user_id_target, amount, 'deposit', description)
-            )
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'user_id': result['id'],
-                    'new_balance': float(result['balance'])
-                }, default=decimal_to_float)
-            }
-        
-        elif action_type == 'delete_account':
-            user_id_target = body_data.get('user_id')
-            
-            if not user_id_target:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'User ID required'})
-                }
-            
-            cursor.execute(f"DELETE FROM {SCHEMA}.user_sessions WHERE user_id = %s", (user_id_target,))
-            cursor.execute(f"DELETE FROM {SCHEMA}.balance_transactions WHERE user_id = %s", (user_id_target,))
-            cursor.execute(f"DELETE FROM {SCHEMA}.users WHERE id = %s", (user_id_target,))
-            conn.commit()
-            
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'message': 'Account deleted'})
-            }
-        
-        elif action_type == 'reset_balance':
-            user_id_target = body_data.get('user_id')
-            
-            if not user_id_target:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'User ID required'})
-                }
-            
-            cursor.execute(f"UPDATE {SCHEMA}.users SET balance = 0 WHERE id = %s", (user_id_target,))
-            cursor.execute(
-                f"""INSERT INTO {SCHEMA}.balance_transactions 
-                (user_id, amount, type, description, created_at) 
-                VALUES (%s, %s, %s, %s, %s)""",
-                (user_id_target, 0, 'reset', 'Обнуление баланса', datetime.now())
-            )
-            conn.commit()
-            
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'balance': 0})
-            }
-        
-        elif action_type == 'update_status':
-            user_id_target = body_data.get('user_id')
-            status = body_data.get('status')
-            
-            cursor.execute(
-                f"""UPDATE {SCHEMA}.users 
-                    SET status = %s 
-                    WHERE id = %s
-                    RETURNING id, status""",
-                (status, user_id_target)
-            )
-            
-            result = cursor.fetchone()
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'user_id': result['id'],
-                    'status': result['status']
-                })
-            }
+    cursor.execute(
+        f"""SELECT o.id, o.customer_name, o.items, o.total_price, o.status, o.created_at
+        FROM {SCHEMA}.orders o
+        WHERE o.user_id = %s
+        ORDER BY o.created_at DESC""",
+        (user_id_param,)
+    )
+    purchases = cursor.fetchall()
     
-    cursor.close()
-    conn.close()
+    return json_response(200, {'purchases': [dict(p) for p in purchases]})
+
+def route_list_users(request: Request) -> Dict[str, Any]:
+    from pagination import parse_limit, decode_cursor, fetch_json_page
+    
+    cursor = request.cursor
+    params = request.params
+    limit = parse_limit(params.get('limit'))
+    
+    try:
+        cursor_values = decode_cursor(params.get('cursor'))
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid cursor'})
+        }
+    
+    conditions = []
+    values = []
+    
+    search = (params.get('search') or '').strip()
+    if search:
+        pattern = f"%{escape_like(search)}%"
+        conditions.append('(username ILIKE %s OR telegram_username ILIKE %s OR email ILIKE %s)')
+        values.extend([pattern, pattern, pattern])
+    if params.get('status'):
+        conditions.append('status = %s')
+        values.append(params['status'])
+    
+    filter_where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    total = estimate_count(cursor, filter_where, list(values)) if params.get('with_total') else None
+    
+    if cursor_values:
+        conditions.append('(created_at, id) < (%s::timestamp, %s)')
+        values.extend(cursor_values)
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    values.append(limit + 1)
+    
+    users_json, next_cursor = fetch_json_page(
+        cursor,
+        f'''SELECT id, username, email, telegram_username, balance, status, created_at
+            FROM {SCHEMA}.users {where}
+            ORDER BY created_at DESC, id DESC LIMIT %s''',
+        values,
+        limit
+    )
+    
+    response = {'next_cursor': next_cursor, 'has_more': next_cursor is not None}
+    if total is not None:
+        response['total'] = total
+        response['total_is_estimate'] = True
+    
+    return json_response(200, body=dumps_with_fragments(response, users=users_json))
+
+def route_user_stats(request: Request) -> Dict[str, Any]:
+    '''Сводка для админ-панели по всем пользователям: список отдаётся страницами и всех не содержит.'''
+    cursor = request.cursor
+    return json_response(200, {
+        'stats': {
+            'total_users': estimate_count(cursor, '', []),
+            'active_users': estimate_count(cursor, 'WHERE status = %s', ['active']),
+            'is_estimate': True
+        }
+    })
+
+def route_add_balance(request: Request) -> Dict[str, Any]:
+    cursor = request.cursor
+    user_id_target = request.body.get('user_id')
+    amount = request.body.get('amount')
+    description = request.body.get('description', 'Пополнение баланса')
+    
+    cursor.execute(
+        f"""UPDATE {SCHEMA}.users 
+            SET balance = balance + %s 
+            WHERE id = %s
+            RETURNING id, balance""",
+        (amount, user_id_target)
+    )
+    
+    result = cursor.fetchone()
+    
+    if not result:
+        request.conn.rollback()
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'User not found'})
+        }
+    
+    record_entry(cursor, user_id_target, amount, result['balance'], 'deposit', description)
+    request.conn.commit()
+    invalidate_user_sessions(user_id_target)
+    
+    return json_response(200, {
+        'success': True,
+        'user_id': result['id'],
+        'new_balance': float(result['balance'])
+    })
+
+def route_delete_account(request: Request) -> Dict[str, Any]:
+    cursor = request.cursor
+    user_id_target = request.body.get('user_id')
+    
+    if not user_id_target:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'User ID required'})
+        }
+    
+    cursor.execute(f"DELETE FROM {SCHEMA}.user_sessions WHERE user_id = %s", (user_id_target,))
+    # Записи balance_ledger остаются: журнал только дополняется, внешнего ключа на users у него нет
+    cursor.execute(f"DELETE FROM {SCHEMA}.balance_transactions WHERE user_id = %s", (user_id_target,))
+    cursor.execute(f"DELETE FROM {SCHEMA}.users WHERE id = %s", (user_id_target,))
+    request.conn.commit()
+    invalidate_user_sessions(user_id_target)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, 'message': 'Account deleted'})
+    }
+
+def route_reset_balance(request: Request) -> Dict[str, Any]:
+    cursor = request.cursor
+    user_id_target = request.body.get('user_id')
+    
+    if not user_id_target:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'User ID required'})
+        }
+    
+    # Прежний баланс читается под той же блокировкой строки, чтобы запись в журнале списала ровно его
+    cursor.execute(
+        f"""UPDATE {SCHEMA}.users u SET balance = 0
+            FROM (SELECT id, balance FROM {SCHEMA}.users WHERE id = %s FOR UPDATE) old
+            WHERE u.id = old.id
+            RETURNING old.balance AS previous_balance""",
+        (user_id_target,)
+    )
+    result = cursor.fetchone()
+    
+    if result and result['previous_balance']:
+        record_entry(cursor, user_id_target, -result['previous_balance'], 0, 'reset', 'Обнуление баланса')
+    request.conn.commit()
+    invalidate_user_sessions(user_id_target)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, 'balance': 0})
+    }
+
+def route_update_status(request: Request) -> Dict[str, Any]:
+    cursor = request.cursor
+    user_id_target = request.body.get('user_id')
+    status = request.body.get('status')
+    
+    cursor.execute(
+        f"""UPDATE {SCHEMA}.users 
+            SET status = %s 
+            WHERE id = %s
+            RETURNING id, status""",
+        (status, user_id_target)
+    )
+    
+    result = cursor.fetchone()
+    request.conn.commit()
+    invalidate_user_sessions(user_id_target)
     
     return {
-        'statusCode': 405,
+        'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
\ No newline at end of file
+        'body': json.dumps({
+            'success': True,
+            'user_id': result['id'],
+            'status': result['status']
+        })
+    }
+
+# (action, метод) -> маршрут; '*' подходит для любого метода
+ROUTES: Dict[Tuple[str, str], Route] = {
+    ('drain_outbox', '*'): route_drain_outbox,
+    ('sweep_sessions', '*'): route_sweep_sessions,
+    ('sweep_changes', '*'): route_sweep_changes,
+    ('telegram_poll', '*'): route_telegram_poll,
+    ('auth', '*'): route_auth,
+    ('verify', '*'): route_verify,
+    ('logout', '*'): route_logout,
+    ('payment', '*'): route_payment,
+    ('purchase_with_balance', 'POST'): route_purchase_with_balance,
+    ('support', 'GET'): route_support_list,
+    ('support', 'POST'): route_support_create,
+    ('support_messages', 'GET'): route_support_messages,
+    ('support_messages', 'POST'): route_support_reply,
+    ('changes', 'GET'): route_changes,
+    ('changes_ticket', 'POST'): route_changes_ticket,
+    ('purchases', '*'): route_purchases,
+    ('user_stats', 'GET'): route_user_stats,
+    ('add_balance', 'POST'): route_add_balance,
+    ('delete_account', 'POST'): route_delete_account,
+    ('reset_balance', 'POST'): route_reset_balance,
+    ('update_status', 'POST'): route_update_status,
+}
+
+# Маршруты без записи: при заданном DATABASE_READ_URL они читают с реплики
+READ_ONLY_ROUTES = {route_verify, route_purchases, route_list_users, route_user_stats, route_support_list}
+
+def resolve_route(request: Request) -> Optional[Route]:
+    # У обновлений Telegram нет action; у ответа в тикет поле message есть, но action задан
+    if 'update_id' in request.body or ('message' in request.body and not request.action):
+        return route_telegram
+    
+    route = ROUTES.get((request.action, request.method)) or ROUTES.get((request.action, '*'))
+    if route:
+        return route
+    
+    if request.body.get('event') == 'payment.succeeded':
+        return route_payment_webhook
+    
+    if request.method == 'GET':
+        return route_list_users
+    
+    return None
+
+@instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Session-Token, X-Admin-Auth, X-User-Id, Last-Event-ID, X-Read-After',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+    
+    request = Request(event)
+    route = resolve_route(request)
+    
+    if route is None:
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+    
+    # psycopg2 загружается при первом запросе к БД, а не при импорте: OPTIONS и 405 обходятся без него
+    from psycopg2.extras import RealDictCursor
+    from db import db_connection, note_write
+    
+    read_only = route in READ_ONLY_ROUTES
+    with db_connection(read_only, request.headers) as conn:
+        request.conn = conn
+        request.cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            response = route(request)
+        finally:
+            request.cursor.close()
+        if not read_only:
+            note_write(conn, request.headers)
+    
+    # Журнал входов пишется на своём соединении, чтобы его COMMIT не зацепил незавершённые записи маршрута
+    if flush_due():
+        with db_connection() as conn:
+            flush_auth_logs(conn)
+    return response
@@ -0,0 +1,203 @@
+'''
+Business: Очередь исходящих сообщений Telegram - запись в транзакции вебхука и отправка воркером
+Args: TELEGRAM_BOT_TOKEN, TELEGRAM_API_BASE и настройки OUTBOX_* из окружения
+Returns: Статистику отправки: sent, retried, failed
+'''
+
+import json
+import logging
+import os
+import time
+import threading
+from typing import Dict, Any, Optional
+from timing import urlopen
+
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+TELEGRAM_API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org').rstrip('/')
+TELEGRAM_TIMEOUT = float(os.environ.get('TELEGRAM_TIMEOUT', '5'))
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_INTERVAL = float(os.environ.get('TELEGRAM_CHAT_INTERVAL', '1'))
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_MAX_BACKOFF = int(os.environ.get('OUTBOX_MAX_BACKOFF', '600'))
+SCHEMA = 't_p8741694_magazin_samp'
+
+logger = logging.getLogger('outbox')
+
+class TelegramError(Exception):
+    def __init__(self, message: str, retry_after: Optional[int] = None, permanent: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+
+class RateLimiter:
+    '''Глобальный лимит сообщений в секунду и минимальный интервал между сообщениями в один чат.'''
+
+    def __init__(self, per_second: float = TELEGRAM_GLOBAL_RATE, chat_interval: float = TELEGRAM_CHAT_INTERVAL):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self.chat_interval = chat_interval
+        self._next_slot = 0.0
+        self._chat_next: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, chat_id: int):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._chat_next.get(chat_id, 0.0))
+            self._next_slot = slot + self.interval
+            self._chat_next[chat_id] = slot + self.chat_interval
+            if len(self._chat_next) > 10000:
+                self._chat_next = {cid: t for cid, t in self._chat_next.items() if t > now}
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+def enqueue_message(cursor, chat_id: int, text: str, parse_mode: str = 'HTML'):
+    cursor.execute(
+        f"""INSERT INTO {SCHEMA}.telegram_outbox (chat_id, text, parse_mode)
+            VALUES (%s, %s, %s)""",
+        (chat_id, text, parse_mode)
+    )
+
+def send_message(chat_id: int, text: str, parse_mode: Optional[str] = 'HTML'):
+    # urllib нужен только воркеру отправки; вебхук, который лишь кладёт сообщения в очередь, его не грузит
+    import urllib.error
+    import urllib.request
+
+    if not TELEGRAM_BOT_TOKEN:
+        raise TelegramError('TELEGRAM_BOT_TOKEN is not configured', permanent=True)
+
+    url = f'{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/sendMessage'
+    payload = {'chat_id': chat_id, 'text': text}
+    if parse_mode:
+        payload['parse_mode'] = parse_mode
+    req = urllib.request.Request(
+        url, data=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'}
+    )
+
+    try:
+        with urlopen(req, timeout=TELEGRAM_TIMEOUT) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        try:
+            error = json.loads(e.read().decode('utf-8'))
+        except ValueError:
+            error = {}
+        retry_after = (error.get('parameters') or {}).get('retry_after')
+        description = error.get('description') or f'HTTP {e.code}'
+        raise TelegramError(description, retry_after=retry_after, permanent=400 <= e.code < 500 and e.code != 429)
+    except (urllib.error.URLError, OSError) as e:
+        raise TelegramError(str(e))
+
+def backoff_delay(attempts: int, retry_after: Optional[int] = None) -> int:
+    if retry_after:
+        return int(retry_after)
+    return min(OUTBOX_MAX_BACKOFF, 2 ** attempts)
+
+def drain_outbox(conn, batch_size: int = OUTBOX_BATCH_SIZE, limiter: Optional[RateLimiter] = None,
+                 deadline: Optional[float] = None) -> Dict[str, int]:
+    '''Отправляет накопившиеся сообщения пачками; строки блокируются FOR UPDATE SKIP LOCKED.'''
+    from psycopg2.extras import RealDictCursor, execute_values
+
+    limiter = limiter or RateLimiter()
+    stats = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    while deadline is None or time.monotonic() < deadline:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                f"""SELECT o.id, o.chat_id, o.text, o.parse_mode, o.attempts
+                    FROM {SCHEMA}.telegram_outbox o
+                    WHERE o.status = 'pending' AND o.next_attempt_at <= CURRENT_TIMESTAMP
+                    AND NOT EXISTS (
+                        SELECT 1 FROM {SCHEMA}.telegram_outbox b
+                        WHERE b.chat_id = o.chat_id AND b.status = 'pending'
+                        AND b.id < o.id AND b.next_attempt_at > CURRENT_TIMESTAMP
+                    )
+                    ORDER BY o.id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED""",
+                (batch_size,)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                conn.commit()
+                break
+
+            sent = []
+            retried = []
+            failed = []
+            deferred_chats = set()
+
+            for row in rows:
+                if row['chat_id'] in deferred_chats:
+                    continue
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+
+                limiter.wait(row['chat_id'])
+                attempts = row['attempts'] + 1
+                try:
+                    send_message(row['chat_id'], row['text'], row['parse_mode'])
+                    sent.append(row['id'])
+                except TelegramError as e:
+                    deferred_chats.add(row['chat_id'])
+                    if e.permanent or attempts >= OUTBOX_MAX_ATTEMPTS:
+                        failed.append((row['id'], attempts, str(e)))
+                    else:
+                        retried.append((row['id'], attempts, backoff_delay(attempts, e.retry_after), str(e)))
+
+            if sent:
+                cursor.execute(
+                    f"""UPDATE {SCHEMA}.telegram_outbox
+                        SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP
+                        WHERE id = ANY(%s)""",
+                    (sent,)
+                )
+            if retried:
+                execute_values(
+                    cursor,
+                    f"""UPDATE {SCHEMA}.telegram_outbox o
+                        SET attempts = v.attempts,
+                            next_attempt_at = CURRENT_TIMESTAMP + v.delay * INTERVAL '1 second',
+                            last_error = v.error
+                        FROM (VALUES %s) AS v(id, attempts, delay, error)
+                        WHERE o.id = v.id""",
+                    retried
+                )
+            if failed:
+                execute_values(
+                    cursor,
+                    f"""UPDATE {SCHEMA}.telegram_outbox o
+                        SET status = 'failed', attempts = v.attempts, last_error = v.error
+                        FROM (VALUES %s) AS v(id, attempts, error)
+                        WHERE o.id = v.id""",
+                    failed
+                )
+            conn.commit()
+
+        stats['sent'] += len(sent)
+        stats['retried'] += len(retried)
+        stats['failed'] += len(failed)
+
+        if len(rows) < batch_size:
+            break
+
+    return stats
+
+if __name__ == '__main__':
+    from db import get_connection, release_connection
+
+    logging.basicConfig(level=logging.INFO)
+
+    poll_interval = float(os.environ.get('OUTBOX_POLL_INTERVAL', '1'))
+    limiter = RateLimiter()
+    while True:
+        conn = get_connection()
+        try:
+            result = drain_outbox(conn, limiter=limiter)
+        finally:
+            release_connection(conn)
+        if result['sent'] or result['retried'] or result['failed']:
+            logger.info(json.dumps(result))
+        else:
+            time.sleep(poll_interval)
@@ -0,0 +1,77 @@
+'''
+Business: Обслуживание user_sessions - чистка просроченных сессий пачками и ограничение числа сессий на пользователя
+Args: SESSION_MAX_PER_USER, SESSION_SWEEP_BATCH из окружения
+Returns: Удалённые токены, чтобы вызывающий код убрал их из кэша сессий
+'''
+
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+SESSION_MAX_PER_USER = int(os.environ.get('SESSION_MAX_PER_USER', '5'))
+SESSION_SWEEP_BATCH = int(os.environ.get('SESSION_SWEEP_BATCH', '1000'))
+SCHEMA = 't_p8741694_magazin_samp'
+
+logger = logging.getLogger('sessions')
+
+def enforce_session_cap(cursor, user_id: int, max_sessions: int = SESSION_MAX_PER_USER) -> List[str]:
+    '''Оставляет пользователю max_sessions самых свежих сессий; просроченные уходят первыми.'''
+    cursor.execute(
+        f"""DELETE FROM {SCHEMA}.user_sessions
+            WHERE id IN (
+                SELECT id FROM {SCHEMA}.user_sessions
+                WHERE user_id = %s
+                ORDER BY expires_at DESC, id DESC
+                OFFSET %s
+            )
+            RETURNING session_token""",
+        (user_id, max_sessions)
+    )
+    return [row['session_token'] for row in cursor.fetchall()]
+
+def sweep_expired_sessions(conn, batch_size: int = SESSION_SWEEP_BATCH,
+                           deadline: Optional[float] = None) -> Dict[str, int]:
+    '''Удаляет просроченные сессии пачками по batch_size, коммитя каждую: блокировки держатся недолго.'''
+    from psycopg2.extras import RealDictCursor
+
+    stats = {'deleted': 0, 'batches': 0}
+    while deadline is None or time.monotonic() < deadline:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                f"""DELETE FROM {SCHEMA}.user_sessions
+                    WHERE id IN (
+                        SELECT id FROM {SCHEMA}.user_sessions
+                        WHERE expires_at <= CURRENT_TIMESTAMP
+                        ORDER BY expires_at
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )""",
+                (batch_size,)
+            )
+            deleted = cursor.rowcount
+        conn.commit()
+
+        stats['deleted'] += deleted
+        stats['batches'] += 1
+        if deleted < batch_size:
+            break
+
+    return stats
+
+if __name__ == '__main__':
+    from db import get_connection, release_connection
+
+    logging.basicConfig(level=logging.INFO)
+
+    sweep_interval = float(os.environ.get('SESSION_SWEEP_INTERVAL', '300'))
+    while True:
+        conn = get_connection()
+        try:
+            result = sweep_expired_sessions(conn)
+        finally:
+            release_connection(conn)
+        if result['deleted']:
+            logger.info(json.dumps(result))
+        time.sleep(sweep_interval)
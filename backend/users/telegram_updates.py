@@ -0,0 +1,169 @@
+'''
+Business: Входящие обновления Telegram - отсев повторов по update_id и воркер getUpdates, обрабатывающий их пачками
+Args: TELEGRAM_DEDUP_MEMORY, TELEGRAM_DEDUP_WINDOW, TELEGRAM_POLL_TIMEOUT, TELEGRAM_POLL_LIMIT из окружения
+Returns: Обновления, которые ещё не обрабатывались, и статистику воркера
+'''
+
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+from cache import TTLCache
+from outbox import TELEGRAM_API_BASE, TELEGRAM_BOT_TOKEN, TELEGRAM_TIMEOUT, TelegramError
+from timing import urlopen
+
+TELEGRAM_DEDUP_MEMORY = int(os.environ.get('TELEGRAM_DEDUP_MEMORY', '2000'))
+TELEGRAM_DEDUP_WINDOW = int(os.environ.get('TELEGRAM_DEDUP_WINDOW', '100000'))
+TELEGRAM_POLL_TIMEOUT = int(os.environ.get('TELEGRAM_POLL_TIMEOUT', '25'))
+TELEGRAM_POLL_LIMIT = int(os.environ.get('TELEGRAM_POLL_LIMIT', '100'))
+SCHEMA = 't_p8741694_magazin_samp'
+
+logger = logging.getLogger('telegram_updates')
+
+# Повторная доставка обычно попадает в тот же тёплый экземпляр: её отсекаем без запроса к базе
+_recent = TTLCache(TELEGRAM_DEDUP_MEMORY, 3600)
+
+def seen_recently(update_id: int) -> bool:
+    return _recent.get(update_id, False)
+
+def remember(update_ids: Iterable[int]):
+    for update_id in update_ids:
+        _recent.set(update_id, True)
+
+def claim_updates(cursor, update_ids: List[int]) -> Set[int]:
+    '''Отмечает update_id обработанными в текущей транзакции; возвращает те, что ещё не встречались.
+
+    Повтор, пришедший параллельно, ждёт на первичном ключе до COMMIT первой доставки и
+    отбрасывается; при откате обработки отметка откатывается вместе с ней. id ниже отметки
+    минус TELEGRAM_DEDUP_WINDOW уже вычищены и считаются повтором.
+    '''
+    cursor.execute(
+        f"""INSERT INTO {SCHEMA}.telegram_updates (update_id)
+            SELECT u.id FROM unnest(%s::bigint[]) AS u(id)
+            WHERE u.id > COALESCE((SELECT MAX(update_id) FROM {SCHEMA}.telegram_updates), 0) - %s
+            ON CONFLICT (update_id) DO NOTHING
+            RETURNING update_id""",
+        (update_ids, TELEGRAM_DEDUP_WINDOW)
+    )
+    return {row['update_id'] for row in cursor.fetchall()}
+
+def high_water_mark(cursor) -> int:
+    cursor.execute(f"SELECT COALESCE(MAX(update_id), 0) AS update_id FROM {SCHEMA}.telegram_updates")
+    return cursor.fetchone()['update_id']
+
+def prune_updates(cursor) -> int:
+    '''Удаляет отметки за окном; последняя остаётся, на ней держится offset getUpdates.'''
+    cursor.execute(
+        f"""DELETE FROM {SCHEMA}.telegram_updates
+            WHERE update_id < (SELECT MAX(update_id) FROM {SCHEMA}.telegram_updates) - %s""",
+        (TELEGRAM_DEDUP_WINDOW,)
+    )
+    return cursor.rowcount
+
+def get_updates(offset: int, timeout: int, limit: int = TELEGRAM_POLL_LIMIT) -> List[Dict[str, Any]]:
+    '''getUpdates с long polling; offset подтверждает Telegram всё, что ниже него.'''
+    import urllib.error
+    import urllib.request
+
+    if not TELEGRAM_BOT_TOKEN:
+        raise TelegramError('TELEGRAM_BOT_TOKEN is not configured', permanent=True)
+
+    payload = {'offset': offset, 'timeout': timeout, 'limit': limit, 'allowed_updates': ['message']}
+    req = urllib.request.Request(
+        f'{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/getUpdates',
+        data=json.dumps(payload).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}
+    )
+    try:
+        with urlopen(req, timeout=timeout + TELEGRAM_TIMEOUT) as response:
+            return json.loads(response.read().decode('utf-8')).get('result') or []
+    except urllib.error.HTTPError as e:
+        try:
+            error = json.loads(e.read().decode('utf-8'))
+        except ValueError:
+            error = {}
+        retry_after = (error.get('parameters') or {}).get('retry_after')
+        # 409 - у бота включён вебхук: getUpdates работает только после deleteWebhook
+        description = error.get('description') or f'HTTP {e.code}'
+        raise TelegramError(description, retry_after=retry_after, permanent=e.code in (401, 404, 409))
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise TelegramError(str(e))
+
+def process_batch(conn, updates: List[Dict[str, Any]], apply: Callable, finish: Callable) -> Dict[str, int]:
+    '''Пачка обновлений в одной транзакции: отметка update_id одним INSERT, каждое обновление - в своей точке сохранения.
+
+    Обновление, упавшее с ошибкой, откатывается до точки сохранения, но остаётся отмеченным:
+    иначе оно возвращалось бы в каждой следующей пачке.
+    '''
+    from psycopg2.extras import RealDictCursor
+
+    stats = {'processed': 0, 'duplicates': 0, 'failed': 0}
+    effects = []
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        claimed = claim_updates(cursor, [update['update_id'] for update in updates])
+        for update in updates:
+            if update['update_id'] not in claimed:
+                stats['duplicates'] += 1
+                continue
+            cursor.execute('SAVEPOINT telegram_update')
+            try:
+                effects.append(apply(cursor, update))
+                cursor.execute('RELEASE SAVEPOINT telegram_update')
+                stats['processed'] += 1
+            except Exception as e:
+                cursor.execute('ROLLBACK TO SAVEPOINT telegram_update')
+                stats['failed'] += 1
+                logger.warning('telegram update %s failed: %s', update['update_id'], e)
+        prune_updates(cursor)
+    conn.commit()
+    remember(update['update_id'] for update in updates)
+    for effect in effects:
+        finish(effect)
+    return stats
+
+def poll_updates(conn, apply: Callable, finish: Callable, deadline: Optional[float] = None) -> Dict[str, int]:
+    '''Воркер для режима без вебхука: забирает getUpdates пачками, пока не истечёт deadline.
+
+    offset берётся из базы, поэтому пачка, не дошедшая до COMMIT, будет получена снова.
+    '''
+    from psycopg2.extras import RealDictCursor
+
+    stats = {'batches': 0, 'processed': 0, 'duplicates': 0, 'failed': 0}
+    while deadline is None or time.monotonic() < deadline:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            offset = high_water_mark(cursor) + 1
+        conn.rollback()
+
+        timeout = TELEGRAM_POLL_TIMEOUT
+        if deadline is not None:
+            timeout = max(0, min(timeout, int(deadline - time.monotonic()) - TELEGRAM_TIMEOUT))
+        updates = get_updates(offset, int(timeout))
+        if not updates:
+            if timeout == 0:
+                break
+            continue
+
+        batch = process_batch(conn, updates, apply, finish)
+        stats['batches'] += 1
+        for key, value in batch.items():
+            stats[key] += value
+    return stats
+
+if __name__ == '__main__':
+    from db import get_connection, release_connection
+    from index import apply_telegram_update, finish_telegram_update
+
+    logging.basicConfig(level=logging.INFO)
+
+    while True:
+        conn = get_connection()
+        try:
+            poll_updates(conn, apply_telegram_update, finish_telegram_update)
+        except TelegramError as e:
+            logger.warning('getUpdates failed: %s', e)
+            if e.permanent:
+                raise
+            time.sleep(e.retry_after or 5)
+        finally:
+            release_connection(conn)
@@ -0,0 +1,110 @@
+'''
+Business: Проверка ленты изменений на событиях, закоммиченных не по порядку id
+Args: --dsn одноразовой базы, --setup
+Returns: Итоги сценариев; код 1, если курсор перепрыгнул событие, которое ещё не было закоммичено
+
+Пример:
+  python bench/changefeed_check.py --dsn postgresql://localhost/magazin_bench --setup
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent / 'backend'
+sys.path.insert(0, str(BENCH_DIR))
+
+from setup_db import schema_dsn, setup_database
+
+GAP_GRACE = 1.0
+
+def publish(conn, count: int = 1) -> List[int]:
+    '''События через publish_change, как их пишут триггеры; COMMIT - на вызывающем.'''
+    with conn.cursor() as cursor:
+        for _ in range(count):
+            cursor.execute("SELECT t_p8741694_magazin_samp.publish_change('order', 'update', 0, NULL, '{}'::jsonb)")
+        cursor.execute("SELECT currval(pg_get_serial_sequence('t_p8741694_magazin_samp.change_events', 'id'))")
+        last = cursor.fetchone()[0]
+    return list(range(last - count + 1, last + 1))
+
+def main():
+    parser = argparse.ArgumentParser(description='Change feed check for out-of-order commits')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--setup', action='store_true', help='drop, migrate and seed a small benchmark schema first')
+    parser.add_argument('--force', action='store_true', help='allow --setup on a database without bench/test in its name')
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('--dsn is required (or set BENCH_DATABASE_URL)')
+
+    if args.setup:
+        setup_database(args.dsn, {'users': 10, 'orders': 10, 'products': 10, 'sessions': 10, 'logs': 10}, args.force)
+
+    function_dir = BACKEND_DIR / 'users'
+    sys.path.insert(0, str(function_dir))
+    os.chdir(function_dir)
+    os.environ['DATABASE_URL'] = schema_dsn(args.dsn)
+    os.environ['CHANGE_FEED_GAP_GRACE'] = str(GAP_GRACE)
+    from changefeed import fetch_changes
+
+    slow = psycopg2.connect(schema_dsn(args.dsn))
+    fast = psycopg2.connect(schema_dsn(args.dsn))
+    reader = psycopg2.connect(schema_dsn(args.dsn))
+    violations = []
+    results = {}
+
+    def read(after_id):
+        with reader.cursor(cursor_factory=RealDictCursor) as cursor:
+            events, next_id = fetch_changes(cursor, after_id, None, ['order'])
+        reader.rollback()
+        return [event['id'] for event in events], next_id
+
+    try:
+        # Курсор стоит на существующем событии, иначе пустая лента ответит CursorExpired
+        publish(fast)
+        fast.commit()
+        _, start = read(None)
+
+        # Дыра в один id и в два: пока первая транзакция не закоммичена, курсор стоит перед дырой
+        for hole in (1, 2):
+            pending = publish(slow, hole)
+            committed = publish(fast)
+            fast.commit()
+            seen, cursor_id = read(start)
+            if seen or cursor_id != start:
+                violations.append(f'hole of {hole}: got {seen} and cursor {cursor_id} before ids {pending} committed')
+            slow.commit()
+            seen, cursor_id = read(start)
+            if seen != pending + committed or cursor_id != committed[-1]:
+                violations.append(f'hole of {hole}: after commit got {seen} and cursor {cursor_id}, expected {pending + committed}')
+            results[f'hole_{hole}'] = {'pending': pending, 'committed': committed, 'delivered': seen}
+            start = cursor_id
+
+        # Откат оставляет дыру навсегда: после CHANGE_FEED_GAP_GRACE курсор проходит её
+        rolled_back = publish(slow)
+        committed = publish(fast)
+        fast.commit()
+        slow.rollback()
+        time.sleep(GAP_GRACE + 0.5)
+        seen, cursor_id = read(start)
+        if seen != committed or cursor_id != committed[-1]:
+            violations.append(f'rollback of {rolled_back}: got {seen} and cursor {cursor_id}, expected {committed}')
+        results['rollback'] = {'rolled_back': rolled_back, 'delivered': seen}
+    finally:
+        for conn in (slow, fast, reader):
+            conn.close()
+
+    print(json.dumps(results, indent=2))
+    for line in violations:
+        print(f'VIOLATION {line}')
+    if violations:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+'''
+Business: Замер холодного старта обработчиков backend/ - импорт index.py и первый вызов в свежем процессе
+Args: --functions, --runs, --ref (git-ревизия для сравнения), --dsn для первого запроса к базе, --json
+Returns: Таблицу медиан и p95 времени импорта и первого вызова, число загруженных модулей и тяжёлых зависимостей
+
+Пример:
+  python bench/cold_start.py --functions users --runs 20 --ref HEAD~1
+  python bench/cold_start.py --dsn postgresql://localhost/magazin_bench --read-only
+'''
+
+import argparse
+import fnmatch
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from driver import percentile
+from scenarios import BENCH_ADMIN_TOKEN, FUNCTIONS, build_scenarios
+from setup_db import DEFAULT_SIZES, schema_dsn
+
+# Модули, которые заметно удлиняют импорт; по ним видно, что маршрут подтянул лишнее
+HEAVY_MODULES = ['psycopg2', 'urllib.request', 'http.client', 'ssl', 'email', 'uuid', 'base64', 'hashlib', 'secrets']
+
+# Выполняется в свежем интерпретаторе: каждый запуск - отдельный холодный старт
+PROBE = r'''
+import json, sys, time
+event = json.loads(sys.argv[1])
+heavy = json.loads(sys.argv[2])
+sys.path.insert(0, '.')
+before = set(sys.modules)
+started = time.perf_counter()
+import index
+import_ms = (time.perf_counter() - started) * 1000
+first_ms = status = None
+if event is not None:
+    started = time.perf_counter()
+    try:
+        status = index.handler(event, None).get('statusCode')
+    except Exception as e:
+        status = 'error:' + type(e).__name__
+    first_ms = (time.perf_counter() - started) * 1000
+loaded = set(sys.modules) - before
+print(json.dumps({
+    'import_ms': import_ms, 'first_ms': first_ms, 'status': status,
+    'modules': len(loaded), 'heavy': [m for m in heavy if m in loaded]
+}))
+'''
+
+def cold_events(function: str, with_db: bool, read_only: bool, pattern: str) -> Dict[str, Optional[Dict[str, Any]]]:
+    events: Dict[str, Optional[Dict[str, Any]]] = {
+        'import': None,
+        'options': {'httpMethod': 'OPTIONS', 'queryStringParameters': {}, 'headers': {}, 'body': ''},
+    }
+    if with_db:
+        import random
+        rng = random.Random(42)
+        for name, make_event in build_scenarios(function, DEFAULT_SIZES).items():
+            scenario, _, kind = name.partition(':')
+            if read_only and kind == 'write':
+                continue
+            events[scenario] = make_event(rng)
+    return {name: event for name, event in events.items() if fnmatch.fnmatch(name, pattern)}
+
+def probe(function_dir: Path, event: Optional[Dict[str, Any]], env: Dict[str, str]) -> Dict[str, Any]:
+    completed = subprocess.run(
+        [sys.executable, '-c', PROBE, json.dumps(event), json.dumps(HEAVY_MODULES)],
+        cwd=function_dir, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(f'Cold start probe in {function_dir} failed with exit code {completed.returncode}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def measure(tree: str, backend_dir: Path, function: str, scenario: str, event: Optional[Dict[str, Any]],
+            runs: int, env: Dict[str, str]) -> Dict[str, Any]:
+    samples = [probe(backend_dir / function, event, env) for _ in range(runs)]
+    imports = sorted(s['import_ms'] for s in samples)
+    firsts = sorted(s['first_ms'] for s in samples if s['first_ms'] is not None)
+    return {
+        'tree': tree,
+        'function': function,
+        'scenario': scenario,
+        'runs': runs,
+        'import_p50_ms': round(statistics.median(imports), 2),
+        'import_p95_ms': round(percentile(imports, 95), 2),
+        'first_p50_ms': round(statistics.median(firsts), 2) if firsts else None,
+        'modules': samples[-1]['modules'],
+        'heavy': ','.join(samples[-1]['heavy']) or '-',
+        'status': samples[-1]['status'],
+    }
+
+def export_ref(ref: str, target: Path) -> Path:
+    '''Распаковывает backend/ из git-ревизии во временный каталог.'''
+    archive = target / 'backend.tar'
+    with open(archive, 'wb') as f:
+        subprocess.run(['git', 'archive', ref, 'backend'], cwd=ROOT, stdout=f, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(target)
+    return target / 'backend'
+
+def print_table(results: List[Dict[str, Any]]):
+    columns = [('tree', 8), ('function', 9), ('scenario', 16), ('import_p50_ms', 10), ('import_p95_ms', 10),
+               ('first_p50_ms', 10), ('modules', 8), ('status', 7), ('heavy', 60)]
+    print('  '.join(name[:width].ljust(width) for name, width in columns))
+    for result in results:
+        print('  '.join(str(result[name])[:width].ljust(width) for name, width in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start of the serverless handlers')
+    parser.add_argument('--functions', default=','.join(FUNCTIONS))
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters per scenario')
+    parser.add_argument('--scenario', default='*', help='glob over scenario names')
+    parser.add_argument('--ref', help='git revision to compare against, e.g. HEAD~1')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'),
+                        help='seeded benchmark database; enables first-request scenarios')
+    parser.add_argument('--read-only', action='store_true', help='skip scenarios that write')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('ADMIN_API_TOKEN', BENCH_ADMIN_TOKEN)
+    if args.dsn:
+        env['DATABASE_URL'] = schema_dsn(args.dsn)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        trees = [('current', ROOT / 'backend')]
+        if args.ref:
+            trees.insert(0, (args.ref, export_ref(args.ref, Path(tmp))))
+
+        results = []
+        for function in (f.strip() for f in args.functions.split(',')):
+            for scenario, event in cold_events(function, bool(args.dsn), args.read_only, args.scenario).items():
+                for tree, backend_dir in trees:
+                    results.append(measure(tree, backend_dir, function, scenario, event, args.runs, env))
+
+    print_table(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'runs': args.runs, 'results': results}, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
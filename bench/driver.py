@@ -0,0 +1,145 @@
+'''
+Business: Прогон сценариев одного обработчика backend/<function>/index.py в отдельном процессе
+Args: --function, --requests, --concurrency, --warmup, --sizes (JSON), --scenario (glob), --read-only
+Returns: По одной JSON-строке с задержками, запросами к БД и пропускной способностью на сценарий
+
+Каждая функция запускается в своём процессе, как отдельный инстанс: у функций одинаковые имена
+модулей (index, db, ...), и общий sys.modules смешал бы их между собой.
+'''
+
+import argparse
+import fnmatch
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent / 'backend'
+sys.path.insert(0, str(BENCH_DIR))
+
+from scenarios import BENCH_ADMIN_TOKEN, build_scenarios
+
+class BenchContext:
+    def __init__(self, function: str):
+        self.function_name = function
+        self.request_id = 'bench'
+
+class QueryCounter:
+    def __init__(self):
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def add(self):
+        with self._lock:
+            self.queries += 1
+
+    def reset(self):
+        with self._lock:
+            self.queries = 0
+
+def install_query_counter(counter: QueryCounter):
+    '''Все обработчики открывают курсоры RealDictCursor, поэтому достаточно обернуть его execute.'''
+    from psycopg2 import extras
+
+    original = extras.RealDictCursor.execute
+
+    def execute(self, query, vars=None):
+        counter.add()
+        return original(self, query, vars)
+
+    extras.RealDictCursor.execute = execute
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100.0 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+def run_scenario(handler: Callable, context: Any, make_event: Callable, requests: int, concurrency: int,
+                 seed: int, counter: QueryCounter) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    events = [make_event(rng) for _ in range(requests)]
+
+    def call(event):
+        started = time.perf_counter()
+        try:
+            status = handler(event, context).get('statusCode')
+        except Exception as e:
+            status = f'error:{type(e).__name__}'
+        return time.perf_counter() - started, status
+
+    counter.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, events))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(r[0] * 1000 for r in results)
+    statuses = Counter(str(r[1]) for r in results)
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+        'throughput_rps': round(requests / wall, 1) if wall > 0 else 0.0,
+        'queries_per_request': round(counter.queries / requests, 2) if requests else 0.0,
+        'statuses': dict(statuses),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark one backend function in-process')
+    parser.add_argument('--function', required=True)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--sizes', default='{}', help='JSON with seeded row counts')
+    parser.add_argument('--scenario', default='*', help='glob over scenario names')
+    parser.add_argument('--read-only', action='store_true', help='skip scenarios that write')
+    args = parser.parse_args()
+
+    from setup_db import DEFAULT_SIZES
+    sizes = dict(DEFAULT_SIZES, **json.loads(args.sizes))
+
+    function_dir = BACKEND_DIR / args.function
+    sys.path.insert(0, str(function_dir))
+    os.chdir(function_dir)
+    os.environ.setdefault('DB_POOL_MAX', str(max(args.concurrency, 1)))
+    os.environ.setdefault('ADMIN_API_TOKEN', BENCH_ADMIN_TOKEN)
+
+    counter = QueryCounter()
+    install_query_counter(counter)
+
+    started = time.perf_counter()
+    import index
+    import_ms = (time.perf_counter() - started) * 1000
+
+    context = BenchContext(args.function)
+    for name, make_event in build_scenarios(args.function, sizes).items():
+        scenario, _, kind = name.partition(':')
+        if not fnmatch.fnmatch(scenario, args.scenario):
+            continue
+        if args.read_only and kind == 'write':
+            continue
+
+        if args.warmup:
+            run_scenario(index.handler, context, make_event, args.warmup, 1, args.seed + 1, counter)
+        result = run_scenario(
+            index.handler, context, make_event, args.requests, args.concurrency, args.seed, counter
+        )
+        result.update({'function': args.function, 'scenario': scenario, 'writes': kind == 'write', 'import_ms': round(import_ms, 3)})
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+if __name__ == '__main__':
+    main()
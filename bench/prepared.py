@@ -0,0 +1,133 @@
+'''
+Business: Бенчмарк подготовленных запросов - cursor.execute против PREPARE/EXECUTE для каждого запроса из statements
+Args: --dsn засеянной базы (bench/setup_db.py), --functions, --runs
+Returns: Таблицу по запросам: среднее время вызова и время планирования на сервере, обычный запрос против EXECUTE
+
+Пример:
+  python bench/prepared.py --dsn postgresql://localhost/magazin_bench --runs 500
+Сквозной замер тех же путей через обработчики:
+  DB_PREPARE=0 python bench/run.py --dsn ... --read-only --json bench/plain.json
+  python bench/run.py --dsn ... --read-only --compare bench/plain.json
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent / 'backend'
+sys.path.insert(0, str(BENCH_DIR))
+
+from scenarios import TELEGRAM_ID_BASE
+
+FUNCTIONS = ['users', 'products', 'orders']
+
+# Параметры, при которых запрос находит строки в базе, засеянной setup_db
+SAMPLES: Dict[str, Callable[[], Tuple]] = {
+    'session_by_token': lambda: (f'bench-token-{TELEGRAM_ID_BASE + 1}', datetime.now()),
+    'user_by_telegram_id': lambda: (TELEGRAM_ID_BASE + 1,),
+    'product_price_by_id': lambda: (1,),
+    'product_by_id': lambda: (1,),
+    'catalog_version': lambda: (),
+    'catalog_body': lambda: (),
+    'order_insert': lambda: ('Bench customer', 'bench@example.com', '[]', 100, 'В обработке'),
+}
+
+def measure(fn: Callable[[], Any], runs: int) -> float:
+    fn()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(statistics.mean(samples), 3)
+
+def planning_ms(cursor, statement: str, vars: Tuple) -> float:
+    '''Planning Time из EXPLAIN ANALYZE: сюда входят разбор и планирование, которые экономит EXECUTE.'''
+    cursor.execute(f'EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) {statement}', vars)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Planning Time']
+
+def bench_function(function: str, dsn: str, runs: int) -> List[Dict[str, Any]]:
+    sys.path.insert(0, str(BACKEND_DIR / function))
+    import psycopg2
+    import db
+    import index  # noqa: F401 - регистрирует запросы функции
+    import statements
+    from setup_db import schema_dsn
+
+    conn = psycopg2.connect(schema_dsn(dsn), connection_factory=db.InstrumentedConnection)
+    results = []
+    try:
+        cursor = conn.cursor()
+        for name, query in statements.registered_statements().items():
+            vars = SAMPLES[name]()
+
+            def plain():
+                cursor.execute(query, vars)
+                conn.rollback()
+
+            def prepared():
+                statements.execute_prepared(cursor, name, vars)
+                conn.rollback()
+
+            count = query.count('%s')
+            execute = f"EXECUTE {name} ({', '.join(['%s'] * count)})" if count else f'EXECUTE {name}'
+            plain_ms = measure(plain, runs)
+            prepared_ms = measure(prepared, runs)
+            plan_plain = planning_ms(cursor, query, vars)
+            plan_prepared = planning_ms(cursor, execute, vars)
+            conn.rollback()
+            results.append({
+                'function': function,
+                'statement': name,
+                'execute_ms': plain_ms,
+                'prepared_ms': prepared_ms,
+                'plan_ms': round(plan_plain, 3),
+                'plan_prepared_ms': round(plan_prepared, 3),
+            })
+    finally:
+        conn.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare plain execute with PREPARE/EXECUTE for registered statements')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'), required='BENCH_DATABASE_URL' not in os.environ)
+    parser.add_argument('--functions', default=','.join(FUNCTIONS))
+    parser.add_argument('--runs', type=int, default=300)
+    parser.add_argument('--function', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.function:
+        # Один процесс на функцию: у всех функций модули называются index, db, statements
+        print(json.dumps(bench_function(args.function, args.dsn, args.runs)))
+        return
+
+    results = []
+    for function in args.functions.split(','):
+        completed = subprocess.run(
+            [sys.executable, __file__, '--dsn', args.dsn, '--runs', str(args.runs), '--function', function],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            sys.stderr.write(completed.stderr)
+            raise SystemExit(f'Benchmark of {function} failed with exit code {completed.returncode}')
+        results.extend(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    columns = [('function', 10), ('statement', 22), ('execute_ms', 12), ('prepared_ms', 12),
+               ('plan_ms', 10), ('plan_prepared_ms', 17)]
+    print(''.join(name.ljust(width) for name, width in columns))
+    for row in results:
+        print(''.join(str(row[name]).ljust(width) for name, width in columns))
+
+if __name__ == '__main__':
+    main()
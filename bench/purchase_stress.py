@@ -0,0 +1,178 @@
+'''
+Business: Стресс-тест покупки с баланса - сотни параллельных покупателей против одного счёта
+Args: --dsn одноразовой базы, --buyers, --connections, --balance, --price, --deposits, --setup
+Returns: Итоги прогона и проверку инвариантов; код 1, если баланс ушёл в минус или потерялось обновление
+
+Пример:
+  python bench/purchase_stress.py --dsn postgresql://localhost/magazin_bench --setup --buyers 500
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, List
+import psycopg2
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent / 'backend'
+sys.path.insert(0, str(BENCH_DIR))
+
+from setup_db import schema_dsn, setup_database
+
+def create_fixture(dsn: str, balance: Decimal, price: Decimal) -> Dict[str, Any]:
+    '''Отдельный пользователь, товар и сессия на каждый прогон, чтобы прогоны не мешали друг другу.'''
+    tag = f'stress_{int(time.time() * 1000)}'
+    conn = psycopg2.connect(schema_dsn(dsn))
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                '''INSERT INTO users (username, email, balance, status)
+                   VALUES (%s, %s, %s, 'active') RETURNING id''',
+                (tag, f'{tag}@example.com', balance)
+            )
+            user_id = cursor.fetchone()[0]
+            cursor.execute(
+                '''INSERT INTO products (title, price, price_amount, price_currency)
+                   VALUES (%s, %s, %s, 'RUB') RETURNING id''',
+                (f'Stress product {tag}', f'{price}₽', price)
+            )
+            product_id = cursor.fetchone()[0]
+            cursor.execute(
+                '''INSERT INTO user_sessions (user_id, session_token, expires_at)
+                   VALUES (%s, %s, CURRENT_TIMESTAMP + INTERVAL '1 day')''',
+                (user_id, f'{tag}-token')
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return {'user_id': user_id, 'product_id': product_id, 'token': f'{tag}-token'}
+
+def read_state(dsn: str, user_id: int) -> Dict[str, Any]:
+    conn = psycopg2.connect(schema_dsn(dsn))
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT balance FROM users WHERE id = %s', (user_id,))
+            balance = cursor.fetchone()[0]
+            cursor.execute(
+                '''SELECT count(*) FILTER (WHERE type = 'purchase'), COALESCE(sum(amount), 0)
+                   FROM balance_ledger WHERE user_id = %s''',
+                (user_id,)
+            )
+            purchases, ledger_sum = cursor.fetchone()
+            cursor.execute('SELECT count(*), COALESCE(sum(total_price), 0) FROM orders WHERE user_id = %s', (user_id,))
+            orders, orders_sum = cursor.fetchone()
+    finally:
+        conn.close()
+    return {'balance': balance, 'ledger_purchases': purchases, 'ledger_sum': ledger_sum,
+            'orders': orders, 'orders_sum': orders_sum}
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent purchase_with_balance stress test')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--setup', action='store_true', help='drop, migrate and seed a small benchmark schema first')
+    parser.add_argument('--force', action='store_true', help='allow --setup on a database without bench/test in its name')
+    parser.add_argument('--buyers', type=int, default=300, help='parallel purchase attempts')
+    parser.add_argument('--connections', type=int, default=50, help='pool size; keep below max_connections')
+    parser.add_argument('--balance', default='10000', help='starting balance')
+    parser.add_argument('--price', default='249.90', help='product price, fractional by default to check kopecks')
+    parser.add_argument('--deposits', type=int, default=50, help='concurrent add_balance calls mixed in')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('--dsn is required (or set BENCH_DATABASE_URL)')
+
+    if args.setup:
+        setup_database(args.dsn, {'users': 100, 'orders': 100, 'products': 10, 'sessions': 100, 'logs': 100}, args.force)
+
+    balance, price = Decimal(args.balance), Decimal(args.price)
+    fixture = create_fixture(args.dsn, balance, price)
+
+    function_dir = BACKEND_DIR / 'users'
+    sys.path.insert(0, str(function_dir))
+    os.chdir(function_dir)
+    os.environ['DATABASE_URL'] = schema_dsn(args.dsn)
+    os.environ['DB_POOL_MAX'] = str(args.connections)
+    import index
+
+    rng = random.Random(args.seed)
+    deposit_amounts = [Decimal(rng.randint(1, 500)) for _ in range(args.deposits)]
+    calls: List[Dict[str, Any]] = [
+        {
+            'httpMethod': 'POST', 'queryStringParameters': {}, 'headers': {'X-Session-Token': fixture['token']},
+            'body': json.dumps({'action': 'purchase_with_balance', 'product_id': fixture['product_id']})
+        }
+        for _ in range(args.buyers)
+    ] + [
+        {
+            'httpMethod': 'POST', 'queryStringParameters': {}, 'headers': {},
+            'body': json.dumps({'action': 'add_balance', 'user_id': fixture['user_id'], 'amount': str(amount)})
+        }
+        for amount in deposit_amounts
+    ]
+    rng.shuffle(calls)
+
+    # Все покупатели стартуют одновременно; пул ограничивает число одновременных соединений
+    gate = threading.Barrier(len(calls))
+    slots = threading.BoundedSemaphore(args.connections)
+
+    def call(event):
+        gate.wait()
+        with slots:
+            try:
+                return json.loads(event['body'])['action'], index.handler(event, None)['statusCode']
+            except Exception as e:
+                return json.loads(event['body'])['action'], f'error:{type(e).__name__}'
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        results = list(pool.map(call, calls))
+    wall = time.perf_counter() - started
+
+    statuses = Counter(f'{action}:{status}' for action, status in results)
+    bought = statuses['purchase_with_balance:200']
+    deposited = statuses['add_balance:200']
+    state = read_state(args.dsn, fixture['user_id'])
+
+    # Депозиты выполняются все (их сумма известна), поэтому итоговый баланс однозначно определён
+    expected_balance = balance + sum(deposit_amounts) - price * bought if deposited == len(deposit_amounts) else None
+    violations = []
+    if state['balance'] < 0:
+        violations.append(f"balance went negative: {state['balance']}")
+    if expected_balance is not None and state['balance'] != expected_balance:
+        violations.append(f"lost update: balance {state['balance']}, expected {expected_balance}")
+    if state['ledger_purchases'] != bought:
+        violations.append(f"ledger has {state['ledger_purchases']} purchases, handler reported {bought}")
+    if state['ledger_sum'] != sum(deposit_amounts) - price * bought and deposited == len(deposit_amounts):
+        violations.append(f"ledger sums to {state['ledger_sum']}, which does not match deposits and purchases")
+    if state['orders'] != bought:
+        violations.append(f"{state['orders']} orders created, handler reported {bought} purchases")
+    if state['orders_sum'] != price * bought:
+        violations.append(f"orders total {state['orders_sum']}, ledger debited {price * bought}")
+    if any(str(status).startswith('error') for _, status in results):
+        violations.append('handler raised errors')
+
+    print(json.dumps({
+        'buyers': args.buyers,
+        'deposits': args.deposits,
+        'connections': args.connections,
+        'wall_s': round(wall, 3),
+        'statuses': dict(statuses),
+        'final_balance': str(state['balance']),
+        'expected_balance': str(expected_balance),
+    }, ensure_ascii=False, indent=2))
+
+    for line in violations:
+        print(f'VIOLATION {line}')
+    if violations:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''
+Business: Проверка чтения с реплики - чтение уходит на DATABASE_READ_URL, а после записи клиент видит свою запись
+Args: --primary и --replica (основной сервер и его реплика потоковой репликации), --rounds, --pause-replay, --setup
+Returns: Сколько чтений обслужила реплика и сколько ушло на основной сервер; код 1, если чтение после записи вернуло старые данные
+
+Пример:
+  python bench/replica_check.py --primary postgresql://localhost:5432/magazin_bench \
+      --replica postgresql://localhost:5433/magazin_bench --rounds 200 --pause-replay
+'''
+
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict
+import psycopg2
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent / 'backend'
+sys.path.insert(0, str(BENCH_DIR))
+
+from scenarios import body_event, get_event
+from setup_db import schema_dsn, setup_database
+
+def in_recovery(dsn: str) -> bool:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_is_in_recovery()')
+            return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+def set_replay(dsn: str, paused: bool):
+    '''Пауза проигрывания WAL на реплике (нужен суперпользователь): так лаг становится заметным.'''
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_wal_replay_pause()' if paused else 'SELECT pg_wal_replay_resume()')
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Check read replica routing and read-your-writes through the balance handler')
+    parser.add_argument('--primary', required=True)
+    parser.add_argument('--replica', required=True)
+    parser.add_argument('--rounds', type=int, default=100)
+    parser.add_argument('--user-id', type=int, default=1)
+    parser.add_argument('--other-user-id', type=int, default=2)
+    parser.add_argument('--pause-replay', action='store_true', help='pause WAL replay on the replica during the check')
+    parser.add_argument('--setup', action='store_true', help='drop, migrate and seed a small benchmark schema on the primary first')
+    parser.add_argument('--force', action='store_true', help='allow --setup on a database without bench/test in its name')
+    args = parser.parse_args()
+
+    if not in_recovery(args.replica):
+        raise SystemExit('--replica is not in recovery: point it at a streaming standby of --primary')
+    if in_recovery(args.primary):
+        raise SystemExit('--primary is in recovery: it must accept writes')
+    if args.setup:
+        setup_database(args.primary, {'users': 100, 'orders': 100, 'products': 10, 'sessions': 100, 'logs': 100}, args.force)
+
+    function_dir = BACKEND_DIR / 'balance'
+    sys.path.insert(0, str(function_dir))
+    os.chdir(function_dir)
+    os.environ['DATABASE_URL'] = schema_dsn(args.primary)
+    os.environ['DATABASE_READ_URL'] = schema_dsn(args.replica)
+    import db
+    import index
+
+    # Какой пул обслужил запрос: роль соединения видна, когда обработчик его возвращает
+    served = Counter()
+    release = index.release_connection
+
+    def counting_release(conn):
+        served[conn.role] += 1
+        release(conn)
+
+    index.release_connection = counting_release
+
+    reads: Dict[str, Counter] = {'other_user': Counter(), 'read_after': Counter(), 'sticky': Counter()}
+    stale: Dict[str, int] = {'read_after': 0, 'sticky': 0}
+
+    def read_balance(user_id: int, headers: Dict[str, str], label: str) -> Decimal:
+        served.clear()
+        response = index.handler(get_event({'action': 'balance', 'user_id': user_id}, headers), None)
+        reads[label][next(iter(served))] += 1
+        return Decimal(str(json.loads(response['body'])['balance']))
+
+    if args.pause_replay:
+        set_replay(args.replica, True)
+    try:
+        for _ in range(args.rounds):
+            response = index.handler(body_event('POST', {
+                'user_id': args.user_id, 'amount': 1, 'description': 'Replica check'
+            }), None)
+            written = Decimal(str(json.loads(response['body'])['new_balance']))
+            read_after = response['headers'].get('X-Read-After')
+            if not read_after:
+                raise SystemExit('Write response has no X-Read-After header: is DATABASE_READ_URL picked up?')
+
+            # Тот же экземпляр: запись запомнена для пользователя
+            if read_balance(args.user_id, {}, 'sticky') != written:
+                stale['sticky'] += 1
+            # Другой экземпляр: знает о записи только из заголовка клиента
+            db._write_marks.clear()
+            if read_balance(args.user_id, {'X-Read-After': read_after}, 'read_after') != written:
+                stale['read_after'] += 1
+            read_balance(args.other_user_id, {}, 'other_user')
+    finally:
+        if args.pause_replay:
+            set_replay(args.replica, False)
+
+    print(f"{'reads'.ljust(14)}{'replica'.ljust(10)}{'primary'.ljust(10)}stale")
+    for label, counter in reads.items():
+        print(f"{label.ljust(14)}{str(counter['replica']).ljust(10)}{str(counter['primary']).ljust(10)}{stale.get(label, '-')}")
+
+    if reads['other_user']['replica'] == 0:
+        raise SystemExit('No read was served by the replica')
+    if any(stale.values()):
+        raise SystemExit('Read after write returned a stale balance')
+
+if __name__ == '__main__':
+    main()
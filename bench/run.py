@@ -0,0 +1,122 @@
+'''
+Business: Бенчмарк и нагрузочный прогон всех обработчиков backend/ на локальной PostgreSQL
+Args: --dsn одноразовой базы, --setup и размеры данных, --functions, --requests, --concurrency,
+      --json для сохранения результата, --compare с допустимой деградацией --max-regression
+Returns: Таблицу p50/p95/p99, запросов к БД на запрос и пропускной способности; код 1 при регрессии
+
+Пример:
+  python bench/run.py --dsn postgresql://localhost/magazin_bench --setup --users 1000000 --orders 1000000
+  python bench/run.py --dsn postgresql://localhost/magazin_bench --read-only --json bench/baseline.json
+  python bench/run.py --dsn postgresql://localhost/magazin_bench --read-only --compare bench/baseline.json
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from scenarios import FUNCTIONS
+from setup_db import DEFAULT_SIZES, add_size_arguments, schema_dsn, setup_database
+
+COLUMNS = [
+    ('function', 9), ('scenario', 22), ('p50_ms', 9), ('p95_ms', 9), ('p99_ms', 9),
+    ('throughput_rps', 10), ('queries_per_request', 8), ('statuses', 24),
+]
+
+def run_function(function: str, args: argparse.Namespace, sizes: Dict[str, int]) -> List[Dict[str, Any]]:
+    command = [
+        sys.executable, str(BENCH_DIR / 'driver.py'),
+        '--function', function,
+        '--requests', str(args.requests),
+        '--concurrency', str(args.concurrency),
+        '--warmup', str(args.warmup),
+        '--sizes', json.dumps(sizes),
+        '--scenario', args.scenario,
+    ]
+    if args.read_only:
+        command.append('--read-only')
+
+    env = dict(os.environ, DATABASE_URL=schema_dsn(args.dsn))
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(f'Benchmark of {function} failed with exit code {completed.returncode}')
+    return [json.loads(line) for line in completed.stdout.splitlines() if line.startswith('{')]
+
+def print_table(results: List[Dict[str, Any]]):
+    print('  '.join(name[:width].ljust(width) for name, width in COLUMNS))
+    for result in results:
+        cells = []
+        for name, width in COLUMNS:
+            value = result[name]
+            if isinstance(value, dict):
+                value = ','.join(f'{k}:{v}' for k, v in value.items())
+            cells.append(str(value)[:width].ljust(width))
+        print('  '.join(cells))
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, max_regression: float) -> List[str]:
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['function'], r['scenario']): r for r in json.load(f)['results']}
+
+    regressions = []
+    for result in results:
+        before = baseline.get((result['function'], result['scenario']))
+        if not before:
+            continue
+        name = f"{result['function']}/{result['scenario']}"
+        if result['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+        if result['queries_per_request'] > before['queries_per_request']:
+            regressions.append(
+                f"{name}: queries/request {before['queries_per_request']} -> {result['queries_per_request']}"
+            )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the serverless handlers against a local PostgreSQL')
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--setup', action='store_true', help='drop, migrate and seed the benchmark schema first')
+    parser.add_argument('--force', action='store_true', help='allow --setup on a database without bench/test in its name')
+    parser.add_argument('--functions', default=','.join(FUNCTIONS))
+    parser.add_argument('--scenario', default='*', help='glob over scenario names')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--read-only', action='store_true', help='skip scenarios that write')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='baseline JSON produced by --json')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='allowed p95 growth, 0.2 = 20%%')
+    add_size_arguments(parser)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('--dsn is required (or set BENCH_DATABASE_URL)')
+
+    sizes = {name: getattr(args, name) for name in DEFAULT_SIZES}
+    if args.setup:
+        setup_database(args.dsn, sizes, args.force)
+
+    results = []
+    for function in args.functions.split(','):
+        results.extend(run_function(function.strip(), args, sizes))
+
+    print_table(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'sizes': sizes, 'results': results}, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.max_regression)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
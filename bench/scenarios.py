@@ -0,0 +1,116 @@
+'''
+Business: Синтетические события API Gateway для каждого обработчика из backend/
+Args: имя функции, размеры засеянных данных, генератор случайных чисел
+Returns: Словарь сценарий -> фабрика event для handler(event, context)
+'''
+
+import itertools
+import json
+import random
+import time
+from typing import Any, Callable, Dict
+
+Event = Dict[str, Any]
+Scenario = Callable[[random.Random], Event]
+
+# Пользователи из V0002 занимают id 1..3, засеянные бенчмарком начинаются с 4
+SEED_USER_OFFSET = 3
+TELEGRAM_ID_BASE = 1000000000
+# update_id растут, как у Telegram: случайные id ниже отметки вебхук отбросил бы как повтор
+UPDATE_IDS = itertools.count(int(time.time() * 1000))
+# driver и cold_start передают функциям этот токен в ADMIN_API_TOKEN: очередь поддержки и общая лента - админские маршруты
+BENCH_ADMIN_TOKEN = 'bench-admin-token'
+ADMIN_HEADERS = {'X-Admin-Auth': BENCH_ADMIN_TOKEN}
+
+def get_event(query: Dict[str, Any] = None, headers: Dict[str, str] = None) -> Event:
+    return {
+        'httpMethod': 'GET',
+        'queryStringParameters': {k: str(v) for k, v in (query or {}).items()},
+        'headers': headers or {},
+        'body': ''
+    }
+
+def body_event(method: str, body: Dict[str, Any], headers: Dict[str, str] = None) -> Event:
+    return {
+        'httpMethod': method,
+        'queryStringParameters': {},
+        'headers': headers or {},
+        'body': json.dumps(body, ensure_ascii=False)
+    }
+
+def session_headers(rng: random.Random, sizes: Dict[str, int]) -> Dict[str, str]:
+    n = rng.randint(1, max(1, min(sizes['sessions'], sizes['users'])))
+    return {'X-Session-Token': f'bench-token-{TELEGRAM_ID_BASE + n}'}
+
+def telegram_update(rng: random.Random, sizes: Dict[str, int], text: str) -> Event:
+    telegram_id = TELEGRAM_ID_BASE + rng.randint(1, max(1, sizes['users']))
+    return body_event('POST', {
+        'update_id': next(UPDATE_IDS),
+        'message': {
+            'chat': {'id': telegram_id},
+            'from': {'id': telegram_id, 'first_name': 'Bench', 'username': f'tg_bench_{telegram_id}'},
+            'text': text
+        }
+    })
+
+def user_id(rng: random.Random, sizes: Dict[str, int]) -> int:
+    return SEED_USER_OFFSET + rng.randint(1, max(1, sizes['users']))
+
+def build_scenarios(function: str, sizes: Dict[str, int]) -> Dict[str, Scenario]:
+    products = max(1, sizes['products'])
+
+    if function == 'products':
+        return {
+            'catalog': lambda rng: get_event(),
+            'product_by_id': lambda rng: get_event({'id': rng.randint(1, products)}),
+            'price_range': lambda rng: get_event({'min_price': 200, 'max_price': 600, 'sort': 'price_asc'}),
+        }
+
+    if function == 'orders':
+        return {
+            'list_first_page': lambda rng: get_event({'limit': 50}),
+            'list_by_status': lambda rng: get_event({'limit': 50, 'status': 'completed'}),
+            'list_date_range': lambda rng: get_event({'limit': 50, 'date_from': '2000-01-01', 'date_to': '2100-01-01'}),
+            'create_order:write': lambda rng: body_event('POST', {
+                'customer_name': 'Bench customer',
+                'customer_email': 'bench@example.com',
+                'items': [{'id': rng.randint(1, products), 'quantity': 1}],
+                'total_price': rng.randint(100, 1000)
+            }),
+        }
+
+    if function == 'users':
+        return {
+            'list_first_page': lambda rng: get_event({'limit': 50}),
+            'search': lambda rng: get_event({'limit': 20, 'search': f'user_{rng.randint(1, 999)}'}),
+            'verify_session': lambda rng: get_event({'action': 'verify'}, session_headers(rng, sizes)),
+            'purchases': lambda rng: get_event({'action': 'purchases', 'user_id': user_id(rng, sizes)}),
+            'support_queue': lambda rng: get_event({'action': 'support', 'limit': 50, 'unread': '1'}, ADMIN_HEADERS),
+            'changes_poll': lambda rng: get_event({'action': 'changes', 'cursor': '0', 'wait': '0'}, ADMIN_HEADERS),
+            'telegram_help:write': lambda rng: telegram_update(rng, sizes, '/help'),
+            'telegram_login:write': lambda rng: telegram_update(rng, sizes, '/login'),
+        }
+
+    if function == 'balance':
+        return {
+            'balance': lambda rng: get_event({'action': 'balance', 'user_id': user_id(rng, sizes)}),
+            'transactions': lambda rng: get_event({'action': 'transactions', 'user_id': user_id(rng, sizes)}),
+            'statement': lambda rng: get_event({'action': 'statement', 'user_id': user_id(rng, sizes)}),
+            'deposit:write': lambda rng: body_event('POST', {
+                'user_id': user_id(rng, sizes),
+                'amount': rng.randint(1, 500),
+                'description': 'Bench deposit'
+            }),
+        }
+
+    if function == 'admins':
+        return {
+            'site_status': lambda rng: get_event({'action': 'site_status'}),
+            'logs': lambda rng: get_event({'action': 'logs', 'limit': 100}),
+            'logs:user': lambda rng: get_event({'action': 'logs', 'limit': 50, 'user_id': rng.randint(0, 999)}),
+            'admins': lambda rng: get_event(),
+        }
+
+    raise ValueError(f'Unknown function: {function}')
+
+FUNCTIONS = ['products', 'orders', 'users', 'balance', 'admins']
@@ -0,0 +1,120 @@
+'''
+Business: Бенчмарк сериализации ответов - json.dumps(default=str), responses.dumps на json и orjson, json_agg в базе
+Args: --rows, --runs; --dsn одноразовой базы добавляет сравнение json_agg с выборкой строк и dumps
+Returns: Таблицу среднего и p95 времени на ответ по каждому способу
+
+Пример:
+  python bench/serialization.py --rows 500
+  python bench/serialization.py --rows 500 --dsn postgresql://localhost/magazin_bench
+'''
+
+import argparse
+import importlib
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent / 'backend'
+sys.path.insert(0, str(BENCH_DIR))
+sys.path.insert(0, str(BACKEND_DIR / 'orders'))
+
+def synthetic_orders(count: int) -> List[Dict[str, Any]]:
+    '''Строки, похожие на выдачу RealDictCursor по orders: Decimal, datetime и разобранный JSONB.'''
+    started = datetime(2025, 1, 1, 12, 0, 0)
+    return [
+        {
+            'id': i,
+            'customer_name': f'Покупатель {i}',
+            'customer_email': f'user{i}@example.com',
+            'items': [{'id': 1 + i % 50, 'title': f'Товар {i % 50}', 'quantity': 1 + i % 3, 'price': 100 + i % 900}],
+            'total_price': 100 + i % 900,
+            'status': 'В обработке',
+            'amount': Decimal(f'{100 + i % 900}.50'),
+            'created_at': started - timedelta(minutes=i),
+            'updated_at': started - timedelta(minutes=i)
+        }
+        for i in range(count)
+    ]
+
+def measure(fn: Callable[[], Any], runs: int) -> Dict[str, float]:
+    fn()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'mean_ms': round(statistics.mean(samples), 3),
+        'p95_ms': round(samples[int(len(samples) * 0.95) - 1], 3)
+    }
+
+def encoder(name: str):
+    os.environ['JSON_ENCODER'] = name
+    import responses
+    return importlib.reload(responses)
+
+def python_paths(rows: List[Dict[str, Any]], runs: int) -> Dict[str, Dict[str, float]]:
+    payload = {'orders': rows, 'next_cursor': 'abc', 'has_more': True}
+    results = {
+        'json.dumps default=str': measure(lambda: json.dumps(payload, ensure_ascii=False, default=str), runs)
+    }
+    stdlib = encoder('json')
+    results['responses.dumps json'] = measure(lambda: stdlib.dumps(payload), runs)
+    fast = encoder('orjson')
+    if fast.JSON_ENCODER == 'orjson':
+        results['responses.dumps orjson'] = measure(lambda: fast.dumps(payload), runs)
+    return results
+
+def database_paths(dsn: str, rows: int, runs: int) -> Dict[str, Dict[str, float]]:
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    from setup_db import schema_dsn
+    from pagination import fetch_json_page
+
+    responses = encoder('orjson')
+    query = 'SELECT * FROM orders ORDER BY created_at DESC, id DESC LIMIT %s'
+    conn = psycopg2.connect(schema_dsn(dsn))
+    try:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+        def fetch_and_dump():
+            cursor.execute(query, (rows + 1,))
+            return responses.dumps({'orders': cursor.fetchall()[:rows]})
+
+        def json_agg():
+            body, _ = fetch_json_page(cursor, query, [rows + 1], rows)
+            return responses.dumps_with_fragments({}, orders=body)
+
+        return {
+            f'fetch + dumps ({responses.JSON_ENCODER})': measure(fetch_and_dump, runs),
+            'json_agg in SQL': measure(json_agg, runs)
+        }
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare JSON response serialization paths')
+    parser.add_argument('--rows', type=int, default=500, help='rows per response')
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'),
+                        help='seeded benchmark database (bench/setup_db.py) for the json_agg comparison')
+    args = parser.parse_args()
+
+    results = python_paths(synthetic_orders(args.rows), args.runs)
+    if args.dsn:
+        results.update(database_paths(args.dsn, args.rows, args.runs))
+
+    print(f"{'path'.ljust(32)}{'mean_ms'.rjust(10)}{'p95_ms'.rjust(10)}")
+    for name, stats in results.items():
+        print(f"{name.ljust(32)}{str(stats['mean_ms']).rjust(10)}{str(stats['p95_ms']).rjust(10)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+'''
+Business: Подготовка одноразовой локальной базы PostgreSQL для бенчмарков обработчиков
+Args: DSN тестовой базы, размеры данных (users, orders, products, sessions, logs)
+Returns: Схему t_p8741694_magazin_samp с применёнными db_migrations и синтетическими данными
+
+Пример: python bench/setup_db.py postgresql://localhost/magazin_bench --users 100000 --orders 1000000
+'''
+
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import Dict
+import psycopg2
+from psycopg2.extensions import make_dsn, parse_dsn
+
+SCHEMA = 't_p8741694_magazin_samp'
+ROOT = Path(__file__).resolve().parent.parent
+MIGRATIONS_DIR = ROOT / 'db_migrations'
+
+DEFAULT_SIZES = {
+    'users': 10000,
+    'orders': 10000,
+    'products': 200,
+    'sessions': 10000,
+    'logs': 10000,
+}
+
+def schema_dsn(dsn: str) -> str:
+    '''DSN, в котором search_path указывает на схему приложения, как в рабочей базе.'''
+    return make_dsn(dsn, options=f'-c search_path={SCHEMA},public')
+
+def ensure_disposable(dsn: str, force: bool):
+    dbname = parse_dsn(dsn).get('dbname', '')
+    if not force and 'bench' not in dbname and 'test' not in dbname:
+        raise SystemExit(
+            f"Refusing to reset database '{dbname}': its name must contain 'bench' or 'test' (or pass --force)"
+        )
+
+def apply_migrations(cursor):
+    for path in sorted(MIGRATIONS_DIR.glob('V*.sql')):
+        cursor.execute(path.read_text(encoding='utf-8'))
+
+def seed(cursor, sizes: Dict[str, int]):
+    cursor.execute(
+        '''INSERT INTO users (username, email, balance, status, telegram_id, telegram_username, created_at)
+           SELECT 'bench_user_' || g, 'bench_user_' || g || '@example.com',
+                  (g %% 5000)::numeric, CASE WHEN g %% 50 = 0 THEN 'blocked' ELSE 'active' END,
+                  1000000000 + g, 'tg_bench_' || g,
+                  CURRENT_TIMESTAMP - g * INTERVAL '1 minute'
+           FROM generate_series(1, %s) AS g''',
+        (sizes['users'],)
+    )
+    cursor.execute(
+        '''INSERT INTO user_sessions (user_id, session_token, expires_at)
+           SELECT u.id, 'bench-token-' || u.telegram_id, CURRENT_TIMESTAMP + INTERVAL '30 days'
+           FROM users u WHERE u.username LIKE 'bench\\_user\\_%%'
+           ORDER BY u.id LIMIT %s''',
+        (sizes['sessions'],)
+    )
+    cursor.execute(
+        '''INSERT INTO products (title, price, price_amount, price_currency, description, icon, gradient)
+           SELECT 'Bench product ' || g, (100 + g %% 900) || '₽', 100 + g %% 900, 'RUB',
+                  'Synthetic product ' || g, 'Package', 'bg-gradient-primary'
+           FROM generate_series(1, %s) AS g''',
+        (sizes['products'],)
+    )
+    cursor.execute(
+        '''INSERT INTO product_images (product_id, image_url, is_primary, display_order)
+           SELECT p.id, 'https://cdn.example.com/' || p.id || '/' || n || '.png', n = 0, n
+           FROM products p CROSS JOIN generate_series(0, 2) AS n'''
+    )
+    cursor.execute(
+        '''INSERT INTO orders (customer_name, customer_email, items, total_price, status, user_id, product_id, created_at)
+           SELECT 'Bench customer ' || g, 'customer' || g || '@example.com',
+                  jsonb_build_array(jsonb_build_object('id', 1 + g %% 6, 'quantity', 1)),
+                  100 + g %% 900,
+                  (ARRAY['В обработке', 'completed', 'Выполнен', 'pending'])[1 + g %% 4],
+                  1 + g %% GREATEST(%s, 1), 1 + g %% 6,
+                  CURRENT_TIMESTAMP - g * INTERVAL '10 seconds'
+           FROM generate_series(1, %s) AS g''',
+        (sizes['users'], sizes['orders'])
+    )
+    cursor.execute(
+        '''INSERT INTO balance_ledger (user_id, amount, balance_after, type, description, created_at)
+           SELECT user_id, amount,
+                  SUM(amount) OVER (PARTITION BY user_id ORDER BY created_at, g),
+                  'deposit', 'Bench deposit', created_at
+           FROM (
+               SELECT g, 1 + g %% GREATEST(%s, 1) AS user_id, (10 + g %% 990)::numeric AS amount,
+                      CURRENT_TIMESTAMP - g * INTERVAL '1 minute' AS created_at
+               FROM generate_series(1, %s) AS g
+           ) entries
+           ORDER BY created_at, g''',
+        (sizes['users'], sizes['orders'])
+    )
+    # Логи уходят в прошлое на sizes['logs'] * 30 секунд - секции нужны и для этих месяцев
+    cursor.execute(
+        "SELECT ensure_auth_logs_partitions((CURRENT_TIMESTAMP - %s * INTERVAL '30 seconds')::date)",
+        (sizes['logs'],)
+    )
+    cursor.execute(
+        '''INSERT INTO auth_logs (user_id, username, action, ip_address, user_agent, status, created_at)
+           SELECT g %% 1000, 'bench_user_' || (g %% 1000), (ARRAY['login', 'logout', 'verify'])[1 + g %% 3],
+                  '10.0.' || (g %% 255) || '.' || (g %% 253), 'bench-agent',
+                  CASE WHEN g %% 10 = 0 THEN 'failed' ELSE 'success' END,
+                  CURRENT_TIMESTAMP - g * INTERVAL '30 seconds'
+           FROM generate_series(1, %s) AS g''',
+        (sizes['logs'],)
+    )
+
+def setup_database(dsn: str, sizes: Dict[str, int], force: bool = False):
+    ensure_disposable(dsn, force)
+    conn = psycopg2.connect(schema_dsn(dsn))
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+            cursor.execute(f'CREATE SCHEMA {SCHEMA}')
+            apply_migrations(cursor)
+            seed(cursor, sizes)
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute('VACUUM ANALYZE')
+    finally:
+        conn.close()
+
+def add_size_arguments(parser: argparse.ArgumentParser):
+    for name, default in DEFAULT_SIZES.items():
+        parser.add_argument(f'--{name}', type=int, default=default, help=f'rows to seed (default {default})')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create and seed a disposable benchmark database')
+    parser.add_argument('dsn', nargs='?', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--force', action='store_true', help='allow resetting a database without bench/test in its name')
+    add_size_arguments(parser)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('dsn is required (or set BENCH_DATABASE_URL)')
+
+    sizes = {name: getattr(args, name) for name in DEFAULT_SIZES}
+    started = time.monotonic()
+    setup_database(args.dsn, sizes, args.force)
+    print(f'Seeded {sizes} in {time.monotonic() - started:.1f}s')
@@ -0,0 +1,90 @@
+'''
+Business: Локальная заглушка Telegram Bot API для проверки очереди исходящих сообщений
+Args: --port, --fail-every N (каждый N-й запрос получает 429 с retry_after), --latency секунды
+Returns: HTTP-сервер, который принимает sendMessage и печатает полученные сообщения
+
+Запуск: python bench/telegram_stub.py --port 8081
+Затем: TELEGRAM_API_BASE=http://127.0.0.1:8081 TELEGRAM_BOT_TOKEN=test python backend/users/outbox.py
+'''
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+class TelegramStub(ThreadingHTTPServer):
+    def __init__(self, address, fail_every: int = 0, latency: float = 0.0, retry_after: int = 1):
+        super().__init__(address, TelegramStubHandler)
+        self.fail_every = fail_every
+        self.latency = latency
+        self.retry_after = retry_after
+        self.messages: List[Dict[str, Any]] = []
+        self.requests = 0
+        self.lock = threading.Lock()
+
+class TelegramStubHandler(BaseHTTPRequestHandler):
+    server: TelegramStub
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            payload = {}
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        with self.server.lock:
+            self.server.requests += 1
+            throttled = self.server.fail_every and self.server.requests % self.server.fail_every == 0
+            if not throttled and self.path.endswith('/sendMessage'):
+                self.server.messages.append(payload)
+
+        if not self.path.endswith('/sendMessage'):
+            self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+        elif throttled:
+            self._reply(429, {
+                'ok': False,
+                'error_code': 429,
+                'description': 'Too Many Requests',
+                'parameters': {'retry_after': self.server.retry_after}
+            })
+        else:
+            self._reply(200, {'ok': True, 'result': {'message_id': len(self.server.messages), 'chat': {'id': payload.get('chat_id')}}})
+
+    def _reply(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+def start_stub(port: int = 0, **options) -> TelegramStub:
+    '''Запускает заглушку в фоновом потоке; адрес - http://127.0.0.1:{server.server_port}.'''
+    server = TelegramStub(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local Telegram Bot API stub')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--fail-every', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    stub = start_stub(args.port, fail_every=args.fail_every, latency=args.latency, retry_after=args.retry_after)
+    print(f'Telegram stub listening on http://127.0.0.1:{stub.server_port}')
+    try:
+        while True:
+            time.sleep(5)
+            print(f'requests={stub.requests} delivered={len(stub.messages)}')
+    except KeyboardInterrupt:
+        stub.shutdown()
@@ -0,0 +1,28 @@
+-- Версия каталога товаров: увеличивается при любом изменении products и product_images
+CREATE TABLE IF NOT EXISTS t_p8741694_magazin_samp.catalog_state (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p8741694_magazin_samp.catalog_state (id, version) VALUES (1, 1)
+ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION t_p8741694_magazin_samp.bump_catalog_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE t_p8741694_magazin_samp.catalog_state
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_products_catalog_version ON t_p8741694_magazin_samp.products;
+CREATE TRIGGER trg_products_catalog_version
+AFTER INSERT OR UPDATE OR DELETE ON t_p8741694_magazin_samp.products
+FOR EACH STATEMENT EXECUTE FUNCTION t_p8741694_magazin_samp.bump_catalog_version();
+
+DROP TRIGGER IF EXISTS trg_product_images_catalog_version ON t_p8741694_magazin_samp.product_images;
+CREATE TRIGGER trg_product_images_catalog_version
+AFTER INSERT OR UPDATE OR DELETE ON t_p8741694_magazin_samp.product_images
+FOR EACH STATEMENT EXECUTE FUNCTION t_p8741694_magazin_samp.bump_catalog_version();
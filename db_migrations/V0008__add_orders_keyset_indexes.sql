@@ -0,0 +1,6 @@
+-- Индексы для keyset-пагинации списка заказов по (created_at, id) и фильтра по статусу
+CREATE INDEX IF NOT EXISTS idx_orders_created_id
+ON t_p8741694_magazin_samp.orders (created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_orders_status_created_id
+ON t_p8741694_magazin_samp.orders (status, created_at DESC, id DESC);
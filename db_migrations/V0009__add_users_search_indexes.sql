@@ -0,0 +1,15 @@
+-- Триграммные индексы для поиска пользователей по подстроке (ILIKE '%...%')
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_users_username_trgm
+ON t_p8741694_magazin_samp.users USING gin (username gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_users_telegram_username_trgm
+ON t_p8741694_magazin_samp.users USING gin (telegram_username gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_users_email_trgm
+ON t_p8741694_magazin_samp.users USING gin (email gin_trgm_ops);
+
+-- Индекс для keyset-пагинации списка пользователей
+CREATE INDEX IF NOT EXISTS idx_users_created_id
+ON t_p8741694_magazin_samp.users (created_at DESC, id DESC);
@@ -0,0 +1,21 @@
+-- Очередь исходящих сообщений Telegram: вебхук только записывает сообщение, отправляет воркер
+CREATE TABLE IF NOT EXISTS t_p8741694_magazin_samp.telegram_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    text TEXT NOT NULL,
+    parse_mode VARCHAR(20) DEFAULT 'HTML',
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_telegram_outbox_pending
+ON t_p8741694_magazin_samp.telegram_outbox (next_attempt_at, id)
+WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_telegram_outbox_pending_chat
+ON t_p8741694_magazin_samp.telegram_outbox (chat_id, id)
+WHERE status = 'pending';
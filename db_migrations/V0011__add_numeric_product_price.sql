@@ -0,0 +1,16 @@
+-- Числовая цена товара и валюта вместо разбора строки вида '1000₽'
+ALTER TABLE t_p8741694_magazin_samp.products
+ADD COLUMN IF NOT EXISTS price_amount NUMERIC(10, 2),
+ADD COLUMN IF NOT EXISTS price_currency VARCHAR(10) DEFAULT 'RUB';
+
+UPDATE t_p8741694_magazin_samp.products
+SET price_amount = NULLIF(regexp_replace(replace(price, ',', '.'), '[^0-9.]', '', 'g'), '')::NUMERIC(10, 2),
+    price_currency = CASE
+        WHEN price LIKE '%$%' THEN 'USD'
+        WHEN price LIKE '%€%' THEN 'EUR'
+        ELSE 'RUB'
+    END
+WHERE price_amount IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_products_price_amount
+ON t_p8741694_magazin_samp.products (price_amount);
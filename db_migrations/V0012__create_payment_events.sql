@@ -0,0 +1,8 @@
+-- Журнал обработанных событий YooKassa: повторная доставка вебхука не меняет заказ и платёж второй раз
+CREATE TABLE IF NOT EXISTS t_p8741694_magazin_samp.payment_events (
+    payment_id VARCHAR(255) NOT NULL,
+    event VARCHAR(100) NOT NULL,
+    order_id INTEGER,
+    processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (payment_id, event)
+);
@@ -0,0 +1,8 @@
+-- Покупатель и товар заказа: их пишут оплата через YooKassa и покупка с баланса,
+-- а список покупок пользователя читает заказы по user_id
+ALTER TABLE t_p8741694_magazin_samp.orders
+ADD COLUMN IF NOT EXISTS user_id INTEGER,
+ADD COLUMN IF NOT EXISTS product_id INTEGER;
+
+CREATE INDEX IF NOT EXISTS idx_orders_user_created
+ON t_p8741694_magazin_samp.orders (user_id, created_at DESC);
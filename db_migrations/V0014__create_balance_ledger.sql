@@ -0,0 +1,92 @@
+-- Единый журнал операций с балансом вместо transactions и balance_transactions.
+-- balance_after - остаток после операции: баланс на любой момент читается одной строкой по индексу
+CREATE TABLE IF NOT EXISTS t_p8741694_magazin_samp.balance_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    amount NUMERIC(12, 2) NOT NULL,
+    balance_after NUMERIC(12, 2) NOT NULL,
+    type VARCHAR(50) NOT NULL,
+    description TEXT,
+    source VARCHAR(50),
+    source_id INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_user_created
+ON t_p8741694_magazin_samp.balance_ledger (user_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_created
+ON t_p8741694_magazin_samp.balance_ledger (created_at);
+
+-- Перенос истории из обеих таблиц. Запись 'opening' ставится перед историей пользователя и сводит
+-- сумму журнала с текущим users.balance. Старые 'reset' писались с amount = 0, поэтому остатки до них
+-- приблизительные; новые записи пишутся с фактической суммой
+INSERT INTO t_p8741694_magazin_samp.balance_ledger
+    (user_id, amount, balance_after, type, description, source, source_id, created_at)
+SELECT user_id, amount,
+       SUM(amount) OVER (PARTITION BY user_id ORDER BY created_at, sort_key, source_id
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW),
+       type, description, source, source_id, created_at
+FROM (
+    SELECT user_id, amount, type, description, source, source_id, created_at, 1 AS sort_key
+    FROM (
+        SELECT user_id, amount, type, description, 'transactions' AS source, id AS source_id,
+               COALESCE(created_at, CURRENT_TIMESTAMP) AS created_at
+        FROM t_p8741694_magazin_samp.transactions
+        UNION ALL
+        SELECT user_id, amount, type, description, 'balance_transactions', id,
+               COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM t_p8741694_magazin_samp.balance_transactions
+        WHERE user_id IS NOT NULL
+    ) legacy
+    UNION ALL
+    SELECT u.id, COALESCE(u.balance, 0) - COALESCE(h.total, 0), 'opening',
+           'Остаток на момент переноса истории', 'migration', NULL,
+           COALESCE(LEAST(h.first_at, u.created_at), u.created_at, CURRENT_TIMESTAMP), 0
+    FROM t_p8741694_magazin_samp.users u
+    LEFT JOIN (
+        SELECT user_id, SUM(amount) AS total, MIN(COALESCE(created_at, CURRENT_TIMESTAMP)) AS first_at
+        FROM (
+            SELECT user_id, amount, created_at FROM t_p8741694_magazin_samp.transactions
+            UNION ALL
+            SELECT user_id, amount, created_at FROM t_p8741694_magazin_samp.balance_transactions
+        ) legacy_totals
+        GROUP BY user_id
+    ) h ON h.user_id = u.id
+    WHERE COALESCE(u.balance, 0) - COALESCE(h.total, 0) <> 0
+) merged
+WHERE NOT EXISTS (SELECT 1 FROM t_p8741694_magazin_samp.balance_ledger)
+ORDER BY created_at, sort_key, source_id;
+
+-- Журнал только дополняется: исправления оформляются новой записью
+CREATE OR REPLACE FUNCTION t_p8741694_magazin_samp.balance_ledger_append_only() RETURNS trigger AS $$
+BEGIN
+    RAISE EXCEPTION 'balance_ledger is append-only';
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_balance_ledger_append_only ON t_p8741694_magazin_samp.balance_ledger;
+CREATE TRIGGER trg_balance_ledger_append_only
+BEFORE UPDATE OR DELETE ON t_p8741694_magazin_samp.balance_ledger
+FOR EACH ROW EXECUTE FUNCTION t_p8741694_magazin_samp.balance_ledger_append_only();
+
+-- Дневные снимки по пользователю: выписка за период читает по строке на день, а не всю историю
+CREATE TABLE IF NOT EXISTS t_p8741694_magazin_samp.balance_daily (
+    user_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    credits NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    debits NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    entries INTEGER NOT NULL DEFAULT 0,
+    closing_balance NUMERIC(12, 2) NOT NULL,
+    PRIMARY KEY (user_id, day)
+);
+
+-- До какого дня включительно снимки построены; NULL - ещё ни разу
+CREATE TABLE IF NOT EXISTS t_p8741694_magazin_samp.balance_snapshot_state (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    materialized_through DATE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p8741694_magazin_samp.balance_snapshot_state (id, materialized_through) VALUES (1, NULL)
+ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,11 @@
+-- Индекс для чистки просроченных сессий пачками в порядке истечения
+CREATE INDEX IF NOT EXISTS idx_sessions_expires
+ON t_p8741694_magazin_samp.user_sessions (expires_at);
+
+-- Сессии пользователя от самой свежей: ограничение числа сессий на пользователя читает только их
+CREATE INDEX IF NOT EXISTS idx_sessions_user_expires
+ON t_p8741694_magazin_samp.user_sessions (user_id, expires_at DESC, id DESC);
+
+-- idx_sessions_user покрывается новым индексом, idx_sessions_token дублирует индекс UNIQUE(session_token)
+DROP INDEX IF EXISTS t_p8741694_magazin_samp.idx_sessions_user;
+DROP INDEX IF EXISTS t_p8741694_magazin_samp.idx_sessions_token;
@@ -0,0 +1,94 @@
+-- auth_logs становится секционированной по месяцам: чтение с диапазоном дат затрагивает только
+-- нужные секции, а старые месяцы удаляются целиком вместо DELETE по всей таблице
+ALTER TABLE t_p8741694_magazin_samp.auth_logs RENAME TO auth_logs_legacy;
+
+CREATE TABLE t_p8741694_magazin_samp.auth_logs (
+    id BIGSERIAL,
+    user_id INTEGER,
+    username VARCHAR(255),
+    action VARCHAR(50) NOT NULL,
+    ip_address VARCHAR(100),
+    user_agent TEXT,
+    status VARCHAR(50) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (created_at, id)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX IF NOT EXISTS idx_auth_logs_created_id
+ON t_p8741694_magazin_samp.auth_logs (created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_auth_logs_user_created_id
+ON t_p8741694_magazin_samp.auth_logs (user_id, created_at DESC, id DESC);
+
+-- Создаёт недостающие месячные секции auth_logs_pYYYY_MM от from_month до текущего месяца + months_ahead
+CREATE OR REPLACE FUNCTION t_p8741694_magazin_samp.ensure_auth_logs_partitions(
+    from_month DATE, months_ahead INTEGER DEFAULT 2
+) RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_month)::date;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := 'auth_logs_p' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass('t_p8741694_magazin_samp.' || partition_name) IS NULL THEN
+            BEGIN
+                EXECUTE format(
+                    'CREATE TABLE t_p8741694_magazin_samp.%I PARTITION OF t_p8741694_magazin_samp.auth_logs
+                     FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, (month_start + INTERVAL '1 month')::date
+                );
+                created := created + 1;
+            EXCEPTION WHEN duplicate_table THEN
+                -- секцию уже создал параллельный вызов
+                NULL;
+            END;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаляет секции месяцев старше retention_months полных месяцев до текущего
+CREATE OR REPLACE FUNCTION t_p8741694_magazin_samp.drop_auth_logs_partitions(
+    retention_months INTEGER
+) RETURNS INTEGER AS $$
+DECLARE
+    cutoff DATE := (date_trunc('month', CURRENT_DATE) - make_interval(months => retention_months))::date;
+    part RECORD;
+    dropped INTEGER := 0;
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 't_p8741694_magazin_samp.auth_logs'::regclass
+          AND c.relname ~ '^auth_logs_p[0-9]{4}_[0-9]{2}$'
+    LOOP
+        IF to_date(substring(part.relname FROM 12), 'YYYY_MM') < cutoff THEN
+            EXECUTE format('DROP TABLE t_p8741694_magazin_samp.%I', part.relname);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Перенос накопленных записей с сохранением id
+SELECT t_p8741694_magazin_samp.ensure_auth_logs_partitions(
+    COALESCE((SELECT MIN(created_at) FROM t_p8741694_magazin_samp.auth_logs_legacy)::date, CURRENT_DATE)
+);
+
+INSERT INTO t_p8741694_magazin_samp.auth_logs
+    (id, user_id, username, action, ip_address, user_agent, status, created_at)
+SELECT id, user_id, username, action, ip_address, user_agent, status, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM t_p8741694_magazin_samp.auth_logs_legacy;
+
+SELECT setval(
+    pg_get_serial_sequence('t_p8741694_magazin_samp.auth_logs', 'id'),
+    GREATEST((SELECT MAX(id) FROM t_p8741694_magazin_samp.auth_logs_legacy), 1)
+);
+
+DROP TABLE t_p8741694_magazin_samp.auth_logs_legacy;
@@ -0,0 +1,26 @@
+-- Настройки сайта отдельной таблицей вместо колонки site_enabled в каждой строке admins
+CREATE TABLE IF NOT EXISTS t_p8741694_magazin_samp.site_settings (
+    key VARCHAR(100) PRIMARY KEY,
+    value JSONB NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p8741694_magazin_samp.site_settings (key, value)
+SELECT 'site_enabled', to_jsonb(COALESCE((SELECT site_enabled FROM t_p8741694_magazin_samp.admins LIMIT 1), TRUE))
+ON CONFLICT (key) DO NOTHING;
+
+ALTER TABLE t_p8741694_magazin_samp.admins DROP COLUMN IF EXISTS site_enabled;
+
+-- Изменение настройки рассылает её ключ в канал site_settings; экземпляры функций сбрасывают кэш.
+-- NOTIFY доставляется при COMMIT, поэтому слушатели не увидят незафиксированное значение
+CREATE OR REPLACE FUNCTION t_p8741694_magazin_samp.notify_site_settings() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('site_settings', COALESCE(NEW.key, OLD.key));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_site_settings_notify ON t_p8741694_magazin_samp.site_settings;
+CREATE TRIGGER trg_site_settings_notify
+AFTER INSERT OR UPDATE OR DELETE ON t_p8741694_magazin_samp.site_settings
+FOR EACH ROW EXECUTE FUNCTION t_p8741694_magazin_samp.notify_site_settings();
@@ -0,0 +1,18 @@
+-- Ключи для массового импорта каталога: товар узнаётся по внешнему артикулу, фото - по товару и адресу
+ALTER TABLE t_p8741694_magazin_samp.products
+ADD COLUMN IF NOT EXISTS external_id VARCHAR(100);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_products_external_id
+ON t_p8741694_magazin_samp.products (external_id);
+
+-- Повторно добавленные фото одного товара сводятся к самому раннему
+DELETE FROM t_p8741694_magazin_samp.product_images pi
+USING t_p8741694_magazin_samp.product_images older
+WHERE pi.product_id = older.product_id
+  AND pi.image_url = older.image_url
+  AND pi.id > older.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_product_images_product_url
+ON t_p8741694_magazin_samp.product_images (product_id, image_url);
+
+DROP INDEX IF EXISTS t_p8741694_magazin_samp.idx_product_images_product;
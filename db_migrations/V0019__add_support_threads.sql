@@ -0,0 +1,62 @@
+-- Денормализованные счётчики переписки в тикете: список тикетов показывает непрочитанное без подсчёта сообщений
+ALTER TABLE t_p8741694_magazin_samp.support_tickets
+ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS last_message_id INTEGER,
+ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP,
+ADD COLUMN IF NOT EXISTS unread_by_user INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS unread_by_admin INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS user_read_message_id INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS admin_read_message_id INTEGER NOT NULL DEFAULT 0;
+
+-- Существующая переписка считается прочитанной обеими сторонами
+UPDATE t_p8741694_magazin_samp.support_tickets t
+SET message_count = m.message_count,
+    last_message_id = m.last_message_id,
+    last_message_at = m.last_message_at,
+    user_read_message_id = m.last_message_id,
+    admin_read_message_id = m.last_message_id
+FROM (
+    SELECT ticket_id, COUNT(*) AS message_count, MAX(id) AS last_message_id, MAX(created_at) AS last_message_at
+    FROM t_p8741694_magazin_samp.support_messages
+    GROUP BY ticket_id
+) m
+WHERE m.ticket_id = t.id;
+
+-- Каждое сообщение обновляет счётчики тикета в той же транзакции; блокировка строки тикета
+-- упорядочивает их с отметкой о прочтении
+CREATE OR REPLACE FUNCTION t_p8741694_magazin_samp.support_message_counters() RETURNS trigger AS $$
+BEGIN
+    UPDATE t_p8741694_magazin_samp.support_tickets
+    SET message_count = message_count + 1,
+        last_message_id = NEW.id,
+        last_message_at = NEW.created_at,
+        unread_by_user = unread_by_user + CASE WHEN NEW.is_admin THEN 1 ELSE 0 END,
+        unread_by_admin = unread_by_admin + CASE WHEN NEW.is_admin THEN 0 ELSE 1 END,
+        updated_at = NEW.created_at
+    WHERE id = NEW.ticket_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_support_message_counters ON t_p8741694_magazin_samp.support_messages;
+CREATE TRIGGER trg_support_message_counters
+AFTER INSERT ON t_p8741694_magazin_samp.support_messages
+FOR EACH ROW EXECUTE FUNCTION t_p8741694_magazin_samp.support_message_counters();
+
+-- Лента тикета читается по (ticket_id, id > последнего полученного)
+CREATE INDEX IF NOT EXISTS idx_messages_ticket_id
+ON t_p8741694_magazin_samp.support_messages (ticket_id, id);
+DROP INDEX IF EXISTS t_p8741694_magazin_samp.idx_messages_ticket;
+
+-- Keyset-списки тикетов: свои тикеты пользователя, очередь поддержки по статусу и непрочитанные
+CREATE INDEX IF NOT EXISTS idx_tickets_user_created
+ON t_p8741694_magazin_samp.support_tickets (user_id, created_at DESC, id DESC);
+DROP INDEX IF EXISTS t_p8741694_magazin_samp.idx_tickets_user;
+
+CREATE INDEX IF NOT EXISTS idx_tickets_status_created
+ON t_p8741694_magazin_samp.support_tickets (status, created_at DESC, id DESC);
+DROP INDEX IF EXISTS t_p8741694_magazin_samp.idx_tickets_status;
+
+CREATE INDEX IF NOT EXISTS idx_tickets_unread_by_admin
+ON t_p8741694_magazin_samp.support_tickets (created_at DESC, id DESC)
+WHERE unread_by_admin > 0;
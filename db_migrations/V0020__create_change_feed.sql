@@ -0,0 +1,117 @@
+-- Лента изменений для админки и кабинета: триггеры пишут дельты заказов, тикетов и сообщений,
+-- клиент читает события после своего курсора (id) вместо повторной загрузки полных списков
+CREATE TABLE IF NOT EXISTS t_p8741694_magazin_samp.change_events (
+    id BIGSERIAL PRIMARY KEY,
+    topic VARCHAR(20) NOT NULL,
+    op VARCHAR(10) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    user_id INTEGER,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT clock_timestamp()
+);
+
+-- Лента пользователя - только его события; лента поддержки читается по первичному ключу
+CREATE INDEX IF NOT EXISTS idx_change_events_user_id
+ON t_p8741694_magazin_samp.change_events (user_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_change_events_created
+ON t_p8741694_magazin_samp.change_events (created_at);
+
+-- Запись события и NOTIFY в одной транзакции с изменением: слушатели просыпаются только после COMMIT
+CREATE OR REPLACE FUNCTION t_p8741694_magazin_samp.publish_change(
+    p_topic TEXT, p_op TEXT, p_entity_id INTEGER, p_user_id INTEGER, p_payload JSONB
+) RETURNS VOID AS $$
+DECLARE
+    event_id BIGINT;
+BEGIN
+    INSERT INTO t_p8741694_magazin_samp.change_events (topic, op, entity_id, user_id, payload)
+    VALUES (p_topic, p_op, p_entity_id, p_user_id, p_payload)
+    RETURNING id INTO event_id;
+    PERFORM pg_notify('change_feed', event_id::text);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Заказы: статус и сумма без состава заказа, он не меняется после создания
+CREATE OR REPLACE FUNCTION t_p8741694_magazin_samp.orders_change_feed() RETURNS trigger AS $$
+BEGIN
+    PERFORM t_p8741694_magazin_samp.publish_change(
+        'order', lower(TG_OP), NEW.id, NEW.user_id,
+        jsonb_build_object(
+            'id', NEW.id, 'status', NEW.status, 'total_price', NEW.total_price,
+            'user_id', NEW.user_id, 'product_id', NEW.product_id,
+            'created_at', NEW.created_at, 'updated_at', NEW.updated_at
+        )
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_orders_change_feed ON t_p8741694_magazin_samp.orders;
+CREATE TRIGGER trg_orders_change_feed
+AFTER INSERT OR UPDATE ON t_p8741694_magazin_samp.orders
+FOR EACH ROW EXECUTE FUNCTION t_p8741694_magazin_samp.orders_change_feed();
+
+-- Тикеты: статус и счётчики непрочитанного; UPDATE без изменений события не даёт
+CREATE OR REPLACE FUNCTION t_p8741694_magazin_samp.support_tickets_change_feed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND (OLD.status, OLD.priority, OLD.message_count, OLD.unread_by_user, OLD.unread_by_admin)
+        IS NOT DISTINCT FROM (NEW.status, NEW.priority, NEW.message_count, NEW.unread_by_user, NEW.unread_by_admin) THEN
+        RETURN NULL;
+    END IF;
+    PERFORM t_p8741694_magazin_samp.publish_change(
+        'ticket', lower(TG_OP), NEW.id, NEW.user_id,
+        jsonb_build_object(
+            'id', NEW.id, 'subject', NEW.subject, 'status', NEW.status, 'priority', NEW.priority,
+            'message_count', NEW.message_count, 'last_message_id', NEW.last_message_id,
+            'last_message_at', NEW.last_message_at, 'unread_by_user', NEW.unread_by_user,
+            'unread_by_admin', NEW.unread_by_admin, 'updated_at', NEW.updated_at
+        )
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_support_tickets_change_feed ON t_p8741694_magazin_samp.support_tickets;
+CREATE TRIGGER trg_support_tickets_change_feed
+AFTER INSERT OR UPDATE ON t_p8741694_magazin_samp.support_tickets
+FOR EACH ROW EXECUTE FUNCTION t_p8741694_magazin_samp.support_tickets_change_feed();
+
+-- Сообщения: событие адресуется владельцу тикета и несёт текст, чтобы клиент дописал ленту без запроса
+CREATE OR REPLACE FUNCTION t_p8741694_magazin_samp.support_messages_change_feed() RETURNS trigger AS $$
+BEGIN
+    PERFORM t_p8741694_magazin_samp.publish_change(
+        'message', 'insert', NEW.id,
+        (SELECT user_id FROM t_p8741694_magazin_samp.support_tickets WHERE id = NEW.ticket_id),
+        jsonb_build_object(
+            'id', NEW.id, 'ticket_id', NEW.ticket_id, 'message', NEW.message,
+            'is_admin', NEW.is_admin, 'created_at', NEW.created_at
+        )
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_support_messages_change_feed ON t_p8741694_magazin_samp.support_messages;
+CREATE TRIGGER trg_support_messages_change_feed
+AFTER INSERT ON t_p8741694_magazin_samp.support_messages
+FOR EACH ROW EXECUTE FUNCTION t_p8741694_magazin_samp.support_messages_change_feed();
+
+-- Чистка старых событий; последнее событие остаётся, чтобы по MIN(id) отличать устаревший курсор
+CREATE OR REPLACE FUNCTION t_p8741694_magazin_samp.prune_change_events(
+    retention INTERVAL, batch_size INTEGER DEFAULT 5000
+) RETURNS INTEGER AS $$
+DECLARE
+    deleted INTEGER;
+BEGIN
+    DELETE FROM t_p8741694_magazin_samp.change_events
+    WHERE id IN (
+        SELECT id FROM t_p8741694_magazin_samp.change_events
+        WHERE created_at < clock_timestamp() - retention
+          AND id < (SELECT MAX(id) FROM t_p8741694_magazin_samp.change_events)
+        ORDER BY id
+        LIMIT batch_size
+    );
+    GET DIAGNOSTICS deleted = ROW_COUNT;
+    RETURN deleted;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,31 @@
+-- Регистрация через /start делает INSERT ... ON CONFLICT (telegram_id): нужен уникальный индекс.
+-- V0005 добавлял UNIQUE вместе со столбцом, но ADD COLUMN IF NOT EXISTS пропускал его, если столбец уже был
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = 't_p8741694_magazin_samp.users'::regclass
+          AND i.indisunique AND i.indnkeyatts = 1 AND i.indpred IS NULL
+          AND a.attname = 'telegram_id'
+    ) THEN
+        -- Дубли от гонки /start: Telegram остаётся за самым старым аккаунтом, остальные отвязываются
+        UPDATE t_p8741694_magazin_samp.users u
+        SET telegram_id = NULL
+        WHERE u.telegram_id IS NOT NULL
+          AND EXISTS (
+              SELECT 1 FROM t_p8741694_magazin_samp.users o
+              WHERE o.telegram_id = u.telegram_id AND o.id < u.id
+          );
+        CREATE UNIQUE INDEX uq_users_telegram_id ON t_p8741694_magazin_samp.users (telegram_id);
+    END IF;
+END;
+$$;
+
+-- Обработанные update_id: повторная доставка того же обновления отбрасывается в транзакции обработки.
+-- MAX(update_id) - отметка, с которой продолжает getUpdates; старые id чистятся за окном
+CREATE TABLE IF NOT EXISTS t_p8741694_magazin_samp.telegram_updates (
+    update_id BIGINT PRIMARY KEY,
+    processed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,4 @@
+-- Сумма заказа с копейками: покупка с баланса списывает точную NUMERIC-цену товара,
+-- и заказ должен совпадать с записью в balance_ledger, а не с округлённой суммой
+ALTER TABLE t_p8741694_magazin_samp.orders
+ALTER COLUMN total_price TYPE NUMERIC(12, 2) USING total_price::NUMERIC(12, 2);
@@ -1,3 +1,4 @@
+import { Button } from '@/components/ui/button';
 import { Card, CardContent } from '@/components/ui/card';
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@/components/ui/table';
 
@@ -12,9 +13,11 @@ interface Order {
 
 interface OrdersTabProps {
   orders: Order[];
+  hasMore?: boolean;
+  onLoadMore?: () => void;
 }
 
-const OrdersTab = ({ orders }: OrdersTabProps) => {
+const OrdersTab = ({ orders, hasMore, onLoadMore }: OrdersTabProps) => {
   return (
     <div className="space-y-4">
       <h2 className="text-2xl font-bold">Все заказы</h2>
@@ -58,6 +61,13 @@ const OrdersTab = ({ orders }: OrdersTabProps) => {
           </Table>
         </CardContent>
       </Card>
+      {hasMore && onLoadMore && (
+        <div className="flex justify-center">
+          <Button variant="outline" onClick={onLoadMore}>
+            Загрузить ещё
+          </Button>
+        </div>
+      )}
     </div>
   );
 };
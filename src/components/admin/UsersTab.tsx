@@ -24,10 +24,14 @@ interface UsersTabProps {
   };
   onUsersChange: () => void;
   usersApi: string;
+  hasMore?: boolean;
+  onLoadMore?: () => void;
+  onSearch?: (search: string) => void;
 }
 
-const UsersTab = ({ users, stats, onUsersChange, usersApi }: UsersTabProps) => {
+const UsersTab = ({ users, stats, onUsersChange, usersApi, hasMore, onLoadMore, onSearch }: UsersTabProps) => {
   const { toast } = useToast();
+  const [search, setSearch] = useState('');
   const [balanceDialogOpen, setBalanceDialogOpen] = useState(false);
   const [selectedUser, setSelectedUser] = useState<User | null>(null);
   const [balanceAmount, setBalanceAmount] = useState('');
@@ -119,6 +123,26 @@ const UsersTab = ({ users, stats, onUsersChange, usersApi }: UsersTabProps) => {
         </div>
       </div>
 
+      {onSearch && (
+        <form
+          className="flex gap-2"
+          onSubmit={(e) => {
+            e.preventDefault();
+            onSearch(search.trim());
+          }}
+        >
+          <Input
+            placeholder="Поиск по имени, Telegram или email"
+            value={search}
+            onChange={(e) => setSearch(e.target.value)}
+          />
+          <Button type="submit" variant="outline">
+            <Icon name="Search" className="mr-2" size={16} />
+            Найти
+          </Button>
+        </form>
+      )}
+
       <Card>
         <CardContent className="p-6">
           <Table>
@@ -180,6 +204,14 @@ const UsersTab = ({ users, stats, onUsersChange, usersApi }: UsersTabProps) => {
         </CardContent>
       </Card>
 
+      {hasMore && onLoadMore && (
+        <div className="flex justify-center">
+          <Button variant="outline" onClick={onLoadMore}>
+            Загрузить ещё
+          </Button>
+        </div>
+      )}
+
       <Dialog open={balanceDialogOpen} onOpenChange={setBalanceDialogOpen}>
         <DialogContent>
           <DialogHeader>
@@ -30,6 +30,17 @@ interface Order {
   created_at: string;
 }
 
+interface OrderStats {
+  total_orders: number;
+  total_revenue: number;
+  pending_orders: number;
+}
+
+interface UserStats {
+  total_users: number;
+  active_users: number;
+}
+
 interface User {
   id: number;
   username: string;
@@ -70,7 +81,12 @@ const Admin = () => {
 
   const [products, setProducts] = useState<Product[]>([]);
   const [orders, setOrders] = useState<Order[]>([]);
+  const [ordersCursor, setOrdersCursor] = useState<string | null>(null);
+  const [orderStats, setOrderStats] = useState<OrderStats | null>(null);
   const [users, setUsers] = useState<User[]>([]);
+  const [usersCursor, setUsersCursor] = useState<string | null>(null);
+  const [usersSearch, setUsersSearch] = useState('');
+  const [userStats, setUserStats] = useState<UserStats | null>(null);
   const [admins, setAdmins] = useState<AdminUser[]>([]);
   const [authLogs, setAuthLogs] = useState<AuthLog[]>([]);
   const [isLoading, setIsLoading] = useState(true);
@@ -82,7 +98,9 @@ const Admin = () => {
     } else {
       fetchProducts();
       fetchOrders();
+      fetchOrderStats();
       fetchUsers();
+      fetchUserStats();
       fetchAdmins();
       fetchAuthLogs();
     }
@@ -105,21 +123,40 @@ const Admin = () => {
     }
   };
 
-  const fetchOrders = async () => {
+  // Заказы приходят страницами по next_cursor; сводка по всем заказам считается на сервере
+  const fetchOrders = async (cursor?: string) => {
     try {
-      const response = await fetch(ORDERS_API);
+      const url = cursor ? `${ORDERS_API}?cursor=${encodeURIComponent(cursor)}` : ORDERS_API;
+      const response = await fetch(url);
       const data = await response.json();
-      setOrders(data.orders);
+      setOrders(prev => (cursor ? [...prev, ...data.orders] : data.orders));
+      setOrdersCursor(data.next_cursor ?? null);
     } catch (error) {
       console.error('Ошибка загрузки заказов:', error);
     }
   };
 
-  const fetchUsers = async () => {
+  const fetchOrderStats = async () => {
     try {
-      const response = await fetch(USERS_API);
+      const response = await fetch(`${ORDERS_API}?action=stats`);
       const data = await response.json();
-      setUsers(data);
+      setOrderStats(data.stats);
+    } catch (error) {
+      console.error('Ошибка загрузки статистики заказов:', error);
+    }
+  };
+
+  // Пользователи, как и заказы, приходят страницами по next_cursor; поиск идёт на сервере
+  const fetchUsers = async (cursor?: string, search: string = usersSearch) => {
+    try {
+      const params = new URLSearchParams();
+      if (cursor) params.set('cursor', cursor);
+      if (search) params.set('search', search);
+      const query = params.toString();
+      const response = await fetch(query ? `${USERS_API}?${query}` : USERS_API);
+      const data = await response.json();
+      setUsers(prev => (cursor ? [...prev, ...data.users] : data.users));
+      setUsersCursor(data.next_cursor ?? null);
     } catch (error) {
       console.error('Ошибка загрузки пользователей:', error);
       toast({
@@ -130,6 +167,26 @@ const Admin = () => {
     }
   };
 
+  const fetchUserStats = async () => {
+    try {
+      const response = await fetch(`${USERS_API}?action=user_stats`);
+      const data = await response.json();
+      setUserStats(data.stats);
+    } catch (error) {
+      console.error('Ошибка загрузки статистики пользователей:', error);
+    }
+  };
+
+  const searchUsers = (search: string) => {
+    setUsersSearch(search);
+    fetchUsers(undefined, search);
+  };
+
+  const refreshUsers = () => {
+    fetchUsers();
+    fetchUserStats();
+  };
+
   const fetchAdmins = async () => {
     try {
       const response = await fetch(ADMINS_API);
@@ -160,12 +217,12 @@ const Admin = () => {
   };
 
   const stats = {
-    totalOrders: orders.length,
-    totalRevenue: orders.reduce((sum, order) => sum + order.total_price, 0),
+    totalOrders: orderStats?.total_orders ?? 0,
+    totalRevenue: Number(orderStats?.total_revenue ?? 0),
     totalProducts: products.length,
-    pendingOrders: orders.filter(o => o.status === 'В обработке').length,
-    totalUsers: users.length,
-    activeUsers: users.filter(u => u.status === 'active').length
+    pendingOrders: orderStats?.pending_orders ?? 0,
+    totalUsers: userStats?.total_users ?? 0,
+    activeUsers: userStats?.active_users ?? 0
   };
 
   return (
@@ -212,14 +269,21 @@ const Admin = () => {
           </TabsContent>
 
           <TabsContent value="orders">
-            <OrdersTab orders={orders} />
+            <OrdersTab 
+              orders={orders} 
+              hasMore={ordersCursor !== null} 
+              onLoadMore={() => ordersCursor && fetchOrders(ordersCursor)}
+            />
           </TabsContent>
 
           <TabsContent value="users">
             <UsersTab 
               users={users} 
               stats={{ totalUsers: stats.totalUsers, activeUsers: stats.activeUsers }}
-              onUsersChange={fetchUsers} 
+              onUsersChange={refreshUsers} 
+              hasMore={usersCursor !== null}
+              onLoadMore={() => usersCursor && fetchUsers(usersCursor)}
+              onSearch={searchUsers}
               usersApi={USERS_API}
             />
           </TabsContent>